@@ -4,6 +4,9 @@ PY2 = sys.version_info[0] == 2
 
 if PY2:
     from ConfigParser import ConfigParser
+    from Queue import Empty
+    from Queue import Full
+    from Queue import Queue
     from StringIO import StringIO
     import cPickle as pickle
     import __builtin__ as builtins
@@ -13,9 +16,15 @@ if PY2:
     def chain_exception(exc1, exc2):
         exec("raise exc1, None, sys.exc_info()[2]")
 
+    def reraise(tp, value, tb):
+        exec("raise tp, value, tb")
+
 else:
     from configparser import ConfigParser
     from io import StringIO
+    from queue import Empty
+    from queue import Full
+    from queue import Queue
     import pickle as pickle
     import builtins
 
@@ -24,5 +33,8 @@ else:
     def chain_exception(exc1, exc2):
         exec("raise exc1 from exc2")
 
+    def reraise(tp, value, tb):
+        raise value.with_traceback(tb)
+
 
 
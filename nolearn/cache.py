@@ -8,16 +8,24 @@ functions between runs.
 Python's :mod:`pickle` is used to serialize data.  All cache files go
 into the `cache/` directory inside your working directory.
 
+The cache directory isn't limited in size by default.  See
+:class:`CacheDir` for how to limit it, and how to get hit rates:
+
+.. code-block:: python
+
+    cache_dir().max_bytes = 50 * 1024 ** 3
+    cache_dir().stats()
+
 `@cached` uses a cache key function to find out if it has the value
 for some given function arguments cached on disk.  The way it
-calculates that cache key by default is to simply use the string
-representation of all arguments passed into the function.  Thus, the
-default cache key function looks like this:
+calculates that cache key by default is to hash the contents of all
+arguments passed into the function with :func:`structural_hash`.
+Thus, the default cache key function looks like this:
 
 .. code-block:: python
 
     def default_cache_key(*args, **kwargs):
-        return str(args) + str(sorted(kwargs.items()))
+        return structural_hash((args, kwargs))
 
 Here is an example use of the :func:`cached` decorator:
 
@@ -43,17 +51,13 @@ for a cache decorator used with a `transform` method of a scikit-learn
 .. doctest::
 
     >>> def transform_cache_key(self, X):
-    ...     return ','.join([
-    ...         str(X[:20]),
-    ...         str(X[-20:]),
-    ...         str(X.shape),
-    ...         str(sorted(self.get_params().items())),
-    ...         ])
-
-This function puts the first and the last twenty rows of the matrix
-`X` into the cache key.  On top of that, it adds the shape of the
-matrix `X.shape` along with the items in `self.get_params`, which with
-a scikit-learn :class:`~sklearn.base.BaseEstimator` class is the
+    ...     return structural_hash(
+    ...         (X, self.get_params()), max_bytes=16 * 1024 ** 2)
+
+This function hashes the matrix `X`, but for matrices larger than
+16 MB only a sample of evenly spaced rows, along with its shape and
+dtype.  On top of that, it adds the items in `self.get_params`, which
+with a scikit-learn :class:`~sklearn.base.BaseEstimator` class is the
 dictionary of model parameters.  This makes sure that even though the
 input matrix is the same, it will still calculate the value again if
 the value of `self.get_params()` is different.
@@ -68,15 +72,23 @@ Your estimator class can then use the decorator like so:
             # ...
 """
 
+import atexit
 from functools import wraps
 import hashlib
+import json
 import logging
 import random
 import os
+import re
+import shutil
 import string
+from time import time
 import traceback
 
 from joblib import numpy_pickle
+import numpy as np
+
+from ._compat import basestring
 
 
 CACHE_PATH = 'cache/'
@@ -86,15 +98,424 @@ if not os.path.exists(CACHE_PATH):  # pragma: no cover
 logger = logging.getLogger(__name__)
 
 
+def _update_bytes(h, tag, data):
+    h.update(tag + str(len(data)).encode('ascii') + b':')
+    h.update(data)
+
+
+def _update_array(h, arr, max_bytes):
+    _update_bytes(h, b'a', (arr.dtype.str + repr(arr.shape)).encode('ascii'))
+    if arr.dtype.hasobject:
+        for item in arr.flat:
+            _update(h, item, max_bytes)
+        return
+
+    if max_bytes is not None and arr.ndim and arr.nbytes > max_bytes:
+        n_rows = max(int(max_bytes * len(arr) // arr.nbytes), 1)
+        arr = arr[np.unique(np.linspace(0, len(arr) - 1, n_rows).astype(int))]
+
+    # Non-contiguous arrays are copied one row at a time:
+    rows = arr if arr.ndim > 1 and not arr.flags.c_contiguous else [arr]
+    for row in rows:
+        h.update(np.ascontiguousarray(row).reshape(-1).view(np.uint8))
+
+
+def _update(h, obj, max_bytes):
+    if isinstance(obj, np.ndarray):
+        _update_array(h, obj, max_bytes)
+    elif isinstance(obj, np.generic):
+        _update_array(h, np.asarray(obj), max_bytes)
+    elif isinstance(obj, bytes):
+        _update_bytes(h, b's', obj)
+    elif isinstance(obj, basestring):
+        _update_bytes(h, b's', obj.encode('utf-8'))
+    elif isinstance(obj, (list, tuple)):
+        _update_bytes(h, b'l', b'')
+        h.update(str(len(obj)).encode('ascii'))
+        for item in obj:
+            _update(h, item, max_bytes)
+    elif isinstance(obj, dict):
+        _update_bytes(h, b'd', b'')
+        h.update(str(len(obj)).encode('ascii'))
+        for key in sorted(obj, key=repr):
+            _update(h, key, max_bytes)
+            _update(h, obj[key], max_bytes)
+    else:
+        _update_bytes(h, b'r', repr(obj).encode('utf-8'))
+
+
+def structural_hash(obj, max_bytes=None):
+    """Returns a hex digest of the contents of `obj`.
+
+    NumPy arrays are hashed by their dtype, shape and raw data, which
+    is streamed into the hash without building a string
+    representation.  Lists, tuples and dicts are hashed item by item,
+    and strings by their UTF-8 encoding.  Anything else is hashed by
+    its `repr`.
+
+    :param max_bytes: If given, of arrays larger than this only a
+                      sample of evenly spaced rows of about this size
+                      is hashed, along with their dtype and shape.
+    """
+    h = hashlib.sha1()
+    _update(h, obj, max_bytes)
+    return h.hexdigest()
+
+
 def default_cache_key(*args, **kwargs):
-    return str(args) + str(sorted(kwargs.items()))
+    return structural_hash((args, kwargs))
 
 
 class DontCache(Exception):
     pass
 
 
-def cached(cache_key=default_cache_key, cache_path=None):
+_COUNTERS = ('hits', 'misses', 'bytes_read', 'bytes_written', 'evictions')
+
+# Cache files, and the companion files that older versions of joblib
+# write arrays to when values are dumped uncompressed:
+_CACHE_FILE = re.compile(r'^(.+-cache-[0-9a-f]+)(_\d+\.npy(?:\.z)?)?$')
+
+
+class CacheDir(object):
+    """Keeps track of the files in a cache directory, and evicts
+    files when it grows too large or they grow too old.
+
+    An index of all cache files with their size, creation and last
+    access time, and counters of hits, misses, bytes read and written
+    and evictions are kept in a JSON file `index.json` inside the
+    directory.  Cache files that aren't in the index yet, e.g. because
+    they were written by an older version, are added when the index
+    is next pruned or its stats are read.
+
+    Lookups and writes are recorded in memory, and written to the
+    index in one go every `flush_every` updates, after
+    `flush_interval` seconds, and at exit.  The size and age limits
+    are enforced then, too.  When several processes use the same
+    directory at the same time, their updates are merged into the
+    index as it is on disk when they flush; only updates that two
+    processes flush at the very same time may get lost.
+
+    :func:`cached` uses the :class:`CacheDir` that :func:`cache_dir`
+    returns for its `cache_path`.  Use that to set limits:
+
+    .. code-block:: python
+
+        cache_dir().max_bytes = 50 * 1024 ** 3
+        cache_dir().stats()
+    """
+    index_name = 'index.json'
+
+    def __init__(self, path, max_bytes=None, max_age=None, policy='lru',
+                 flush_every=100, flush_interval=60):
+        """
+        :param path: The cache directory.
+
+        :param max_bytes: If given, evict files whenever one is added
+                          until all files take up at most this many
+                          bytes.
+
+        :param max_age: If given, evict files that were written more
+                        than this many seconds ago.  Lookups of such
+                        files are misses.
+
+        :param policy: Which files to evict first to stay within
+                       `max_bytes`: `'lru'` for the ones least recently
+                       used, `'age'` for the ones written first.
+
+        :param flush_every: Write the index after this many updates.
+                            With `max_bytes` or `max_age`, files that
+                            are added are written to the index right
+                            away, so that the limits are kept.
+
+        :param flush_interval: If given, also write the index when
+                               this many seconds have passed since the
+                               last time.
+        """
+        if policy not in ('lru', 'age'):
+            raise ValueError(
+                "Unknown policy {!r}; must be 'lru' or 'age'.".format(policy))
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.policy = policy
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._reset_pending()
+        atexit.register(self.flush)
+
+    @property
+    def index_path(self):
+        return os.path.join(self.path, self.index_name)
+
+    def _load(self):
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except (IOError, OSError, ValueError):
+            index = {}
+        index.setdefault('entries', {})
+        for name in _COUNTERS:
+            index.setdefault(name, 0)
+        return index
+
+    def _dump(self, index):
+        tmp_path = '{}-{}.tmp'.format(
+            self.index_path,
+            ''.join(random.sample(string.ascii_letters, 4)),
+            )
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(index, f)
+            os.rename(tmp_path, self.index_path)
+        except (IOError, OSError):
+            logger.exception(
+                "Writing cache index {} failed".format(self.index_path))
+
+    def _list(self):
+        """Returns a dict that maps the name of each cache file in
+        the directory to a list of the names of its companion files.
+        """
+        files = {}
+        for name in sorted(os.listdir(self.path)):
+            match = _CACHE_FILE.match(name)
+            if match is not None:
+                files.setdefault(match.group(1), [])
+                if match.group(2):
+                    files[match.group(1)].append(name)
+        return files
+
+    def _size(self, names):
+        return sum(
+            os.path.getsize(os.path.join(self.path, name)) for name in names)
+
+    def _sync(self, index):
+        """Brings the entries of `index` in line with the files in
+        the directory, and returns what :meth:`_list` returns.
+        """
+        entries = index['entries']
+        files = self._list()
+        for name in set(entries) - set(files):
+            del entries[name]
+        for name in set(files) - set(entries):
+            if not os.path.exists(os.path.join(self.path, name)):
+                continue  # companion files without their cache file
+            mtime = os.path.getmtime(os.path.join(self.path, name))
+            entries[name] = {
+                'size': self._size([name] + files[name]),
+                'created': mtime,
+                'accessed': mtime,
+                }
+        return files
+
+    def _reset_pending(self):
+        self._pending = {
+            'counters': dict.fromkeys(_COUNTERS, 0),
+            'accessed': {},
+            'read': {},
+            'added': {},
+            }
+        self._n_pending = 0
+        self._last_flush = time()
+
+    def _updated(self):
+        self._n_pending += 1
+        if self._n_pending >= self.flush_every or (
+                self.flush_interval is not None and
+                time() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def expired(self, filename):
+        """Returns whether `filename` was written more than `max_age`
+        seconds ago.
+        """
+        if self.max_age is None:
+            return False
+        try:
+            return time() - os.path.getmtime(filename) > self.max_age
+        except OSError:
+            return True
+
+    def hit(self, filename):
+        """Records a cache hit on `filename`.
+        """
+        pending = self._pending
+        name = os.path.basename(filename)
+        pending['accessed'][name] = time()
+        pending['read'][name] = pending['read'].get(name, 0) + 1
+        pending['counters']['hits'] += 1
+        self._updated()
+
+    def miss(self, filename):
+        """Records a cache miss on `filename`.
+        """
+        self._pending['counters']['misses'] += 1
+        self._updated()
+
+    def add(self, filename, names=None):
+        """Records that `filename` was written.
+
+        :param names: The names of the files that were written, i.e.
+                      of `filename` and its companion files, if
+                      known.  Otherwise they're looked up in the
+                      directory.
+        """
+        now = time()
+        name = os.path.basename(filename)
+        if names is None:
+            names = [name] + self._list().get(name, [])
+        size = self._size(names)
+        self._pending['added'][name] = {
+            'size': size,
+            'created': now,
+            'accessed': now,
+            }
+        self._pending['accessed'].pop(name, None)
+        self._pending['read'].pop(name, None)
+        self._pending['counters']['bytes_written'] += size
+        if self.max_bytes is not None or self.max_age is not None:
+            self._n_pending += 1
+            self.flush()
+        else:
+            self._updated()
+
+    def flush(self):
+        """Writes the updates recorded since the last flush to the
+        index, and evicts files if there's a limit.
+        """
+        if not self._n_pending:
+            return
+        pending = self._pending
+        self._reset_pending()
+
+        index = self._load()
+        entries = index['entries']
+        entries.update(pending['added'])
+        for name, accessed in pending['accessed'].items():
+            if name in entries:
+                entries[name]['accessed'] = max(
+                    entries[name]['accessed'], accessed)
+        for name, count in pending['read'].items():
+            if name in entries:
+                index['bytes_read'] += entries[name]['size'] * count
+        for name, value in pending['counters'].items():
+            index[name] += value
+        if self.max_bytes is not None or self.max_age is not None:
+            self._prune(index, self.max_bytes, self.max_age)
+        self._dump(index)
+
+    def _prune(self, index, max_bytes, max_age):
+        files = self._sync(index)
+        entries = index['entries']
+        evict = []
+        if max_age is not None:
+            now = time()
+            evict.extend(
+                name for name, entry in entries.items()
+                if now - entry['created'] > max_age)
+
+        if max_bytes is not None:
+            by = 'accessed' if self.policy == 'lru' else 'created'
+            keep = sorted(
+                (entry[by], name) for name, entry in entries.items()
+                if name not in evict)
+            total = sum(entries[name]['size'] for _, name in keep)
+            for _, name in keep:
+                if total <= max_bytes:
+                    break
+                total -= entries[name]['size']
+                evict.append(name)
+
+        for name in evict:
+            # The cache file goes first, so that it's never found
+            # without its companion files:
+            for fname in [name] + files.get(name, []):
+                try:
+                    os.remove(os.path.join(self.path, fname))
+                except OSError:
+                    pass
+            del entries[name]
+            index['evictions'] += 1
+            logger.debug(" * cache evict: {}".format(name))
+        return evict
+
+    def prune(self, max_bytes=None, max_age=None):
+        """Evicts files until the directory is within `max_bytes` and
+        no file is older than `max_age`, which default to the limits
+        this was created with.  Returns the names of evicted files.
+        """
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        if max_age is None:
+            max_age = self.max_age
+        self.flush()
+        index = self._load()
+        evicted = self._prune(index, max_bytes, max_age)
+        self._dump(index)
+        return evicted
+
+    def stats(self):
+        """Returns a dict with the counters, along with the number
+        of files `n_entries`, their total size `bytes`, and the
+        `hit_rate`.
+        """
+        self.flush()
+        index = self._load()
+        self._sync(index)
+        stats = dict((name, index[name]) for name in _COUNTERS)
+        stats['n_entries'] = len(index['entries'])
+        stats['bytes'] = sum(
+            entry['size'] for entry in index['entries'].values())
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = float(stats['hits']) / lookups if lookups else 0.
+        return stats
+
+
+_cache_dirs = {}
+
+
+def cache_dir(path=None):
+    """Returns the :class:`CacheDir` for `path`, which defaults to
+    `CACHE_PATH`.  There's one per path and process, created with no
+    limits on first use.
+    """
+    path = path or CACHE_PATH
+    key = os.path.abspath(path)
+    if key not in _cache_dirs:
+        _cache_dirs[key] = CacheDir(path)
+    return _cache_dirs[key]
+
+
+def _move_dumped(src, dst, name):
+    # Companion files are named after the final name already, and are
+    # moved before the cache file that refers to them:
+    names = sorted(fname for fname in os.listdir(src) if fname != name)
+    for fname in names:
+        os.rename(os.path.join(src, fname), os.path.join(dst, fname))
+    os.rename(os.path.join(src, name), os.path.join(dst, name))
+    return [name] + names
+
+
+def cached(cache_key=default_cache_key, cache_path=None, compress=9,
+           mmap_mode=None):
+    """Returns a decorator that caches the return values of a
+    function on disk, see above.
+
+    :param cache_key: The cache key function.
+
+    :param cache_path: The cache directory; defaults to `CACHE_PATH`.
+
+    :param compress: The compression of cache files, as in
+                     :func:`joblib.dump`: a zlib level from `0` to
+                     `9`, or with newer versions of joblib a
+                     `(codec, level)` tuple.  Large arrays are much
+                     faster to write with a low level, or with `0`.
+
+    :param mmap_mode: If given, e.g. `'r'`, arrays in uncompressed
+                      cache files are memory-mapped on a cache hit
+                      instead of read into memory, as in
+                      :func:`joblib.load`.
+    """
     def cached(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
@@ -106,35 +527,54 @@ def cached(cache_key=default_cache_key, cache_path=None):
             except DontCache:
                 return func(*args, **kwargs)
 
-            hashed_key = hashlib.sha1(key).hexdigest()[:8]
+            hashed_key = hashlib.sha1(key).hexdigest()
 
             # We construct the filename using the cache key.  If the
             # file exists, unpickle and return the value.
+            directory = cache_dir(cache_path)
             filename = os.path.join(
-                cache_path or CACHE_PATH,
+                directory.path,
                 '{}.{}-cache-{}'.format(
                     func.__module__, func.__name__, hashed_key))
 
-            if os.path.exists(filename):
-                filesize = os.path.getsize(filename)
-                size = "%0.1f MB" % (filesize / (1024 * 1024.0))
-                logger.debug(" * cache hit: {} ({})".format(filename, size))
-                return numpy_pickle.load(filename)
-            else:
-                logger.debug(" * cache miss: {}".format(filename))
-                value = func(*args, **kwargs)
-                tmp_filename = '{}-{}.tmp'.format(
-                    filename,
-                    ''.join(random.sample(string.ascii_letters, 4)),
-                    )
+            if os.path.exists(filename) and not directory.expired(filename):
                 try:
-                    numpy_pickle.dump(value, tmp_filename, compress=9)
-                    os.rename(tmp_filename, filename)
-                except Exception:
-                    logger.exception(
-                        "Saving pickle {} resulted in Exception".format(
-                        filename))
-                return value
+                    filesize = os.path.getsize(filename)
+                    size = "%0.1f MB" % (filesize / (1024 * 1024.0))
+                    logger.debug(
+                        " * cache hit: {} ({})".format(filename, size))
+                    value = numpy_pickle.load(filename, mmap_mode=mmap_mode)
+                except (IOError, OSError):
+                    # Evicted by another process in the meantime:
+                    logger.debug(" * cache gone: {}".format(filename))
+                else:
+                    directory.hit(filename)
+                    return value
+
+            logger.debug(" * cache miss: {}".format(filename))
+            directory.miss(filename)
+            value = func(*args, **kwargs)
+            # Dump into a temporary directory first, since joblib may
+            # write arrays to companion files next to the cache file:
+            tmp_dirname = '{}-{}.tmp'.format(
+                filename,
+                ''.join(random.sample(string.ascii_letters, 4)),
+                )
+            name = os.path.basename(filename)
+            try:
+                os.mkdir(tmp_dirname)
+                numpy_pickle.dump(
+                    value, os.path.join(tmp_dirname, name),
+                    compress=compress)
+                names = _move_dumped(tmp_dirname, directory.path, name)
+                directory.add(filename, names)
+            except Exception:
+                logger.exception(
+                    "Saving pickle {} resulted in Exception".format(
+                    filename))
+            finally:
+                shutil.rmtree(tmp_dirname, ignore_errors=True)
+            return value
 
         wrapper.uncached = func
         return wrapper
@@ -15,21 +15,18 @@ from .util import ChunkedTransform
 def _forward_cache_key(self, X):
     if len(X) == 1:
         raise cache.DontCache
-    return ','.join([
-        str(X),
+    return cache.structural_hash((
+        X,
         self.model_def,
         self.pretrained_model,
         self.oversample,
-        ])
+        ))
 
 
 def _transform_cache_key(self, X):
     if len(X) == 1 or not isinstance(X[0], str):
         raise cache.DontCache
-    return ','.join([
-        str(X),
-        str(sorted(self.get_params().items())),
-        ])
+    return cache.structural_hash((X, self.get_params()))
 
 
 def _prepare_image(cls, image, oversample='center_only'):
@@ -9,11 +9,7 @@ from sklearn.base import BaseEstimator
 def _transform_cache_key(self, X):
     if len(X) == 1:
         raise cache.DontCache
-    return ','.join([
-        str(X),
-        str(len(X)),
-        str(sorted(self.get_params().items())),
-        ])
+    return cache.structural_hash((X, self.get_params()))
 
 
 class ConvNetFeatures(BaseEstimator):
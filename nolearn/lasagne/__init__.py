@@ -1,3 +1,7 @@
+from .accounts import (
+    MemmapAccountStore,
+    PickleAccountStore,
+    )
 from .handlers import (
     PrintLayerInfo,
     PrintLog,
@@ -5,9 +9,21 @@ from .handlers import (
     SaveWeights,
     WeightLog,
     )
+from .sinks import (
+    CSVSink,
+    MemorySink,
+    NpySink,
+    )
+from .timing import PhaseTimer
 from .base import (
     BatchIterator,
     objective,
     NeuralNet,
+    PrefetchingBatchIterator,
     TrainSplit,
     )
+from .cross_validation import CrossValidation
+from .search import (
+    HyperbandSearch,
+    SuccessiveHalvingSearch,
+    )
@@ -0,0 +1,338 @@
+from collections import OrderedDict
+import os
+
+import numpy as np
+
+from .._compat import pickle
+
+
+def _params_nbytes(params):
+    nbytes = 0
+    for W, b in params.values():
+        nbytes += W.nbytes
+        if b is not None:
+            nbytes += b.nbytes
+    return nbytes
+
+
+class AccountWeightCache(object):
+    """A bounded, write-back LRU cache of per-account parameter sets.
+
+    Parameter sets are ordered dicts that map the names of the account
+    weight layers to ``(W, b)`` tuples of arrays.  Entries are read
+    through `load` on a miss; entries stored with :meth:`put` are only
+    written through `save` when they are evicted, or when
+    :meth:`flush` is called.
+    """
+    def __init__(self, load, save, max_bytes):
+        """
+        :param load: Callable that takes an account key and returns
+                     its parameter set.
+
+        :param save: Callable that takes an account key and a
+                     parameter set and persists it.
+
+        :param max_bytes: The memory budget of the cache in bytes.
+                          The most recently used entry is always
+                          kept, even if it alone exceeds the budget.
+        """
+        self.load = load
+        self.save = save
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self.reset_counters()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, k):
+        return k in self._entries
+
+    def get(self, k):
+        entry = self._entries.pop(k, None)
+        if entry is None:
+            self.misses += 1
+            params = self.load(k)
+            entry = [params, False, _params_nbytes(params)]
+            self.nbytes += entry[2]
+            self._entries[k] = entry
+            self._evict()
+        else:
+            self.hits += 1
+            self._entries[k] = entry
+        return entry[0]
+
+    def put(self, k, params):
+        entry = self._entries.pop(k, None)
+        if entry is not None:
+            self.nbytes -= entry[2]
+        entry = [params, True, _params_nbytes(params)]
+        self.nbytes += entry[2]
+        self._entries[k] = entry
+        self._evict()
+
+    def flush(self):
+        for k, entry in self._entries.items():
+            if entry[1]:
+                self.save(k, entry[0])
+                entry[1] = False
+                self.flushes += 1
+
+    def clear(self):
+        self.flush()
+        self._entries.clear()
+        self.nbytes = 0
+
+    def counters(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'flushes': self.flushes,
+            }
+
+    def reset_counters(self):
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            k, (params, dirty, nbytes) = self._entries.popitem(last=False)
+            self.nbytes -= nbytes
+            if dirty:
+                self.save(k, params)
+                self.flushes += 1
+
+
+class PickleAccountStore(object):
+    """Keeps the weights of each account in a pickle file of its own.
+
+    Files are named ``<prefix><k>.pkl``, and ``<prefix><k>_loss_prms.pkl``
+    for the weights with the best loss.
+    """
+    def __init__(self, prefix):
+        self.prefix = prefix
+
+    def _path(self, k, best=False):
+        suffix = '_loss_prms.pkl' if best else '.pkl'
+        return self.prefix + str(k) + suffix
+
+    def load(self, k, names, best=False):
+        fpath = self._path(k, best)
+        if not os.path.isfile(fpath):
+            return None
+        with open(fpath, 'rb') as f:
+            paramDic = pickle.load(f)
+
+        params = OrderedDict()
+        for name in names:
+            W = paramDic.get(str(k) + name)
+            if W is not None:
+                params[name] = (W, paramDic.get(str(k) + name + '_b'))
+        return params
+
+    def save(self, k, params, best=False):
+        fpath = self._path(k, best)
+        if os.path.isfile(fpath):
+            with open(fpath, 'rb') as f:
+                paramDic = pickle.load(f)
+        else:
+            paramDic = {}
+
+        for name, (W, b) in params.items():
+            paramDic[str(k) + name] = W
+            if b is not None:
+                paramDic[str(k) + name + '_b'] = b
+
+        with open(fpath, 'wb') as f:
+            pickle.dump(paramDic, f)
+
+    def flush(self):
+        pass
+
+
+class MemmapAccountStore(object):
+    """Keeps the weights of all accounts in preallocated memory-mapped
+    files, one per parameter, with one row per account.
+
+    Loading the weights of an account returns views into the mapped
+    files, and saving writes straight into the account's row.  Files
+    are only created when weights are first saved to them, and only
+    rows that were saved to are loaded.  The index from account key to
+    row, and to the parameters saved for it, lives in
+    ``<path>/index.pkl`` and is written by :meth:`flush`.
+    """
+    index_name = 'index.pkl'
+
+    def __init__(self, path, capacity=1024, dtype=None):
+        """
+        :param path: Directory that holds the index and array files.
+
+        :param capacity: The number of accounts to preallocate rows
+                         for.  The files double in size whenever they
+                         run out of rows.
+
+        :param dtype: The dtype that weights are stored with.  Defaults
+                      to the dtype of the weights first saved to each
+                      file.  For a :class:`NeuralNet`, that's its
+                      `storage_dtype` for best-loss weights, and the
+                      layers' dtype otherwise.
+        """
+        self.path = path
+        self.capacity = capacity
+        self.dtype = dtype
+        self._index = None
+        self._arrays = {}
+
+    def _slot(self, best):
+        return 'best' if best else 'last'
+
+    def _filename(self, slot, name, param):
+        return os.path.join(
+            self.path, '{}.{}.{}.dat'.format(name, param, slot))
+
+    @property
+    def index(self):
+        if self._index is None:
+            fname = os.path.join(self.path, self.index_name)
+            if os.path.exists(fname):
+                with open(fname, 'rb') as f:
+                    self._index = pickle.load(f)
+            else:
+                self._index = {
+                    'capacity': self.capacity,
+                    'rows': {'last': {}, 'best': {}},
+                    'shapes': {},
+                    'saved': {'last': {}, 'best': {}},
+                    'dtypes': {},
+                    }
+            self._index_dirty = False
+            if 'saved' not in self._index:
+                self._index['saved'] = self._saved_from_files()
+            self._index.setdefault('dtypes', {})
+        return self._index
+
+    def _dtype(self, slot, name, param):
+        # BBB: files of indexes written before dtypes were kept track
+        # of are float32, unless given otherwise:
+        return self.index['dtypes'].get(
+            (slot, name, param), self.dtype or np.float32)
+
+    def _saved_from_files(self):
+        # BBB: indexes written before the saved parameters were kept
+        # track of.  Assume that all existing files were saved to.
+        index = self._index
+        saved = {}
+        for slot, rows in index['rows'].items():
+            params = set(
+                key for key in index['shapes'] if os.path.exists(
+                    self._filename(slot, *key)))
+            saved[slot] = dict((k, set(params)) for k in rows)
+        return saved
+
+    def _array(self, slot, name, param, value=None):
+        key = (slot, name, param)
+        arr = self._arrays.get(key)
+        if arr is not None:
+            return arr
+
+        index = self.index
+        fname = self._filename(slot, name, param)
+        if not os.path.exists(fname) and value is None:
+            # Files are only created for writing, so that rows that
+            # were never saved aren't read back as zeros:
+            return None
+        if (name, param) not in index['shapes']:
+            if value is None:
+                return None
+            index['shapes'][(name, param)] = tuple(np.shape(value))
+            self._index_dirty = True
+        shape = (index['capacity'],) + index['shapes'][(name, param)]
+        if not os.path.exists(fname):
+            dtype = np.dtype(self.dtype or np.asarray(value).dtype)
+            index['dtypes'][key] = dtype.name
+            self._index_dirty = True
+            if not os.path.exists(self.path):
+                os.makedirs(self.path)
+            arr = np.memmap(fname, dtype=dtype, mode='w+', shape=shape)
+        else:
+            arr = np.memmap(fname, dtype=self._dtype(*key), mode='r+',
+                            shape=shape)
+        self._arrays[key] = arr
+        return arr
+
+    def _grow(self):
+        index = self.index
+        capacity = index['capacity'] * 2
+        for (slot, name, param), arr in list(self._arrays.items()):
+            arr.flush()
+            del self._arrays[(slot, name, param)]
+        for slot in ('last', 'best'):
+            for (name, param), shape in index['shapes'].items():
+                fname = self._filename(slot, name, param)
+                itemsize = np.dtype(self._dtype(slot, name, param)).itemsize
+                if os.path.exists(fname):
+                    with open(fname, 'r+b') as f:
+                        f.truncate(
+                            capacity * int(np.prod(shape)) * itemsize)
+        index['capacity'] = capacity
+        self._index_dirty = True
+
+    def load(self, k, names, best=False):
+        slot = self._slot(best)
+        row = self.index['rows'][slot].get(k)
+        if row is None:
+            return None
+
+        saved = self.index['saved'][slot].get(k, ())
+        params = OrderedDict()
+        for name in names:
+            if (name, 'W') not in saved:
+                continue
+            W = self._array(slot, name, 'W')
+            if W is not None:
+                b = None
+                if (name, 'b') in saved:
+                    b = self._array(slot, name, 'b')
+                params[name] = (W[row], b[row] if b is not None else None)
+        return params
+
+    def save(self, k, params, best=False):
+        slot = self._slot(best)
+        rows = self.index['rows'][slot]
+        row = rows.get(k)
+        if row is None:
+            row = len(rows)
+            if row >= self.index['capacity']:
+                self._grow()
+            rows[k] = row
+            self._index_dirty = True
+
+        saved = self.index['saved'][slot].setdefault(k, set())
+        n_saved = len(saved)
+        for name, (W, b) in params.items():
+            self._array(slot, name, 'W', W)[row] = W
+            saved.add((name, 'W'))
+            if b is not None:
+                self._array(slot, name, 'b', b)[row] = b
+                saved.add((name, 'b'))
+        if len(saved) != n_saved:
+            self._index_dirty = True
+
+    def flush(self):
+        for arr in self._arrays.values():
+            arr.flush()
+        if self._index is not None and self._index_dirty:
+            fname = os.path.join(self.path, self.index_name)
+            if not os.path.exists(self.path):
+                os.makedirs(self.path)
+            with open(fname + '.tmp', 'wb') as f:
+                pickle.dump(self._index, f, -1)
+            os.rename(fname + '.tmp', fname)
+            self._index_dirty = False
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_arrays'] = {}
+        return state
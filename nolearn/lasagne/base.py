@@ -2,12 +2,24 @@ from __future__ import absolute_import
 
 from .._compat import basestring
 from .._compat import chain_exception
+from .._compat import Empty
+from .._compat import Full
 from .._compat import pickle
+from .._compat import Queue
+from .._compat import reraise
+from collections import deque
 from collections import OrderedDict
 import itertools
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import numbers
+import signal
+import sys
+import threading
 from warnings import warn
 from time import time
 import os
+import weakref
 
 from lasagne.layers import get_all_layers
 from lasagne.layers import get_output
@@ -32,6 +44,14 @@ from theano import tensor as T
 
 from . import PrintLog
 from . import PrintLayerInfo
+from .accounts import AccountWeightCache
+from .accounts import PickleAccountStore
+from .checkpoint import is_checkpoint
+from .checkpoint import load_checkpoint
+from .checkpoint import save_checkpoint
+from .parallel import DataParallelTrainer
+from .timing import PhaseTimer
+from .util import graph_fingerprint
 
 class _list(list):
     pass
@@ -41,13 +61,95 @@ class _dict(dict):
         return True
 
 
+def _astype(value, dtype):
+    """Casts floating point `value` to `dtype`; leaves `None`, integer
+    arrays, and values of that dtype alone.
+    """
+    if value is None or dtype is None:
+        return value
+    value = np.asarray(value)
+    if value.dtype.kind != 'f' or value.dtype == dtype:
+        return value
+    return value.astype(dtype)
+
+
 def _sldict(arr, sl):
     if isinstance(arr, dict):
-        return {k: v[sl] for k, v in arr.items()}
+        return {k: _sldict(v, sl) for k, v in arr.items()}
+    elif isinstance(arr, list) and not isinstance(sl, slice):
+        return [arr[i] for i in sl]
     else:
         return arr[sl]
 
 
+_NO_ACCOUNT = object()
+
+
+_INITIALIZE_MODES = {
+    None: (),
+    'predict': ('predict',),
+    'full': ('train', 'eval', 'predict'),
+    }
+
+
+class _LazyIterFunc(object):
+    """Compiles one of the iteration functions of :class:`NeuralNet`
+    when it's first accessed.
+    """
+    def __init__(self, kind):
+        self.kind = kind
+
+    def __get__(self, net, owner):
+        if net is None:
+            return self
+        net.initialize()
+        return net._compile_iter_func(self.kind)
+
+
+def _func(method):
+    return getattr(method, '__func__', method)
+
+
+class _SharedBatch(object):
+    """Stands in for a batch of data that already lives in a Theano
+    shared variable.  Calling it runs the batch through `func`, a
+    function compiled to take the batch index.
+    """
+    def __init__(self, func, index, size):
+        self.func = func
+        self.index = index
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __call__(self):
+        return self.func(self.index)
+
+
+def _batch_size(Xb, yb=None):
+    if yb is not None:
+        return len(yb)
+    if isinstance(Xb, dict):
+        return len(list(Xb.values())[0])
+    return len(Xb)
+
+
+def _grow(out, size):
+    """Returns a copy of `out` with room for at least `size` samples.
+    """
+    grown = np.empty(
+        (max(size, 2 * len(out)),) + out.shape[1:], dtype=out.dtype)
+    grown[:len(out)] = out
+    return grown
+
+
+def _weighted_mean(values, weights):
+    if not len(values):
+        return np.mean(values)
+    return np.average(np.ravel(values), weights=weights)
+
+
 class Layers(OrderedDict):
     def __getitem__(self, key):
         if isinstance(key, int):
@@ -66,23 +168,63 @@ class Layers(OrderedDict):
 
 
 class BatchIterator(object):
-    def __init__(self, batch_size):
+    def __init__(self, batch_size, group_by=None, shuffle_groups=False,
+                 random_state=None):
+        """
+        :param batch_size: The maximum number of samples per batch.
+
+        :param group_by: An optional callable that takes `X` and `y`
+                         and returns one group key (e.g. the account)
+                         per sample.  Batches are then formed within
+                         groups only, and all batches of a group are
+                         yielded back to back.
+
+        :param shuffle_groups: Visit the groups in random order.
+
+        :param random_state: Seed for shuffling the groups.
+        """
         self.batch_size = batch_size
+        self.group_by = group_by
+        self.shuffle_groups = shuffle_groups
+        self.random_state = random_state
 
     def __call__(self, X, y=None):
         self.X, self.y = X, y
         return None, self
 
     def __iter__(self):
-        bs = self.batch_size
-        for i in range((self.n_samples + bs - 1) // bs):
-            sl = slice(i * bs, (i + 1) * bs)
+        for Xb, yb in self._iter_slices():
+            yield self.transform(Xb, yb)
+
+    def _iter_slices(self):
+        for sl in self._batch_indices():
             Xb = _sldict(self.X, sl)
             if self.y is not None:
-                yb = self.y[sl]
+                yb = _sldict(self.y, sl)
             else:
                 yb = None
-            yield self.transform(Xb, yb)
+            yield Xb, yb
+
+    def _batch_indices(self):
+        bs = self.batch_size
+        if getattr(self, 'group_by', None) is None:
+            for i in range((self.n_samples + bs - 1) // bs):
+                yield slice(i * bs, (i + 1) * bs)
+            return
+
+        keys = np.asarray(self.group_by(self.X, self.y))
+        groups = np.unique(keys, return_inverse=True)[1]
+        order = np.argsort(groups, kind='mergesort')
+        bounds = np.cumsum(np.bincount(groups))[:-1]
+        groups = np.split(order, bounds)
+        if self.shuffle_groups:
+            rng = getattr(self, 'rng_', None)
+            if rng is None:
+                rng = self.rng_ = np.random.RandomState(self.random_state)
+            rng.shuffle(groups)
+        for indices in groups:
+            for i in range(0, len(indices), bs):
+                yield indices[i:i + bs]
 
     @property
     def n_samples(self):
@@ -103,6 +245,174 @@ class BatchIterator(object):
         return state
 
 
+def _prefetch_transform(batch_iterator, Xb, yb, seed=None):
+    if seed is not None:
+        np.random.seed(seed)
+    return batch_iterator.transform(Xb, yb)
+
+
+def _ignore_sigint():
+    # Worker processes leave handling of Ctrl-C to the parent:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+_DONE = object()
+
+
+def _prefetch(iterable, queue_size, timeout):
+    """Iterates over `iterable` in a background thread, up to
+    `queue_size` items ahead of consumption.
+    """
+    queue = Queue(max(queue_size, 1))
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except Exception:
+            # The traceback goes along, so that it points to where
+            # the error happened in the producer:
+            put((_DONE, sys.exc_info()))
+        else:
+            put((_DONE, None))
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            try:
+                item, error = queue.get(timeout=timeout)
+            except Empty:
+                continue
+            if error is not None:
+                reraise(*error)
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        # Also reached when the consumer stops iterating early:
+        stop.set()
+
+
+class PrefetchingBatchIterator(object):
+    """Wraps a :class:`BatchIterator` and prepares batches ahead of
+    consumption in the background.
+
+    Calling it returns what calling the wrapped iterator returns,
+    except that batches are prefetched.  Batches are yielded in the
+    same order as by the wrapped iterator.
+
+    If the wrapped iterator keeps :meth:`BatchIterator.__iter__`, its
+    `transform` is run in a pool of worker threads or processes.
+    With processes, each batch's transform is run with the global
+    NumPy random state seeded from `random_state`, which keeps random
+    augmentations reproducible.  With threads, use `n_workers=1` if
+    `transform` draws from the global random state.  Iterators that
+    yield batches in their own way, i.e. that override `__iter__` or
+    return another iterable from `__call__`, are instead run as they
+    are in a single background thread, and `n_workers` and
+    `processes` don't apply to them.  A warning says so.
+    """
+    # Waiting on a result with a timeout keeps Python 2 responsive to
+    # KeyboardInterrupt:
+    _timeout = 60 * 60 * 24 * 365
+
+    def __init__(self, batch_iterator, n_workers=1, queue_size=2,
+                 processes=False, random_state=None):
+        """
+        :param batch_iterator: The :class:`BatchIterator` to wrap.
+
+        :param n_workers: Number of worker threads or processes.
+
+        :param queue_size: Maximum number of batches that are
+                           prepared ahead of consumption.
+
+        :param processes: Use worker processes instead of threads.
+                          Useful when `transform` holds the GIL.
+
+        :param random_state: Seed for the per-batch seeds used with
+                             worker processes.
+        """
+        self.batch_iterator = batch_iterator
+        self.n_workers = n_workers
+        self.queue_size = queue_size
+        self.processes = processes
+        self.random_state = random_state
+
+    def __call__(self, X, y=None):
+        batches = self.batch_iterator(X, y)
+        # BatchIterator.__call__ returns `(None, self)`:
+        if (isinstance(batches, tuple) and len(batches) == 2 and
+                batches[1] is self.batch_iterator):
+            return batches[0], self
+        self._warn_single_thread()
+        return _prefetch(batches, self.queue_size, self._timeout)
+
+    def _warn_single_thread(self):
+        if self.n_workers > 1 or self.processes:
+            warn("{} yields batches in its own way, so they're prefetched "
+                 "in a single thread, regardless of n_workers and "
+                 "processes.".format(type(self.batch_iterator).__name__))
+
+    def __getattr__(self, name):
+        if name == 'batch_iterator':
+            raise AttributeError(name)
+        return getattr(self.batch_iterator, name)
+
+    def _next_seed(self):
+        if not self.processes:
+            return None
+        rng = getattr(self, 'rng_', None)
+        if rng is None:
+            rng = self.rng_ = np.random.RandomState(self.random_state)
+        return rng.randint(2 ** 31 - 1)
+
+    def __iter__(self):
+        batch_iterator = self.batch_iterator
+        if (_func(getattr(type(batch_iterator), '__iter__')) is not
+                _func(BatchIterator.__iter__)):
+            self._warn_single_thread()
+            for batch in _prefetch(
+                    batch_iterator, self.queue_size, self._timeout):
+                yield batch
+            return
+
+        if self.processes:
+            pool = multiprocessing.Pool(
+                self.n_workers, initializer=_ignore_sigint)
+        else:
+            pool = ThreadPool(self.n_workers)
+
+        pending = deque()
+        try:
+            for Xb, yb in batch_iterator._iter_slices():
+                pending.append(pool.apply_async(
+                    _prefetch_transform,
+                    (batch_iterator, Xb, yb, self._next_seed())))
+                if len(pending) > max(self.queue_size, 1):
+                    yield pending.popleft().get(self._timeout)
+            while pending:
+                yield pending.popleft().get(self._timeout)
+            pool.close()
+        finally:
+            # Also reached on KeyboardInterrupt and when the consumer
+            # stops iterating early:
+            pool.terminate()
+            pool.join()
+
+
 class TrainSplit(object):
     def __init__(self, eval_size, stratify=True):
         self.eval_size = eval_size
@@ -168,6 +478,10 @@ def objective(layers,
 class NeuralNet(BaseEstimator):
     """A scikit-learn estimator based on Lasagne.
     """
+    train_iter_ = _LazyIterFunc('train')
+    eval_iter_ = _LazyIterFunc('eval')
+    predict_iter_ = _LazyIterFunc('predict')
+
     def __init__(
         self,
         layers,
@@ -192,6 +506,14 @@ class NeuralNet(BaseEstimator):
         layer_weights= None,
         account_weights=False,
         account_weight_layers = [],
+        account_cache_bytes=0,
+        account_store=None,
+        shared_data=False,
+        shared_data_max_bytes=512 * 1024 ** 2,
+        compile_cache_dir=None,
+        n_workers=1,
+        sync_every=1,
+        storage_dtype=None,
         l3_layers = [],
         verbose=0,
         identifier='test',
@@ -260,6 +582,14 @@ class NeuralNet(BaseEstimator):
         self.layer_weights = layer_weights
         self.account_weights = account_weights
         self.account_weight_layers = account_weight_layers
+        self.account_cache_bytes = account_cache_bytes
+        self.account_store = account_store
+        self.shared_data = shared_data
+        self.shared_data_max_bytes = shared_data_max_bytes
+        self.compile_cache_dir = compile_cache_dir
+        self.n_workers = n_workers
+        self.sync_every = sync_every
+        self.storage_dtype = storage_dtype
         self.fp_accW = fp_accW
         self.l3_layers = l3_layers
         self.verbose = verbose
@@ -326,21 +656,143 @@ class NeuralNet(BaseEstimator):
 
         return X, y
 
-    def initialize(self):
-        if getattr(self, '_initialized', False):
-            return
+    def initialize(self, mode=None):
+        """Builds the layers, and compiles the functions needed for
+        `mode`.
+
+        The iteration functions `train_iter_`, `eval_iter_` and
+        `predict_iter_` are otherwise compiled lazily, on first use.
+
+        :param mode: `None` to compile nothing up front, `'predict'`
+                     to compile `predict_iter_` only, e.g. in
+                     inference-only processes, or `'full'` to compile
+                     all iteration functions.
+        """
+        if mode not in _INITIALIZE_MODES:
+            raise ValueError("Unknown mode {!r}; must be one of {}.".format(
+                mode, ', '.join(map(repr, _INITIALIZE_MODES))))
+
+        if not getattr(self, '_initialized', False):
+            out = getattr(self, '_output_layer', None)
+            if out is None:
+                out = self._output_layer = self.initialize_layers()
+            self._check_for_unused_kwargs()
+            self._initialized = True
+
+        for kind in _INITIALIZE_MODES[mode]:
+            getattr(self, kind + '_iter_')
+
+    def _compile_iter_func(self, kind):
+        func = self._load_compiled(kind)
+        if func is None:
+            func, = self._create_iter_funcs(
+                self.layers_, self.objective, self.update,
+                self.y_tensor_type, kinds=(kind,),
+                )
+            self._save_compiled(kind, func)
+        setattr(self, kind + '_iter_', func)
+        return func
+
+    def _compile_cache_path(self, kind):
+        """Returns the path that the compiled function of the given
+        `kind` is cached under, or `None` if the graph can't be
+        fingerprinted reliably.
+        """
+        try:
+            key = graph_fingerprint(
+                self.layers_,
+                kind,
+                self.objective,
+                self._get_params_for('objective'),
+                self.objective_loss_function,
+                self.update,
+                self._get_params_for('update'),
+                self.layer_weights,
+                self.l3_layers,
+                self.regression,
+                str(self.y_tensor_type),
+                bool(self.custom_score),
+                )
+        except ValueError:
+            return None
+        return os.path.join(
+            self.compile_cache_dir, '{}-{}.pkl'.format(kind, key))
+
+    def _param_keys(self):
+        # Layer parameters, and shared variables passed as objective
+        # or update parameters, such as a shared learning rate, are
+        # swapped in for the ones a cached function was compiled with:
+        keys = OrderedDict()
+        for name, layer in self.layers_.items():
+            for i, param in enumerate(layer.get_params()):
+                keys.setdefault(param, (name, i))
+        for prefix in ('objective', 'update'):
+            for name, value in sorted(self._get_params_for(prefix).items()):
+                if isinstance(value, theano.compile.SharedVariable):
+                    keys.setdefault(value, (prefix, name))
+        return keys
+
+    def _load_compiled(self, kind):
+        """Loads the compiled function of the given `kind` from the
+        compile cache, and swaps in this net's parameters for the
+        ones it was compiled with.  Returns `None` on a cache miss.
+        """
+        if not self.compile_cache_dir:
+            return None
+        fname = self._compile_cache_path(kind)
+        if fname is None or not os.path.exists(fname):
+            return None
+
+        reoptimize = theano.config.reoptimize_unpickled_function
+        theano.config.reoptimize_unpickled_function = False
+        try:
+            with open(fname, 'rb') as f:
+                func, param_keys = pickle.load(f)
+            params = dict((key, param) for param, key in
+                          self._param_keys().items())
+            swap = {}
+            for var, key in zip(func.get_shared(), param_keys):
+                if key is not None:
+                    swap[var] = params[key]
+            func = func.copy(swap=swap)
+        except Exception as e:
+            warn("Could not load compiled function from {}: {}".format(
+                fname, e))
+            return None
+        finally:
+            theano.config.reoptimize_unpickled_function = reoptimize
 
-        out = getattr(self, '_output_layer', None)
-        if out is None:
-            out = self._output_layer = self.initialize_layers()
-        self._check_for_unused_kwargs()
+        if self.verbose:
+            print("Loaded compiled function from {}.".format(fname))
+        return func
 
-        iter_funcs = self._create_iter_funcs(
-            self.layers_, self.objective, self.update,
-            self.y_tensor_type,
-            )
-        self.train_iter_, self.eval_iter_, self.predict_iter_ = iter_funcs
-        self._initialized = True
+    def _save_compiled(self, kind, func):
+        if not self.compile_cache_dir:
+            return
+        fname = self._compile_cache_path(kind)
+        if fname is None:
+            warn("Not caching the compiled {} function, because its graph "
+                 "can't be fingerprinted.".format(kind))
+            return
+        param_keys = self._param_keys()
+        keys = [param_keys.get(var) for var in func.get_shared()]
+
+        if not os.path.exists(self.compile_cache_dir):
+            os.makedirs(self.compile_cache_dir)
+        recursionlimit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(recursionlimit, 50000))
+        tmp_fname = '{}.{}.tmp'.format(fname, os.getpid())
+        try:
+            with open(tmp_fname, 'wb') as f:
+                pickle.dump((func, keys), f, -1)
+            os.rename(tmp_fname, fname)
+        except Exception as e:
+            warn("Could not save compiled function to {}: {}".format(
+                fname, e))
+            if os.path.exists(tmp_fname):
+                os.remove(tmp_fname)
+        finally:
+            sys.setrecursionlimit(recursionlimit)
 
     def _get_params_for(self, name):
         collected = {}
@@ -444,62 +896,97 @@ class NeuralNet(BaseEstimator):
                   'In lasagne these count as two independent parametersets.\n'
         return layer
 
-    def _create_iter_funcs(self, layers, objective, update, output_type):
-        y_batch = output_type('y_batch')
+    def _build_iter_graph(self, kind, layers, objective, update,
+                          output_type):
+        """Returns the symbolic `(outputs, updates)` of the iteration
+        function of the given `kind`.  Only the parts of the graph
+        that this kind needs are built, and built only once.
+        """
+        graph = getattr(self, '_iter_graph_', None)
+        if graph is None:
+            input_layers = [layer for layer in layers.values()
+                            if isinstance(layer, InputLayer)]
+            graph = self._iter_graph_ = {
+                'X_inputs': [layer.input_var for layer in input_layers],
+                'X_names': [layer.name for layer in input_layers],
+                'y_batch': output_type('y_batch'),
+                'predict_proba': get_output(
+                    layers[-1], None, deterministic=True),
+                }
+        if kind in graph:
+            return graph[kind]
 
-        output_layer = layers[-1]
+        y_batch = graph['y_batch']
+        predict_proba = graph['predict_proba']
         objective_kw = self._get_params_for('objective')
 
-        l3Layers = []
-        for l3_name in self.l3_layers:
-            l3Layers.append( layers[ l3_name ] )
-
-        loss_train = objective(
-            layers, target=y_batch, l3_layers=l3Layers, **objective_kw)
-        loss_eval = objective(
-            layers, target=y_batch, deterministic=True, **objective_kw)
-        predict_proba = get_output(output_layer, None, deterministic=True)
-
-        if not self.regression:
-            predict = predict_proba.argmax(axis=1)
-            accuracy = T.mean(T.eq(predict, y_batch))
-        elif self.objective_loss_function is binary_crossentropy:
-            predict = T.where( predict_proba >= 0.5, 1, 0 )
-            accuracy = T.mean( T.eq(predict, y_batch) )
-        else:
-            predict = T.where( predict_proba > 0., 1, 0 )
-            label   = T.where( y_batch > 0., 1, 0 )
-            accuracy = T.mean( T.eq( predict, label ) )
-
-        all_params = self.get_all_params(trainable=True)
-        update_params = self._get_params_for('update')
-        updates = update(loss_train, all_params, layer_weights=self.layer_weights, **update_params )
-
-        input_layers = [layer for layer in layers.values()
-                        if isinstance(layer, InputLayer)]
-
-        X_inputs = [theano.Param(input_layer.input_var, name=input_layer.name)
-                    for input_layer in input_layers]
-        inputs = X_inputs + [theano.Param(y_batch, name="y")]
-
-        train_iter = theano.function(
-            inputs=inputs,
-            outputs=[loss_train],
-            updates=updates,
-            allow_input_downcast=True,
-            )
-        eval_iter = theano.function(
-            inputs=inputs,
-            outputs=[loss_eval, accuracy],
-            allow_input_downcast=True,
-            )
-        predict_iter = theano.function(
-            inputs=X_inputs,
-            outputs=predict_proba,
-            allow_input_downcast=True,
-            )
+        if kind == 'predict':
+            graph[kind] = (predict_proba, None)
+
+        elif kind == 'eval':
+            loss_eval = objective(
+                layers, target=y_batch, deterministic=True, **objective_kw)
+
+            if not self.regression:
+                predict = predict_proba.argmax(axis=1)
+                accuracy = T.mean(T.eq(predict, y_batch))
+            elif self.objective_loss_function is binary_crossentropy:
+                predict = T.where( predict_proba >= 0.5, 1, 0 )
+                accuracy = T.mean( T.eq(predict, y_batch) )
+            else:
+                predict = T.where( predict_proba > 0., 1, 0 )
+                label   = T.where( y_batch > 0., 1, 0 )
+                accuracy = T.mean( T.eq( predict, label ) )
+
+            # The predictions come along with the loss so that custom
+            # scores don't need a second forward pass.  Without custom
+            # scores, they're not copied back from the device at all:
+            outputs = [loss_eval, accuracy]
+            if self.custom_score:
+                outputs.append(predict_proba)
+            graph[kind] = (outputs, None)
+
+        elif kind == 'train':
+            l3Layers = []
+            for l3_name in self.l3_layers:
+                l3Layers.append( layers[ l3_name ] )
+
+            loss_train = objective(
+                layers, target=y_batch, l3_layers=l3Layers, **objective_kw)
 
-        return train_iter, eval_iter, predict_iter
+            all_params = self.get_all_params(trainable=True)
+            update_params = self._get_params_for('update')
+            updates = update(loss_train, all_params, layer_weights=self.layer_weights, **update_params )
+            graph[kind] = ([loss_train], updates)
+
+        else:
+            raise ValueError("Unknown kind of function: {}".format(kind))
+
+        return graph[kind]
+
+    def _create_iter_funcs(self, layers, objective, update, output_type,
+                           kinds=('train', 'eval', 'predict')):
+        funcs = []
+        for kind in kinds:
+            outputs, updates = self._build_iter_graph(
+                kind, layers, objective, update, output_type)
+            graph = self._iter_graph_
+
+            X_inputs = [theano.Param(input_var, name=name)
+                        for input_var, name in zip(
+                            graph['X_inputs'], graph['X_names'])]
+            inputs = X_inputs
+            if kind != 'predict':
+                inputs = X_inputs + [theano.Param(graph['y_batch'], name="y")]
+
+            funcs.append(theano.function(
+                inputs=inputs,
+                outputs=outputs,
+                updates=updates,
+                allow_input_downcast=True,
+                ))
+
+        return tuple(funcs)
 
     def fit(self, X_train, y_train, X_valid, y_valid ):
         X_train, y_train = self._check_good_input(X_train, y_train)
@@ -514,7 +1001,9 @@ class NeuralNet(BaseEstimator):
         try:
             self.train_loop(X_train, y_train, X_valid, y_valid )
         except KeyboardInterrupt:
-            pass
+            self.flush_account_weights()
+        finally:
+            self._close_parallel()
         return self
 
     def partial_fit(self, X, y, classes=None):
@@ -560,7 +1049,13 @@ class NeuralNet(BaseEstimator):
             func(self, self.train_history_)
 
         num_epochs_past = len(self.train_history_)
-    
+
+        # Time spent per phase of each epoch, see PhaseTimer:
+        timer = self.timer_ = PhaseTimer()
+        span = timer.span
+
+        parallel = self._get_parallel()
+
         self.SANE = True
         while epoch < self.max_epochs:
             if not self.SANE:
@@ -569,63 +1064,86 @@ class NeuralNet(BaseEstimator):
 
             train_losses = []
             train_accuracies = []
+            train_sizes = []
             valid_losses = []
             valid_accuracies = []
+            valid_sizes = []
             custom_score = []
 
             t0 = time()
-            time_i = time()
-            for k, fpaths, Xb, yb in self.batch_iterator_train( X_train, y_train ):
+            # Account weights are only swapped when the account
+            # changes from one batch to the next:
+            k_loaded = _NO_ACCOUNT
+            account_swaps = 0
+            for k, fpaths, Xb, yb in timer.iterate(self._batches(
+                    'train', self.batch_iterator_train, X_train, y_train),
+                    'batches'):
                 if not self.SANE:
                     continue
-                #print time() - time_i
-                if self.account_weights:
-                    time0 = time()
-                    self.load_account_weights( k )
-
-                time0 = time()
-                batch_train_loss = self.apply_batch_func( self.train_iter_, Xb, yb )
-                #print 'training batch', time() - time0
+                if self.account_weights and k != k_loaded:
+                    if k_loaded is not _NO_ACCOUNT:
+                        with span('account_save'):
+                            self.save_account_weights( k_loaded )
+                    with span('account_load'):
+                        self.load_account_weights( k )
+                    k_loaded = k
+                    account_swaps += 1
+
+                with span('train'):
+                    if parallel is not None:
+                        batch_train_loss = parallel.train(Xb, yb)
+                    else:
+                        batch_train_loss = self.apply_batch_func(
+                            self.train_iter_, Xb, yb)
                 accuracy = 0.
 
-#                dummy, accuracy = self.apply_batch_func(
-#                    self.eval_iter_, Xb, yb)
-
                 train_accuracies.append(accuracy)
                 train_losses.append(batch_train_loss)
-   
-                for func in on_batch_finished:
-                    func(self, self.train_history_)
-
-                if self.account_weights:
-                    time0 = time()
-                    self.save_account_weights( k )
-                time_i = time()
-
-            for k, fpaths, Xb, yb in self.batch_iterator_train( X_valid, y_valid ):
-                if self.account_weights:
-                    self.load_account_weights( k )
-           
-                time0 = time()
-                batch_valid_loss, accuracy = self.apply_batch_func(
-                    self.eval_iter_, Xb, yb)
-                #print 'predicting batch', time()-time0
+                train_sizes.append(_batch_size(Xb, yb))
+
+                with span('batch_handlers'):
+                    for func in on_batch_finished:
+                        func(self, self.train_history_)
+
+            if self.account_weights and k_loaded is not _NO_ACCOUNT:
+                with span('account_save'):
+                    self.save_account_weights( k_loaded )
+            if parallel is not None:
+                with span('train'):
+                    parallel.sync()
+
+            for k, fpaths, Xb, yb in timer.iterate(self._batches(
+                    'valid', self.batch_iterator_train, X_valid, y_valid),
+                    'batches'):
+                if self.account_weights and k != k_loaded:
+                    with span('account_load'):
+                        self.load_account_weights( k )
+                    k_loaded = k
+                    account_swaps += 1
+
+                with span('eval'):
+                    outputs = self.apply_batch_func(self.eval_iter_, Xb, yb)
+                batch_valid_loss, accuracy = outputs[:2]
 
                 valid_losses.append(batch_valid_loss)
                 valid_accuracies.append( accuracy )
+                valid_sizes.append(_batch_size(Xb, yb))
 
                 if self.custom_score:
-                    y_prob = self.apply_batch_func(self.predict_iter_, Xb)
-                    custom_score.append(self.custom_score[1](yb, y_prob))
+                    with span('custom_score'):
+                        custom_score.append(
+                            self.custom_score[1](yb, outputs[2]))
 
-            avg_train_loss = np.mean(train_losses)
-            avg_valid_loss = np.mean(valid_losses)
+            # Batch averages are weighted by batch size, so that a
+            # last, partial batch doesn't count as much as a full one:
+            avg_train_loss = _weighted_mean(train_losses, train_sizes)
+            avg_valid_loss = _weighted_mean(valid_losses, valid_sizes)
 
-            avg_train_accuracy = np.mean( train_accuracies )
-            avg_valid_accuracy = np.mean( valid_accuracies )
+            avg_train_accuracy = _weighted_mean(train_accuracies, train_sizes)
+            avg_valid_accuracy = _weighted_mean(valid_accuracies, valid_sizes)
 
             if custom_score:
-                avg_custom_score = np.mean(custom_score)
+                avg_custom_score = _weighted_mean(custom_score, valid_sizes)
 
             if avg_train_loss < best_train_loss:
                 best_train_loss = avg_train_loss
@@ -651,19 +1169,197 @@ class NeuralNet(BaseEstimator):
                 }
             if self.custom_score:
                 info[self.custom_score[0]] = avg_custom_score
+            if self.account_weights:
+                info['account_swaps'] = account_swaps
+                with span('account_save'):
+                    self.flush_account_weights()
+            account_cache = getattr(self, '_account_cache', None)
+            if account_cache is not None:
+                for key, value in account_cache.counters().items():
+                    info['account_cache_' + key] = value
+                account_cache.reset_counters()
+            # Epoch handlers, like PrintLog, write out the entry as
+            # they see it, so their own spans are reported with the
+            # next epoch's entry:
+            info['dur_epoch_handlers'] = 0.
+            info.update(timer.durations())
+            timer.reset()
             self.train_history_.append(info)
 
             try:
-                for func in on_epoch_finished:
-                    func(self, self.train_history_)
+                with span('epoch_handlers'):
+                    for func in on_epoch_finished:
+                        func(self, self.train_history_)
             except StopIteration:
                 break
 
+        # The last epoch's handlers have no next entry to be reported
+        # with, so their spans are added to the last one:
+        if self.train_history_:
+            info = self.train_history_[-1]
+            for key, seconds in timer.durations().items():
+                info[key] = info.get(key, 0.) + seconds
+        timer.reset()
+
+        self.flush_account_weights()
+        self._close_parallel()
+        # Handlers that buffer what they write, like metrics sinks,
+        # write out the rest now:
+        for func in itertools.chain(on_batch_finished, on_epoch_finished):
+            close = getattr(func, 'close', None)
+            if close is not None:
+                close()
         for func in on_training_finished:
             func(self, self.train_history_)
 
+    def _get_parallel(self):
+        if self.n_workers <= 1:
+            return None
+        if self.account_weights:
+            raise ValueError(
+                "Data-parallel training with n_workers > 1 doesn't "
+                "support account weights.")
+        parallel = getattr(self, '_parallel_', None)
+        if parallel is None:
+            parallel = self._parallel_ = DataParallelTrainer(
+                self, self.n_workers, self.sync_every)
+        return parallel
+
+    def _close_parallel(self):
+        parallel = getattr(self, '_parallel_', None)
+        if parallel is not None:
+            parallel.close()
+            self._parallel_ = None
+
+    def _batches(self, kind, batch_iterator, X, y=None, layer=None):
+        """Iterates over `(k, fpaths, Xb, yb)` batches of `X` and `y`.
+
+        In shared data mode, `Xb` is a :class:`_SharedBatch` that
+        refers to a slice of `X` held in a Theano shared variable.
+        Calling it returns what the iteration function of `kind`
+        returns, or for `'test'` batches, the output of `layer` if
+        given.
+        """
+        batches = self._shared_batches(kind, batch_iterator, X, y, layer)
+        if batches is None:
+            batches = batch_iterator(X, y)
+        return batches
+
+    def _shared_batches(self, kind, batch_iterator, X, y=None, layer=None):
+        """Returns batches of `X` and `y` sliced on the device, or
+        `None` if shared data mode doesn't apply, e.g. for batch
+        iterators that override how batches are made.
+
+        `X` and `y` are copied to the device again only when they're
+        different objects from the last call, so arrays modified in
+        place must be passed as copies for the changes to be seen.
+        """
+        if not self.shared_data or self.account_weights:
+            return None
+        if kind == 'train' and self.n_workers > 1:
+            return None
+        if not isinstance(X, np.ndarray):
+            return None
+        if kind != 'test' and y is None:
+            return None
+        if not (isinstance(batch_iterator, BatchIterator) and
+                getattr(batch_iterator, 'group_by', None) is None):
+            return None
+        for name in ('__call__', '__iter__', '_iter_slices', 'transform'):
+            if (_func(getattr(type(batch_iterator), name)) is not
+                    _func(getattr(BatchIterator, name))):
+                return None
+
+        graph_kind = {'train': 'train', 'valid': 'eval', 'test': 'predict'}
+        outputs, updates = self._build_iter_graph(
+            graph_kind[kind], self.layers_, self.objective, self.update,
+            self.y_tensor_type)
+        graph = self._iter_graph_
+        if len(graph['X_inputs']) != 1:
+            return None
+        X_input, = graph['X_inputs']
+        y_batch = graph['y_batch']
+        if X.ndim != X_input.ndim or (
+                y is not None and y.ndim != y_batch.ndim):
+            return None
+        # With a storage_dtype, float inputs are held in it on the
+        # device, and only cast to the input's dtype batch by batch:
+        X_dtype = X_input.dtype
+        if (self.storage_dtype is not None and
+                np.dtype(X_input.dtype).kind == 'f'):
+            X_dtype = np.dtype(self.storage_dtype).name
+        nbytes = X.size * np.dtype(X_dtype).itemsize
+        if y is not None:
+            nbytes += y.size * np.dtype(y_batch.dtype).itemsize
+        if nbytes > self.shared_data_max_bytes:
+            return None
+
+        bs = batch_iterator.batch_size
+        shared_data = getattr(self, '_shared_data_', None)
+        if shared_data is None:
+            shared_data = self._shared_data_ = {}
+        entry = shared_data.get(kind)
+        if entry is None or entry['batch_size'] != bs:
+            X_shared = theano.shared(X.astype(X_dtype), borrow=True)
+            y_shared = None
+            givens = {}
+            index = T.lscalar('batch_index')
+            sl = slice(index * bs, (index + 1) * bs)
+            givens[X_input] = X_shared[sl]
+            if X_dtype != X_input.dtype:
+                givens[X_input] = T.cast(X_shared[sl], X_input.dtype)
+            if kind != 'test':
+                y_shared = theano.shared(
+                    y.astype(y_batch.dtype), borrow=True)
+                givens[y_batch] = y_shared[sl]
+            entry = shared_data[kind] = {
+                'batch_size': bs,
+                'index': index,
+                'givens': givens,
+                'funcs': {},
+                'X_shared': X_shared,
+                'y_shared': y_shared,
+                }
+        elif entry['X_ref']() is not X or (
+                entry['y_shared'] is not None and entry['y_ref']() is not y):
+            entry['X_shared'].set_value(X.astype(X_dtype), borrow=True)
+            if entry['y_shared'] is not None:
+                entry['y_shared'].set_value(
+                    y.astype(y_batch.dtype), borrow=True)
+        # Only weak references to the data on the host are kept, to
+        # tell when it changes, so that it can be freed once it's on
+        # the device:
+        entry['X_ref'] = weakref.ref(X)
+        if entry['y_shared'] is not None:
+            entry['y_ref'] = weakref.ref(y)
+
+        # One function per layer whose output is asked for:
+        func = entry['funcs'].get(layer)
+        if func is None:
+            if layer is not None:
+                outputs = get_output(layer, None, deterministic=True)
+                updates = None
+            func = entry['funcs'][layer] = theano.function(
+                inputs=[entry['index']],
+                outputs=outputs,
+                updates=updates,
+                givens=entry['givens'],
+                on_unused_input='ignore',
+                )
+        return self._iter_shared_batches(func, len(X), bs, y)
+
+    @staticmethod
+    def _iter_shared_batches(func, n_samples, batch_size, y=None):
+        for i in range((n_samples + batch_size - 1) // batch_size):
+            start, stop = i * batch_size, min((i + 1) * batch_size, n_samples)
+            indices = np.arange(start, stop)
+            yb = y[start:stop] if y is not None else None
+            yield None, indices, _SharedBatch(func, i, len(indices)), yb
+
     @staticmethod
     def apply_batch_func(func, Xb, yb=None):
+        if isinstance(Xb, _SharedBatch):
+            return Xb()
         if isinstance(Xb, dict):
             kwargs = dict(Xb)
             if yb is not None:
@@ -672,28 +1368,73 @@ class NeuralNet(BaseEstimator):
         else:
             return func(Xb) if yb is None else func(Xb, yb)
 
-    def predict_proba(self, X, y=None ):
-        probas = []
-        real_probas = []
-        X_reordered = []
-        y_reordered = []
+    def iter_predict_proba(self, X, y=None):
+        """Yields `(fpaths, probas, yb)` for each batch of `X`.
 
-        for k, fpaths, Xb, yb in self.batch_iterator_test( X, y ):
-            X_reordered.append( fpaths )
-            if self.account_weights:
+        Use this instead of :meth:`predict_proba` to stream predictions
+        for inputs too large to hold all results in memory at once.
+        """
+        k_loaded = _NO_ACCOUNT
+        for k, fpaths, Xb, yb in self._batches(
+                'test', self.batch_iterator_test, X, y):
+            if self.account_weights and k != k_loaded:
                 self.load_account_weights( k, BEST_LOSS = True )
+                k_loaded = k
+            yield fpaths, self.apply_batch_func(self.predict_iter_, Xb), yb
+
+    def predict_proba(self, X, y=None, out=None):
+        """Returns the predicted probabilities, the targets and the
+        file paths, all in the order that the test batch iterator
+        visited the samples in.
+
+        Predictions are written batch by batch into one preallocated
+        array, sized like in :meth:`transform`.  Pass `out` (e.g. an
+        `np.memmap`) to provide that array yourself; it must have room
+        for all samples.
+        """
+        grow = out is None
+        y_out = None
+        y_missing = 0
+        X_reordered = []
+        pos = 0
+
+        for fpaths, probas, yb in self.iter_predict_proba(X, y):
+            X_reordered.extend( fpaths )
+            stop = pos + len(probas)
+            if out is None:
+                n_samples = self._n_test_samples(X) or stop
+                out = np.empty(
+                    (n_samples,) + probas.shape[1:], dtype=probas.dtype)
+            if stop > len(out):
+                if not grow:
+                    raise ValueError(
+                        "The batch iterator yielded more than the {} "
+                        "samples that there's room for.".format(len(out)))
+                out = _grow(out, stop)
+            out[pos:stop] = probas
 
-            probas.append(self.apply_batch_func(self.predict_iter_, Xb))
-
-            try:
-                yb = np.reshape( yb, ( len(yb),1 ) )
-            except TypeError:
-                pass
-            y_reordered.append( yb )
-
-        X_reordered = [ val for arr in X_reordered for val in arr ]
-        return np.vstack( probas ),  np.vstack(y_reordered)[:,0], X_reordered
+            if yb is None:
+                y_missing += 1
+            else:
+                yb = np.reshape( yb, ( len(yb),1 ) )[:, 0]
+                if y_out is None:
+                    y_out = np.empty(len(out), dtype=yb.dtype)
+                elif len(y_out) < stop:
+                    y_out = _grow(y_out, len(out))
+                dtype = np.result_type(y_out.dtype, yb.dtype)
+                if dtype != y_out.dtype:
+                    y_out = y_out.astype(dtype)
+                y_out[pos:stop] = yb
+            pos = stop
 
+        if out is None:
+            raise ValueError("The batch iterator yielded no batches.")
+        if y_out is None:
+            # BBB: one 'None' per batch when there are no targets
+            y_out = np.array([None] * y_missing)
+        else:
+            y_out = y_out[:pos]
+        return out[:pos], y_out, X_reordered
 
     def predict(self, X, y=None):
         y_pred, y_reordered, X_reordered = self.predict_proba(X,y)
@@ -705,6 +1446,105 @@ class NeuralNet(BaseEstimator):
                 y_pred = self.enc_.inverse_transform( y_pred )
             return y_pred, y_reordered, X_reordered
 
+    def _n_test_samples(self, X):
+        """Returns the number of samples that the test batch iterator
+        yields for `X`, or `None` if that's not known up front.
+        """
+        n_samples = getattr(self.batch_iterator_test, 'n_samples', None)
+        if isinstance(n_samples, numbers.Integral):
+            return n_samples
+        try:
+            return _batch_size(X)
+        except TypeError:
+            return None
+
+    def get_layer_output_fn(self, layer_name):
+        """Returns a compiled function that maps the net's inputs to
+        the deterministic output of a layer.
+
+        Functions are compiled once per layer, and kept for the
+        lifetime of the net, so that repeated calls, e.g. from
+        :meth:`transform` or the plots in :mod:`visualize`, don't
+        recompile.
+
+        :param layer_name: The name or index of a layer in `layers_`,
+                           or the layer itself.
+        """
+        self.initialize()
+        if isinstance(layer_name, Layer):
+            layer = layer_name
+        else:
+            layer = self.layers_[layer_name]
+
+        layer_output_fns = getattr(self, '_layer_output_fns_', None)
+        if layer_output_fns is None:
+            layer_output_fns = self._layer_output_fns_ = {}
+        func = layer_output_fns.get(layer)
+        if func is None:
+            input_layers = [l for l in self.layers_.values()
+                            if isinstance(l, InputLayer)]
+            func = layer_output_fns[layer] = theano.function(
+                inputs=[theano.Param(l.input_var, name=l.name)
+                        for l in input_layers],
+                outputs=get_output(layer, None, deterministic=True),
+                allow_input_downcast=True,
+                on_unused_input='ignore',
+                )
+        return func
+
+    def iter_transform(self, X, layer=None):
+        """Yields `(fpaths, outputs)` for each batch of `X`, where
+        `outputs` is the output of `layer`, or of the output layer if
+        `layer` is `None`.  See :meth:`transform`.
+        """
+        func = self.get_layer_output_fn(-1 if layer is None else layer)
+        if not isinstance(layer, Layer):
+            layer = self.layers_[-1 if layer is None else layer]
+        k_loaded = _NO_ACCOUNT
+        for k, fpaths, Xb, yb in self._batches(
+                'test', self.batch_iterator_test, X, layer=layer):
+            if self.account_weights and k != k_loaded:
+                self.load_account_weights( k, BEST_LOSS = True )
+                k_loaded = k
+            yield fpaths, self.apply_batch_func(func, Xb)
+
+    def transform(self, X, layer=None, out=None):
+        """Returns the output of `layer` for all samples in `X`, e.g.
+        to extract intermediate embeddings, and the file paths in the
+        order that the test batch iterator visited the samples in.
+
+        Like :meth:`predict_proba`, outputs are written batch by batch
+        into one preallocated array, or into `out` if given.  The
+        array is sized by the test batch iterator's `n_samples` if it
+        has one, or else by `len(X)`, and grows if more samples come.
+
+        :param layer: The name or index of a layer in `layers_`, or
+                      the layer itself.  Defaults to the output layer.
+        """
+        grow = out is None
+        X_reordered = []
+        pos = 0
+
+        for fpaths, outputs in self.iter_transform(X, layer):
+            X_reordered.extend( fpaths )
+            stop = pos + len(outputs)
+            if out is None:
+                n_samples = self._n_test_samples(X) or stop
+                out = np.empty(
+                    (n_samples,) + outputs.shape[1:], dtype=outputs.dtype)
+            if stop > len(out):
+                if not grow:
+                    raise ValueError(
+                        "The batch iterator yielded more than the {} "
+                        "samples that there's room for.".format(len(out)))
+                out = _grow(out, stop)
+            out[pos:stop] = outputs
+            pos = stop
+
+        if out is None:
+            raise ValueError("The batch iterator yielded no batches.")
+        return out[:pos], X_reordered
+
     def get_all_layers(self):
         return self.layers_.values()
 
@@ -713,18 +1553,37 @@ class NeuralNet(BaseEstimator):
         params = sum([l.get_params(**kwargs) for l in layers], [])
         return unique(params)
 
-    def get_all_params_values(self):
+    def get_all_params_values(self, dtype=None):
+        """Returns an ordered dict that maps layer names to lists of
+        parameter values.
+
+        :param dtype: If given, float values are cast to this dtype,
+                      e.g. to :attr:`storage_dtype`.
+        """
         return_value = OrderedDict()
         for name, layer in self.layers_.items():
-            return_value[name] = [p.get_value() for p in layer.get_params()]
+            return_value[name] = [
+                _astype(p.get_value(), dtype) for p in layer.get_params()]
         return return_value
 
     def load_params_from(self, source):
+        """Loads parameter values from `source`.
+
+        :param source: Another :class:`NeuralNet`, a dict like the
+                       return value of :meth:`get_all_params_values`,
+                       or the name of a file written by
+                       :meth:`save_params_to`.  Checkpoint files are
+                       memory-mapped, and only the parameters whose
+                       shapes match are read.
+        """
         self.initialize()
 
         if isinstance(source, basestring):
-            with open(source, 'rb') as f:
-                source = pickle.load(f)
+            if is_checkpoint(source):
+                source = load_checkpoint(source)
+            else:
+                with open(source, 'rb') as f:
+                    source = pickle.load(f)
 
         if isinstance(source, NeuralNet):
             source = source.get_all_params_values()
@@ -738,12 +1597,13 @@ class NeuralNet(BaseEstimator):
             if layer is not None:
                 for p1, p2v in zip(layer.get_params(), values):
 
-                    shape1 = p1.get_value().shape
+                    shape1 = p1.get_value(
+                        borrow=True, return_internal_type=True).shape
                     shape2 = p2v.shape
                     shape1s = 'x'.join(map(str, shape1))
                     shape2s = 'x'.join(map(str, shape2))
                     if shape1 == shape2:
-                        p1.set_value(p2v)
+                        p1.set_value(np.asarray(p2v, dtype=p1.dtype))
 #                        if layer.name == 'conv1':
 #                            print '\nvalues', p1.get_value()
                         if self.verbose:
@@ -754,10 +1614,27 @@ class NeuralNet(BaseEstimator):
                             print(failure.format(
                                 key, shape1s, shape2s))
 
-    def save_params_to(self, fname):
-        params = self.get_all_params_values()
-        with open(fname, 'wb') as f:
-            pickle.dump(params, f, -1)
+    def save_params_to(self, fname, format='pickle'):
+        """Saves the values of all parameters to `fname`.
+
+        :param format: `'pickle'` to pickle the return value of
+                       :meth:`get_all_params_values`, or `'binary'`
+                       to write a checkpoint file with a header and
+                       raw array payloads, which
+                       :meth:`load_params_from` memory-maps.
+
+        With a :attr:`storage_dtype`, values are saved in that dtype,
+        and cast back to the parameters' dtype when loaded.
+        """
+        params = self.get_all_params_values(dtype=self.storage_dtype)
+        if format == 'binary':
+            save_checkpoint(fname, params)
+        elif format == 'pickle':
+            with open(fname, 'wb') as f:
+                pickle.dump(params, f, -1)
+        else:
+            raise ValueError("Unknown format {!r}; must be 'pickle' or "
+                             "'binary'.".format(format))
 
     def load_weights_from(self, source):
         warn("The 'load_weights_from' method will be removed in nolearn 0.6. "
@@ -776,62 +1653,133 @@ class NeuralNet(BaseEstimator):
              "Please use 'save_params_to' instead.")
         return self.save_params_to(fname)
 
+    def _get_account_store(self):
+        if self.account_store is not None:
+            return self.account_store
+        account_store = getattr(self, '_account_store', None)
+        if account_store is None:
+            account_store = self._account_store = PickleAccountStore(
+                self.HOME + 'trainedParams/' + self.fp_accW + '_')
+        return account_store
+
+    def _read_account_params(self, k, BEST_LOSS=False):
+        account_store = self._get_account_store()
+        names = self.account_weight_layers
+        try:
+            stored = account_store.load(k, names, best=BEST_LOSS)
+            if stored is None and BEST_LOSS:
+                stored = account_store.load(k, names)
+        except Exception:
+            # Unreadable weights, e.g. a truncated pickle, are
+            # initialized anew like missing ones:
+            stored = None
+        if stored is None:
+            stored = {}
+
+        params = OrderedDict()
+        for name in names:
+            layer = self.layers_[name]
+            bval = None
+            try:
+                Wval, bval = stored[name]
+                Wval = np.asarray(Wval)
+                if layer.b is not None:
+                    if bval is None:
+                        raise KeyError(name + '_b')
+                    bval = np.asarray(bval)
+                    if len(np.shape(bval)) == 0:
+                        bval = np.reshape(bval, (1,))
+            except Exception:
+                print('init weights: {}'.format(k))
+                uniformInit = Uniform()
+                Wval = uniformInit.sample(np.shape(layer.W.get_value()))
+                if layer.b is not None:
+                    bval = uniformInit.sample(np.shape(layer.b.get_value()))
+            dtype = layer.W.dtype
+            params[name] = (_astype(Wval, dtype), _astype(bval, dtype))
+        return params
+
+    def _write_account_params(self, k, params, BEST_LOSS=False):
+        self._get_account_store().save(k, params, best=BEST_LOSS)
+
+    def _get_account_params(self, BEST_LOSS=False):
+        # Account weights that training continues from are kept in the
+        # layer's dtype, so that updates smaller than what the
+        # storage_dtype can represent aren't lost from one swap to the
+        # next.  Only best-loss weights, which are never trained
+        # further, are kept in the storage_dtype:
+        dtype = self.storage_dtype if BEST_LOSS else None
+        params = OrderedDict()
+        for name in self.account_weight_layers:
+            layer = self.layers_[name]
+            b = layer.b.get_value() if layer.b is not None else None
+            params[name] = (
+                _astype(layer.W.get_value(), dtype), _astype(b, dtype))
+        return params
+
+    def _set_account_params(self, params):
+        for name, (W, b) in params.items():
+            layer = self.layers_[name]
+            layer.W.set_value(np.asarray(W, dtype=layer.W.dtype))
+            if layer.b is not None:
+                layer.b.set_value(np.asarray(b, dtype=layer.b.dtype))
+
+    def _get_account_cache(self):
+        if not self.account_cache_bytes:
+            return None
+        account_cache = getattr(self, '_account_cache', None)
+        if account_cache is None:
+            account_cache = self._account_cache = AccountWeightCache(
+                load=self._read_account_params,
+                save=self._write_account_params,
+                max_bytes=self.account_cache_bytes,
+                )
+        return account_cache
+
     def load_account_weights( self, k, BEST_LOSS=False ):
         '''
         Function to load account specific weights
+
+        With `account_cache_bytes` set, weights are served from an
+        in-memory LRU cache and only read from disk on a miss.
         '''
-        if BEST_LOSS:
-            fpath = self.HOME+'trainedParams/'+self.fp_accW+'_'+str(k)+'_loss_prms.pkl'
-            if not os.path.isfile( fpath ):
-                fpath = self.HOME+'trainedParams/'+self.fp_accW+'_'+str(k)+'.pkl'
+        account_cache = self._get_account_cache()
+        if account_cache is None:
+            params = self._read_account_params(k, BEST_LOSS)
+        elif BEST_LOSS:
+            # The fallback for missing best-loss weights are the
+            # regular account weights, which must be current on disk:
+            account_cache.flush()
+            params = self._read_account_params(k, BEST_LOSS)
         else:
-            fpath = self.HOME+'trainedParams/'+self.fp_accW+'_'+str(k)+'.pkl'
-        
-        for name in self.account_weight_layers:
-            try:
-                with open( fpath, 'r' ) as f:
-                    paramDic = pickle.load( f )
-                    Wval = paramDic[ str(k)+name ].astype( np.float32 )
-                    if self.layers_[ name ].b is not None:
-                        bval = paramDic[ str(k)+name+'_b' ].astype( np.float32 )
-                        if len( np.shape( bval ) ) == 0:
-                            bval = np.reshape( bval, (1,) )
-            except:
-                print 'init weights: ', k
-                uniformInit = Uniform()
-                Wval = uniformInit.sample( np.shape( self.layers_[ name ].W.get_value() ) )
-                if self.layers_[ name ].b is not None:
-                    bval = uniformInit.sample( np.shape( self.layers_[ name ].b.get_value() ) )
-        
-            self.layers_[ name ].W.set_value( Wval )
-            if self.layers_[ name ].b is not None:
-                self.layers_[ name ].b.set_value( bval )
+            params = account_cache.get(k)
+        self._set_account_params(params)
 
     def save_account_weights( self, k, BEST_LOSS=False ):
         '''
         Function that stores account specific weights
+
+        With `account_cache_bytes` set, weights are written back to
+        disk only when evicted from the cache or flushed.
         '''
-        fpath = self.HOME+'trainedParams/'+self.fp_accW+'_'+str(k)+'.pkl'
-        if BEST_LOSS:
-            fpath = self.HOME+'trainedParams/'+self.fp_accW+'_'+str(k)+'_loss_prms.pkl'
-
-        if os.path.isfile( fpath ):
-            with open( fpath, 'r' ) as f:
-                paramDic = pickle.load( f )
-                
+        params = self._get_account_params(BEST_LOSS)
+        account_cache = self._get_account_cache()
+        if account_cache is None or BEST_LOSS:
+            self._write_account_params(k, params, BEST_LOSS)
         else:
-            paramDic = {}
-           
-        for name in self.account_weight_layers:
-            W = self.layers_[ name ].W.get_value()
-            paramDic[ str(k)+name ] = W
-
-            if self.layers_[ name ].b is not None:
-                b = self.layers_[ name ].b.get_value()
-                paramDic[ str(k)+name+'_b' ] = b
-
-        with open( fpath, 'w' ) as f:
-            pickle.dump( paramDic, f )
+            account_cache.put(k, params)
+
+    def flush_account_weights(self):
+        """Write all account weights held in the cache or in the
+        account store's buffers to disk.
+        """
+        account_cache = getattr(self, '_account_cache', None)
+        if account_cache is not None:
+            account_cache.flush()
+        account_store = self.account_store or getattr(
+            self, '_account_store', None)
+        if account_store is not None:
+            account_store.flush()
 
     def __getstate__(self):
         state = dict(self.__dict__)
@@ -840,12 +1788,30 @@ class NeuralNet(BaseEstimator):
             'eval_iter_',
             'predict_iter_',
             '_initialized',
+            '_account_cache',
+            '_account_store',
+            '_iter_graph_',
+            '_layer_output_fns_',
+            '_shared_data_',
+            '_parallel_',
             ):
             if attr in state:
                 del state[attr]
         return state
 
     def __setstate__(self, state):
+        # BBB: nets pickled before these parameters existed
+        for name, value in (
+            ('account_cache_bytes', 0),
+            ('account_store', None),
+            ('shared_data', False),
+            ('shared_data_max_bytes', 512 * 1024 ** 2),
+            ('compile_cache_dir', None),
+            ('n_workers', 1),
+            ('sync_every', 1),
+            ('storage_dtype', None),
+            ):
+            state.setdefault(name, value)
         self.__dict__.update(state)
         self.initialize()
 
@@ -0,0 +1,126 @@
+"""A binary checkpoint format for the parameters of a network.
+
+A checkpoint file starts with a small header that lists, for every
+parameter, the layer name, the parameter's index within its layer,
+its dtype, its shape, and the offset of its payload.  The raw array
+payloads follow the header, each aligned to :data:`ALIGNMENT` bytes,
+so that they can be memory-mapped in place.
+
+Reading the header alone is enough to compare shapes; array data is
+only paged in once it's actually used.
+"""
+
+from collections import OrderedDict
+import json
+import os
+import struct
+
+import numpy as np
+
+
+MAGIC = b'NLCKPT\x00\x01'
+ALIGNMENT = 64
+_LENGTH = struct.Struct('<Q')
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def is_checkpoint(fname):
+    """Returns `True` if `fname` is a file in checkpoint format.
+    """
+    if not os.path.isfile(fname):
+        return False
+    with open(fname, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def read_header(fname):
+    """Returns the list of parameter entries in the header of the
+    checkpoint `fname`, and the file offset of the payload section.
+
+    Each entry is a dict with the keys `layer`, `index`, `dtype`,
+    `shape` and `offset`, where `offset` is relative to the start of
+    the payload section.
+    """
+    with open(fname, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} is not a checkpoint file.".format(fname))
+        length, = _LENGTH.unpack(f.read(_LENGTH.size))
+        header = json.loads(f.read(length).decode('utf-8'))
+    data_offset = _align(len(MAGIC) + _LENGTH.size + length)
+    for entry in header['params']:
+        entry['shape'] = tuple(entry['shape'])
+    return header['params'], data_offset
+
+
+def save_checkpoint(fname, params):
+    """Writes `params` to `fname`.
+
+    :param fname: A file name, or a file object opened for writing in
+                  binary mode.
+
+    :param params: An ordered dict that maps layer names to lists of
+                   arrays, like the return value of
+                   :meth:`NeuralNet.get_all_params_values`.
+    """
+    if not hasattr(fname, 'write'):
+        with open(fname, 'wb') as f:
+            return save_checkpoint(f, params)
+    f = fname
+
+    entries = []
+    arrays = []
+    offset = 0
+    for layer_name, values in params.items():
+        for index, value in enumerate(values):
+            value = np.ascontiguousarray(value)
+            entries.append({
+                'layer': layer_name,
+                'index': index,
+                'dtype': value.dtype.str,
+                'shape': list(value.shape),
+                'offset': offset,
+                })
+            arrays.append(value)
+            offset = _align(offset + value.nbytes)
+
+    header = json.dumps({'params': entries}).encode('utf-8')
+    data_offset = _align(len(MAGIC) + _LENGTH.size + len(header))
+
+    f.write(MAGIC)
+    f.write(_LENGTH.pack(len(header)))
+    f.write(header)
+    for entry, value in zip(entries, arrays):
+        f.write(b'\x00' * (data_offset + entry['offset'] - f.tell()))
+        value.tofile(f)
+
+
+def load_checkpoint(fname, mmap_mode='r'):
+    """Returns the parameters stored in `fname` as an ordered dict
+    that maps layer names to lists of arrays.
+
+    :param mmap_mode: The mode that arrays are memory-mapped with, or
+                      `None` to read them into memory.
+    """
+    entries, data_offset = read_header(fname)
+    params = OrderedDict()
+    with open(fname, 'rb') as f:
+        for entry in entries:
+            dtype = np.dtype(entry['dtype'])
+            shape = entry['shape']
+            offset = data_offset + entry['offset']
+            if mmap_mode is None:
+                f.seek(offset)
+                count = int(np.prod(shape))
+                value = np.fromfile(f, dtype=dtype, count=count)
+                value = value.reshape(shape)
+            elif 0 in shape:
+                value = np.empty(shape, dtype=dtype)
+            else:
+                value = np.memmap(
+                    f, dtype=dtype, mode=mmap_mode, offset=offset,
+                    shape=shape)
+            params.setdefault(entry['layer'], []).append(value)
+    return params
@@ -0,0 +1,127 @@
+"""Trains a :class:`NeuralNet` on every fold of a k-fold split, in
+parallel, and aggregates the per-fold training histories.
+"""
+
+import numbers
+
+from joblib import delayed
+from joblib import Parallel
+import numpy as np
+from sklearn.base import clone
+from sklearn.cross_validation import KFold
+from sklearn.cross_validation import StratifiedKFold
+
+from .base import _sldict
+
+
+def _fit_fold(net, X, y, train_indices, valid_indices, return_params):
+    net = clone(net)
+    net.fit(
+        _sldict(X, train_indices), y[train_indices],
+        _sldict(X, valid_indices), y[valid_indices],
+        )
+    params = net.get_all_params_values() if return_params else None
+    return net.train_history_, params
+
+
+def aggregate_histories(histories):
+    """Aggregates a list of train histories, one per fold, into one.
+
+    For every epoch, the result has the mean and standard deviation
+    over folds of each numeric key, as `<key>_mean` and `<key>_std`,
+    along with `n_folds`, the number of folds that got as far as that
+    epoch.  Folds may have stopped early, so later epochs can be
+    based on fewer folds.
+    """
+    history = []
+    for i in range(max([len(h) for h in histories] or [0])):
+        rows = [h[i] for h in histories if len(h) > i]
+        info = {'epoch': i + 1, 'n_folds': len(rows)}
+        keys = set(rows[0]).intersection(*rows[1:])
+        keys.discard('epoch')
+        for key in sorted(keys):
+            values = [row[key] for row in rows]
+            if all(isinstance(v, numbers.Number) and
+                   not isinstance(v, bool) for v in values):
+                info[key + '_mean'] = np.mean(values)
+                info[key + '_std'] = np.std(values)
+        history.append(info)
+    return history
+
+
+class CrossValidation(object):
+    """Runs k-fold cross-validation of a :class:`NeuralNet`.
+
+    Each fold is trained on a fresh clone of `net`, in a process
+    pool.  Input arrays larger than `max_nbytes` are dumped to disk
+    once, and memory-mapped read-only into the worker processes
+    instead of being copied into each of them.
+
+    After :meth:`fit`, the results are in these attributes:
+
+    - `histories_`: the `train_history_` of each fold
+    - `history_`: the histories aggregated by
+      :func:`aggregate_histories`
+    - `best_valid_loss_`: the best validation loss of each fold
+    - `params_`: the final parameter values of each fold, if
+      `return_params` is true
+    """
+    def __init__(self, net, n_folds=5, stratify=True, n_jobs=1,
+                 max_nbytes='1M', return_params=False, verbose=0):
+        """
+        :param net: The net to cross-validate.  It's cloned through
+                    its :meth:`get_params` for each fold, so it's not
+                    trained itself.
+
+        :param n_folds: The number of folds.
+
+        :param stratify: Whether to use stratified folds for
+                         classification nets.
+
+        :param n_jobs: The number of worker processes, as in
+                       :class:`joblib.Parallel`.  Since worker
+                       processes are daemonic, nets can't use
+                       `n_workers > 1` for data-parallel training in
+                       them.
+
+        :param max_nbytes: Arrays larger than this are memory-mapped
+                           into worker processes, as in
+                           :class:`joblib.Parallel`.
+        """
+        self.net = net
+        self.n_folds = n_folds
+        self.stratify = stratify
+        self.n_jobs = n_jobs
+        self.max_nbytes = max_nbytes
+        self.return_params = return_params
+        self.verbose = verbose
+
+    def folds(self, y):
+        if self.net.regression or not self.stratify:
+            return list(KFold(y.shape[0], self.n_folds))
+        else:
+            return list(StratifiedKFold(y, self.n_folds))
+
+    def fit(self, X, y):
+        parallel = Parallel(
+            n_jobs=self.n_jobs,
+            max_nbytes=self.max_nbytes,
+            mmap_mode='r',
+            verbose=self.verbose,
+            )
+        results = parallel(
+            delayed(_fit_fold)(
+                self.net, X, y, train_indices, valid_indices,
+                self.return_params)
+            for train_indices, valid_indices in self.folds(y)
+            )
+
+        self.histories_ = [history for history, params in results]
+        self.history_ = aggregate_histories(self.histories_)
+        self.best_valid_loss_ = np.array([
+            min([row['valid_loss'] for row in history])
+            for history in self.histories_
+            ])
+        if self.return_params:
+            self.params_ = [params for history, params in results]
+        return self
@@ -3,27 +3,67 @@ from csv import DictWriter
 from datetime import datetime
 from functools import reduce
 import operator
+import os
 import sys
+import threading
 
 import numpy
 from tabulate import tabulate
 
 from lasagne.objectives import squared_error
+import theano
 
 from .._compat import pickle
+from .checkpoint import save_checkpoint
+from .sinks import CSVSink
 from .util import ansi
 from .util import get_conv_infos
 from .util import is_conv2d
 
 
 class PrintLog:
-    def __init__(self):
+    # The columns of the tracker file that PrintLog writes by default:
+    tracker_columns = (
+        'train_loss',
+        'valid_loss',
+        'train/val',
+        'train_accuracy',
+        'valid_accuracy',
+        'dur',
+        )
+
+    def __init__(self, sink=None):
+        """
+        :param sink: A :class:`~nolearn.lasagne.sinks.MetricsSink`
+                     that I write each entry of the train history to,
+                     along with its `'train/val'` loss ratio.
+                     Defaults to a :class:`~nolearn.lasagne.sinks.CSVSink`
+                     that writes :attr:`tracker_columns` to
+                     ``HOME + 'trainedParams/<identifier>_tracker.csv'``.
+                     Pass `False` to not record anything.
+        """
         self.first_iteration = True
+        self.sink = sink
 
     def __call__(self, nn, train_history):
         print(self.table(nn, train_history))
         sys.stdout.flush()
 
+        if getattr(self, 'sink', None) is None:
+            self.sink = CSVSink(
+                nn.HOME + 'trainedParams/' + str(nn.identifier) +
+                '_tracker.csv',
+                columns=self.tracker_columns,
+                )
+        if self.sink is not False:
+            info = dict(train_history[-1])
+            info['train/val'] = info['train_loss'] / info['valid_loss']
+            self.sink.write(info)
+
+    def close(self):
+        if getattr(self, 'sink', None):
+            self.sink.close()
+
     def table(self, nn, train_history):
         info = train_history[-1]
 
@@ -48,48 +88,106 @@ class PrintLog:
         if nn.custom_score:
             info_tabulate[nn.custom_score[0]] = info[nn.custom_score[0]]
 
+        # The phases in the first entry make the columns, so that
+        # rows line up with the header:
+        dur_keys = getattr(self, '_dur_keys', None)
+        if self.first_iteration or dur_keys is None:
+            dur_keys = self._dur_keys = sorted(
+                key for key in info if key.startswith('dur_'))
         info_tabulate['dur'] = "{:.2f}s".format(info['dur'])
+        for key in dur_keys:
+            info_tabulate[key] = "{:.2f}s".format(info.get(key, 0.))
 
         tabulated = tabulate(
             [info_tabulate], headers="keys", floatfmt='.5f')
 
         out = ""
-        fname=nn.HOME+'trainedParams/'+nn.identifier+'_tracker.csv'
         if self.first_iteration:
             out = "\n".join(tabulated.split('\n', 2)[:2])
             out += "\n"
             self.first_iteration = False
 
-            f = open( fname, 'w' )
-            f.write( 'train_loss,valid_loss,train/val,train_accuracy,valid_accuracy,dur\n')
-            f.close()
-
-        f = open( fname, 'a' )
-        f.write( str(round( info['train_loss'], 4))+','+\
-                 str(round( info['valid_loss'], 4))+','+\
-                 str(round( info['train_loss']/info['valid_loss'], 3))+','+\
-                 str(round( info['train_accuracy'], 3))+','+\
-                 str(round( info['valid_accuracy'], 3))+','+\
-                 str(round( info['dur'], 3))+'\n')
-        f.close()
-
         out += tabulated.rsplit('\n', 1)[-1]
         return out
 
 
+def _write_atomic(path, write):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp_path, path)
+
+
+class _BackgroundWriter(object):
+    """Writes files in a background thread, one at a time.
+    """
+    def __init__(self):
+        self._thread = None
+        self._error = None
+
+    def submit(self, path, write):
+        # Back-pressure: wait for the previous write to finish first.
+        self.wait()
+        self._thread = threading.Thread(
+            target=self._run, args=(path, write))
+        self._thread.start()
+
+    def _run(self, path, write):
+        try:
+            _write_atomic(path, write)
+        except Exception as e:
+            self._error = e
+
+    def wait(self):
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+
 class SaveWeights:
     def __init__(self, path, every_n_epochs=1, only_best=False,
-                 pickle=False, verbose=0):
+                 pickle=False, verbose=0, background=False,
+                 format='pickle'):
+        """
+        :param background: If true, I take a snapshot of the
+                           parameters and leave serialization and
+                           writing to a background thread, so that
+                           training can continue in the meantime.
+                           Files are written to a temporary file
+                           first, synced, and renamed into place.  If
+                           a write is still in progress when the next
+                           one is due, I wait for it to finish.  When
+                           training ends, :meth:`NeuralNet.train_loop`
+                           waits for the last write through
+                           :meth:`close`, which also raises any error
+                           that the write ran into.  With
+                           `pickle=True`, the net is still pickled in
+                           the foreground; only the writing happens in
+                           the background.
+
+        :param format: The format that parameters are saved in, as in
+                       :meth:`NeuralNet.save_params_to`.
+        """
         self.path = path
         self.every_n_epochs = every_n_epochs
         self.only_best = only_best
         self.pickle = pickle
         self.verbose = verbose
+        self.background = background
+        self.format = format
+        self._writer = None
+        self._best_valid_loss = None
+        self._history_seen = (None, 0)
 
     def __call__(self, nn, train_history):
         if self.only_best:
             this_loss = train_history[-1]['valid_loss']
-            best_loss = min([h['valid_loss'] for h in train_history])
+            best_loss = self._best_loss(train_history)
             if this_loss > best_loss:
                 return
 
@@ -106,19 +204,71 @@ class SaveWeights:
         if self.verbose:
             print("Writing {}".format(path))
 
-        if self.pickle:
+        if self.background:
+            self._save_background(nn, path)
+        elif self.pickle:
             with open(path, 'wb') as f:
                 pickle.dump(nn, f, -1)
+        elif self.format != 'pickle':
+            nn.save_params_to(path, format=self.format)
         else:
             nn.save_params_to(path)
 
+    def _best_loss(self, train_history):
+        # Keep a running minimum, and only look at the entries that
+        # were added since the last call.  Start over for a new
+        # history, e.g. after a refit.
+        history_id, seen = getattr(self, '_history_seen', (None, 0))
+        if history_id != id(train_history) or seen > len(train_history):
+            self._best_valid_loss, seen = None, 0
+        for info in train_history[seen:]:
+            if (self._best_valid_loss is None or
+                    info['valid_loss'] < self._best_valid_loss):
+                self._best_valid_loss = info['valid_loss']
+        self._history_seen = (id(train_history), len(train_history))
+        return self._best_valid_loss
+
+    def _save_background(self, nn, path):
+        if self.pickle:
+            data = pickle.dumps(nn, -1)
+
+            def write(f):
+                f.write(data)
+        else:
+            params = nn.get_all_params_values(dtype=nn.storage_dtype)
+            if self.format == 'binary':
+                def write(f):
+                    save_checkpoint(f, params)
+            else:
+                def write(f):
+                    pickle.dump(params, f, -1)
+
+        if getattr(self, '_writer', None) is None:
+            self._writer = _BackgroundWriter()
+        self._writer.submit(path, write)
+
+    def wait(self):
+        """Blocks until any write in progress has finished, and
+        raises the error of a write that failed.
+        """
+        if getattr(self, '_writer', None) is not None:
+            self._writer.wait()
+
+    def close(self):
+        self.wait()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_writer'] = None
+        return state
+
 
 class _RestoreBestWeights:
     def __init__(self, remember):
         self.remember = remember
 
     def __call__(self, nn, train_history):
-        nn.load_params_from(self.remember.best_weights)
+        self.remember.load_best_weights(nn)
         if self.remember.verbose:
             print("Loaded best weights from epoch {} where {} was {}".format(
                 self.remember.best_weights_epoch,
@@ -129,14 +279,31 @@ class _RestoreBestWeights:
 
 
 class RememberBestWeights:
-    def __init__(self, loss='valid_loss', score=None, verbose=1):
+    def __init__(self, loss='valid_loss', score=None, verbose=1,
+                 store='copy'):
+        """
+        :param store: How I keep the best weights.  With `'copy'`,
+                      `best_weights` is a fresh copy of
+                      :meth:`NeuralNet.get_all_params_values` on every
+                      improvement.  With `'host'`, the arrays in
+                      `best_weights` are allocated once and then
+                      overwritten in place.  With `'device'`,
+                      `best_weights` holds shadow shared variables
+                      that parameters are copied into on the device,
+                      without a round trip through host memory.
+        """
+        if store not in ('copy', 'host', 'device'):
+            raise ValueError("Unknown store {!r}; must be 'copy', 'host' "
+                             "or 'device'.".format(store))
         self.loss = loss
         self.score = score
         self.verbose = 1
+        self.store = store
         self.best_weights = None
         self.best_weights_loss = sys.maxsize
         self.best_weights_epoch = None
         self.restore = _RestoreBestWeights(self)
+        self._copy_funcs = {}
 
     def __call__(self, nn, train_history):
         key = self.score if self.score is not None else self.loss
@@ -146,10 +313,68 @@ class RememberBestWeights:
             curr_loss *= -1
 
         if curr_loss < self.best_weights_loss:
-            self.best_weights = nn.get_all_params_values()
+            self._remember(nn)
             self.best_weights_loss = curr_loss
             self.best_weights_epoch = train_history[-1]['epoch']
 
+    def _remember(self, nn):
+        store = getattr(self, 'store', 'copy')
+        if store == 'device':
+            self._device_copy(nn)()
+        elif store == 'host' and self.best_weights is not None:
+            for name, layer in nn.layers_.items():
+                for buf, param in zip(self.best_weights[name],
+                                      layer.get_params()):
+                    buf[...] = param.get_value(borrow=True)
+        else:
+            self.best_weights = nn.get_all_params_values()
+
+    def _device_copy(self, nn, restore=False):
+        if self.best_weights is None:
+            shadows = {}
+            self.best_weights = OrderedDict()
+            for name, layer in nn.layers_.items():
+                self.best_weights[name] = []
+                for param in layer.get_params():
+                    if param not in shadows:
+                        shadows[param] = theano.shared(
+                            param.get_value(),
+                            broadcastable=param.broadcastable,
+                            )
+                    self.best_weights[name].append(shadows[param])
+
+        pairs = OrderedDict()
+        for name, layer in nn.layers_.items():
+            for param, shadow in zip(layer.get_params(),
+                                     self.best_weights[name]):
+                pairs.setdefault(param, shadow)
+
+        # Compiled copy functions are keyed by the net's parameters,
+        # so that they're recompiled for a different net:
+        params = tuple(pairs.keys())
+        cached = self._copy_funcs.get(restore)
+        if cached is None or cached[0] != params:
+            if restore:
+                updates = [(param, shadow) for param, shadow in pairs.items()]
+            else:
+                updates = [(shadow, param) for param, shadow in pairs.items()]
+            cached = self._copy_funcs[restore] = (
+                params, theano.function([], [], updates=updates))
+        return cached[1]
+
+    def load_best_weights(self, nn):
+        """Loads the best weights I remember into `nn`.
+        """
+        if getattr(self, 'store', 'copy') == 'device':
+            self._device_copy(nn, restore=True)()
+        else:
+            nn.load_params_from(self.best_weights)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_copy_funcs'] = {}
+        return state
+
 
 class PrintLayerInfo:
     def __init__(self):
@@ -226,42 +451,64 @@ class PrintLayerInfo:
 
         return layer_infos, legend
 
+_WEIGHT_STATS = ('wdiff', 'wabsmean', 'wmean', 'wmin', 'wmax', 'wstd')
+
+
 class WeightLog:
     """Keep a log of your network's weights and weight changes.
 
     Pass instances of :class:`WeightLog` as an `on_batch_finished`
     handler into your network.
+
+    For a :class:`NeuralNet`, statistics are computed on the device by
+    a single compiled Theano function, which compares the weights
+    against a previous copy that's also kept on the device.  Only the
+    statistics themselves are transferred to the host.
     """
-    def __init__(self, save_to=None, write_every=8):
+    def __init__(self, save_to=None, write_every=8, sink=None,
+                 every_n_batches=1):
         """
         :param save_to: If given, `save_to` must be a path into which
                         I will write weight statistics in CSV format.
+
+        :param sink: If given, a
+                     :class:`~nolearn.lasagne.sinks.MetricsSink` that
+                     I write weight statistics to.
+
+        :param every_n_batches: Only compute statistics for every
+                                n-th batch.  `wdiff` is then the
+                                change since the last batch that was
+                                sampled.
         """
         self.last_weights = None
         self.history = []
         self.save_to = save_to
         self.write_every = write_every
+        self.sink = sink
+        self.every_n_batches = every_n_batches
         self._dictwriter = None
         self._save_to_file = None
+        self._stats_func = None
+        self._calls = 0
         self.PRINTED = False
 
     def __call__(self, nn, train_history):
-        weights = nn.get_all_params_values()
+        calls = getattr(self, '_calls', 0)
+        self._calls = calls + 1
+        if calls % getattr(self, 'every_n_batches', 1) != 0:
+            return
+
+        stats = self._device_stats(nn)
+        if stats is None:
+            stats = self._host_stats(nn)
 
         if self.save_to and self._dictwriter is None:
             fieldnames = []
-            for key in weights.keys():
-                for i, p in enumerate(weights[key]):
-                    fieldnames.extend([
-                        '{}_{} wdiff'.format(key, i),
-                        '{}_{} wabsmean'.format(key, i),
-                        '{}_{} wmean'.format(key, i),
-                        '{}_{} wmin'.format(key, i),
-                        '{}_{} wmax'.format(key, i),
-                        '{}_{} wstd'.format(key, i),
-                        ])
-
-            newfile = self.last_weights is None
+            for key in stats.keys():
+                fieldnames.extend(
+                    '{} {}'.format(key, stat) for stat in _WEIGHT_STATS)
+
+            newfile = not self.history
             if newfile:
                 self._save_to_file = open(self.save_to, 'w')
             else:
@@ -271,42 +518,96 @@ class WeightLog:
                 self._dictwriter.writeheader()
 
         entry = {}
-        lw = self.last_weights if self.last_weights is not None else weights
         if not self.PRINTED:
             print '\nMEAN and VARIANCES of layer weights\n'
-        for key in weights.keys():
-            for i, (p1, p2) in enumerate(zip(lw[key], weights[key])):
-                wdiff = numpy.abs(p1 - p2).mean()
-                wabsmean = numpy.abs(p2).mean()
-                wmean = p2.mean()
-                wmin  = p2.min()
-                wmax  = p2.max()
-                wstd  = p2.std()
-                entry.update({
-                    '{}_{} wdiff'.format(key, i): wdiff,
-                    '{}_{} wabsmean'.format(key, i): wabsmean,
-                    '{}_{} wmean'.format(key, i): wmean,
-                    '{}_{} wmin'.format(key, i): wmin,
-                    '{}_{} wmax'.format(key, i): wmax,
-                    '{}_{} wstd'.format(key, i): wstd,
-                    })
-                if not self.PRINTED:
-                    print key, wmean, wstd
+        for key, values in stats.items():
+            for stat, value in zip(_WEIGHT_STATS, values):
+                entry['{} {}'.format(key, stat)] = value
+            if not self.PRINTED:
+                print key.rsplit('_', 1)[0], values[2], values[5]
 
         if not self.PRINTED:
             print ''
             self.PRINTED = True
         self.history.append(entry)
+        if getattr(self, 'sink', None) is not None:
+            self.sink.write(entry)
 
         if self.save_to:
             if len(self.history) % self.write_every == 0:
                 self._dictwriter.writerows(self.history[-self.write_every:])
                 self._save_to_file.flush()
 
+    def close(self):
+        if getattr(self, 'sink', None) is not None:
+            self.sink.close()
+
+    def _host_stats(self, nn):
+        weights = nn.get_all_params_values()
+        lw = self.last_weights if self.last_weights is not None else weights
+        stats = OrderedDict()
+        for key in weights.keys():
+            for i, (p1, p2) in enumerate(zip(lw[key], weights[key])):
+                stats['{}_{}'.format(key, i)] = (
+                    numpy.abs(p1 - p2).mean(),
+                    numpy.abs(p2).mean(),
+                    p2.mean(),
+                    p2.min(),
+                    p2.max(),
+                    p2.std(),
+                    )
         self.last_weights = weights
+        return stats
+
+    def _device_stats(self, nn):
+        layers = getattr(nn, 'layers_', None)
+        if not isinstance(layers, dict):
+            return None
+
+        keys, params = [], []
+        for name, layer in layers.items():
+            for i, param in enumerate(layer.get_params()):
+                keys.append('{}_{}'.format(name, i))
+                params.append(param)
+        if not params:
+            return OrderedDict()
+
+        func = getattr(self, '_stats_func', None)
+        if func is None or func[0] != params:
+            func = self._stats_func = (params, self._compile_stats(params))
+        values = func[1]().reshape(len(params), len(_WEIGHT_STATS))
+        return OrderedDict(zip(keys, values.tolist()))
+
+    @staticmethod
+    def _compile_stats(params):
+        previous = OrderedDict()
+        for param in params:
+            if param not in previous:
+                previous[param] = theano.shared(
+                    param.get_value(),
+                    broadcastable=param.broadcastable,
+                    )
+
+        floatX = theano.config.floatX
+        stats = []
+        for param in params:
+            stats.extend([
+                abs(param - previous[param]).mean(),
+                abs(param).mean(),
+                param.mean(),
+                param.min(),
+                param.max(),
+                param.std(),
+                ])
+        return theano.function(
+            [],
+            theano.tensor.stack([stat.astype(floatX) for stat in stats]),
+            updates=[(prev, param) for param, prev in previous.items()],
+            )
 
     def __getstate__(self):
         state = dict(self.__dict__)
         state['_save_to_file'] = None
         state['_dictwriter'] = None
+        state['_stats_func'] = None
         return state
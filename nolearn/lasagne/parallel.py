@@ -0,0 +1,270 @@
+"""Data-parallel training of a :class:`NeuralNet` on several CPU
+cores.
+
+Every batch is split into one shard per worker.  The parent process
+trains on the first shard itself, and each of the ``n_workers - 1``
+worker processes trains a replica of the net on one of the other
+shards.  Parameters are averaged through shared memory, weighted by
+the number of samples that each replica has seen since the last
+average.  Along with the parameters, this goes for any other shared
+variables of `train_iter_`, such as a shared learning rate, and the
+state of the updates.  Replicas load the parent's values after every
+average, so that changes that handlers make to the net in between are
+seen by all of them.
+
+Worker processes are forked after `train_iter_` has been compiled, so
+they start out with a copy of the compiled function.  Theano's GPU
+backends can't be used across a fork; this is meant for CPU training.
+"""
+
+import ctypes
+import multiprocessing
+import signal
+import traceback
+
+import numpy as np
+
+
+def _n_samples(Xb):
+    if isinstance(Xb, dict):
+        Xb = next(iter(Xb.values()))
+    return len(Xb)
+
+
+def _shard(value, sl):
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        return dict((key, _shard(v, sl)) for key, v in value.items())
+    return value[sl]
+
+
+def _shared_variables(net):
+    """Returns the parameters of `net`, followed by the other shared
+    variables of its `train_iter_`.
+    """
+    variables = list(net.get_all_params())
+    get_shared = getattr(net.train_iter_, 'get_shared', None)
+    if get_shared is not None:
+        seen = set(id(var) for var in variables)
+        for var in get_shared():
+            if id(var) not in seen:
+                seen.add(id(var))
+                variables.append(var)
+    return variables
+
+
+class _ParamBuffer(object):
+    """`n_slots` copies of a list of parameters, laid out in one block
+    of shared memory.
+    """
+    def __init__(self, params, n_slots):
+        self.shapes = []
+        self.dtypes = []
+        self.offsets = []
+        nbytes = 0
+        for param in params:
+            value = param.get_value(borrow=True)
+            self.shapes.append(value.shape)
+            self.dtypes.append(value.dtype)
+            self.offsets.append(nbytes)
+            nbytes += value.nbytes
+        self.slot_nbytes = nbytes
+        self.raw = multiprocessing.RawArray(
+            ctypes.c_char, max(nbytes * n_slots, 1))
+
+    def views(self, slot):
+        views = []
+        base = slot * self.slot_nbytes
+        for shape, dtype, offset in zip(
+                self.shapes, self.dtypes, self.offsets):
+            count = int(np.prod(shape))
+            views.append(np.frombuffer(
+                self.raw, dtype=dtype, count=count,
+                offset=base + offset).reshape(shape))
+        return views
+
+
+def _worker(net, conn, shared, results, slot):
+    # Ctrl-C is handled by the parent, which then stops the workers:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    train_iter = net.train_iter_
+    params = _shared_variables(net)
+    shared_views = shared.views(0)
+    result_views = results.views(slot)
+
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        kind, load, sync, Xb, yb = message
+        try:
+            if load:
+                for param, value in zip(params, shared_views):
+                    param.set_value(value)
+            loss = None
+            if kind == 'train' and _n_samples(Xb):
+                loss = net.apply_batch_func(train_iter, Xb, yb)
+            if sync:
+                for param, view in zip(params, result_views):
+                    view[...] = param.get_value(borrow=True)
+            conn.send(('ok', loss))
+        except Exception:
+            conn.send(('error', traceback.format_exc()))
+    conn.close()
+
+
+class DataParallelTrainer(object):
+    """Trains `net` on shards of each batch in `n_workers` processes.
+
+    :class:`NeuralNet` creates one of these in `train_loop` when its
+    `n_workers` parameter is greater than one.
+    """
+    def __init__(self, net, n_workers, sync_every=1):
+        """
+        :param net: The net to train.  The parent process uses it to
+                    train on the first shard of each batch, and it
+                    holds the averaged parameters after each sync.
+
+        :param n_workers: The total number of processes to train in,
+                          including the parent.
+
+        :param sync_every: Average parameters every this many batches.
+                           With `1`, replicas are kept in sync after
+                           every batch.  Larger values let replicas
+                           train on their own for a while, and
+                           trade off consistency for less
+                           communication.
+        """
+        self.net = net
+        self.n_workers = n_workers
+        self.sync_every = sync_every
+
+        # Compile before forking, so that workers inherit the function:
+        net.train_iter_
+        self.params = _shared_variables(net)
+
+        self.shared = _ParamBuffer(self.params, 1)
+        self.results = _ParamBuffer(self.params, n_workers)
+        self._publish()
+
+        self.conns = []
+        self.processes = []
+        for slot in range(1, n_workers):
+            parent_conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_worker,
+                args=(net, child_conn, self.shared, self.results, slot),
+                )
+            process.daemon = True
+            process.start()
+            child_conn.close()
+            self.conns.append(parent_conn)
+            self.processes.append(process)
+
+        self._load = True
+        self._batches_since_sync = 0
+        self._counts = np.zeros(n_workers)
+
+    def train(self, Xb, yb=None):
+        """Trains on one batch, and returns the loss averaged over
+        all shards, in the form that `train_iter_` returns it.
+        """
+        n = _n_samples(Xb)
+        bounds = np.linspace(0, n, self.n_workers + 1).astype(int)
+        sizes = np.diff(bounds)
+        self._batches_since_sync += 1
+        sync = self._batches_since_sync >= self.sync_every
+
+        if self._load:
+            self._publish()
+        for slot, conn in enumerate(self.conns, 1):
+            sl = slice(bounds[slot], bounds[slot + 1])
+            conn.send(
+                ('train', self._load, sync, _shard(Xb, sl), _shard(yb, sl)))
+
+        losses = [None]
+        if sizes[0]:
+            sl = slice(bounds[0], bounds[1])
+            losses[0] = self.net.apply_batch_func(
+                self.net.train_iter_, _shard(Xb, sl), _shard(yb, sl))
+        losses.extend(self._receive())
+
+        self._counts += sizes
+        if sync:
+            self._average()
+        else:
+            self._load = False
+
+        weights = [size for size, loss in zip(sizes, losses)
+                   if loss is not None]
+        losses = [np.ravel(loss)[0] for loss in losses if loss is not None]
+        if not losses:
+            return [np.nan]
+        return [np.average(losses, weights=weights)]
+
+    def sync(self):
+        """Averages parameters right away, e.g. at the end of an
+        epoch, before the net is evaluated.
+        """
+        if self._batches_since_sync == 0:
+            return
+        if self._load:
+            self._publish()
+        for conn in self.conns:
+            conn.send(('sync', self._load, True, None, None))
+        self._receive()
+        self._average()
+
+    def _receive(self):
+        losses = []
+        for conn in self.conns:
+            status, value = conn.recv()
+            if status == 'error':
+                raise RuntimeError(
+                    "Data-parallel worker failed:\n{}".format(value))
+            losses.append(value)
+        return losses
+
+    def _publish(self):
+        # Handlers may have changed the net since the last average,
+        # e.g. with load_params_from, or by adjusting a shared
+        # learning rate.  Replicas load these values next:
+        for param, view in zip(self.params, self.shared.views(0)):
+            view[...] = param.get_value(borrow=True)
+
+    def _average(self):
+        for param, view in zip(self.params, self.results.views(0)):
+            view[...] = param.get_value(borrow=True)
+
+        slots = [slot for slot in range(self.n_workers)
+                 if self._counts[slot] > 0]
+        if slots:
+            weights = self._counts[slots] / self._counts[slots].sum()
+            results = [self.results.views(slot) for slot in slots]
+            for i, (param, view) in enumerate(
+                    zip(self.params, self.shared.views(0))):
+                average = sum(
+                    weight * result[i]
+                    for weight, result in zip(weights, results))
+                if view.dtype.kind in 'iu':
+                    average = np.round(average)
+                view[...] = average
+                param.set_value(view.copy())
+
+        self._load = True
+        self._batches_since_sync = 0
+        self._counts[:] = 0
+
+    def close(self):
+        for conn, process in zip(self.conns, self.processes):
+            try:
+                conn.send(None)
+            except (IOError, OSError):
+                pass
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+            conn.close()
+        self.conns = []
+        self.processes = []
@@ -0,0 +1,267 @@
+""":class:`SuccessiveHalvingSearch` and :class:`HyperbandSearch` search
+over the parameters of a :class:`NeuralNet`, and stop bad trials
+early.
+
+Instead of training every configuration for `max_epochs`, like
+:class:`sklearn.grid_search.GridSearchCV` does, all configurations
+are first trained for a few epochs.  Judging by their
+`train_history_`, only the best `1 / eta` of them continue for `eta`
+times as many epochs, and so on, until the survivors have been
+trained for `max_epochs`.
+
+Usage example:
+
+.. code-block:: python
+
+    search = HyperbandSearch(
+        net,
+        {'update_learning_rate': [0.001, 0.01, 0.1],
+         'hidden_num_units': [100, 200, 500]},
+        n_jobs=4,
+        )
+    search.fit(X_train, y_train, X_valid, y_valid)
+    search.print_report()
+"""
+
+from __future__ import print_function
+
+import math
+import shutil
+import tempfile
+
+from joblib import delayed
+from joblib import Parallel
+import numpy as np
+from sklearn.base import BaseEstimator
+from sklearn.base import clone
+from sklearn.grid_search import ParameterGrid
+from sklearn.grid_search import ParameterSampler
+from sklearn.utils import check_random_state
+
+
+def _train_trial(net, epochs, X_train, y_train, X_valid, y_valid):
+    net.max_epochs = epochs
+    net.fit(X_train, y_train, X_valid, y_valid)
+    return net
+
+
+class SuccessiveHalvingSearch(object):
+    """Searches over `param_grid` with successive halving.
+
+    After :meth:`fit`, these attributes hold the results:
+
+    - `trials_`: a list with one dict per configuration, with the
+      keys `params`, `epochs` (the number of epochs trained),
+      `score` and `history`
+    - `best_params_`, `best_score_`: of the best trial among those
+      that were trained the longest
+    - `best_estimator_`: the net of that trial
+    """
+    def __init__(self, net, param_grid, n_iter=None, min_epochs=1,
+                 max_epochs=None, eta=3, score='valid_loss',
+                 greater_is_better=False, n_jobs=1,
+                 compile_cache_dir=None, random_state=None, verbose=1):
+        """
+        :param net: The :class:`NeuralNet` to search parameters for.
+                    Each trial trains a clone of it.
+
+        :param param_grid: A dict that maps parameter names to lists
+                           of values, or to distributions if
+                           `n_iter` is given.
+
+        :param n_iter: If given, sample this many configurations from
+                       `param_grid`, instead of trying all of them.
+
+        :param min_epochs: The number of epochs to train all
+                           configurations for in the first round.
+
+        :param max_epochs: The number of epochs to train the last
+                           survivors for.  Defaults to the
+                           `max_epochs` of `net`.
+
+        :param eta: In each round, keep the best `1 / eta` of trials,
+                    and train them for `eta` times as many epochs.
+
+        :param score: The key in `train_history_` to rank trials by.
+                      A trial's score is its best value so far.
+
+        :param greater_is_better: Whether higher scores are better.
+
+        :param n_jobs: The number of trials to train in parallel,
+                       as in :class:`joblib.Parallel`.
+
+        :param compile_cache_dir: The `compile_cache_dir` that all
+                                  trial nets share, so that trials of
+                                  the same architecture only compile
+                                  their Theano functions once.
+                                  Defaults to a temporary directory
+                                  that's removed after the search.
+        """
+        self.net = net
+        self.param_grid = param_grid
+        self.n_iter = n_iter
+        self.min_epochs = min_epochs
+        self.max_epochs = max_epochs
+        self.eta = eta
+        self.score = score
+        self.greater_is_better = greater_is_better
+        self.n_jobs = n_jobs
+        self.compile_cache_dir = compile_cache_dir
+        self.random_state = random_state
+        self.verbose = verbose
+
+    def _max_epochs(self):
+        return self.max_epochs or self.net.max_epochs
+
+    def _sample(self, n_configs=None):
+        grid = ParameterGrid(self.param_grid)
+        if n_configs is None and self.n_iter is None:
+            return list(grid)
+        n_configs = n_configs or self.n_iter
+        if not any(hasattr(v, 'rvs') for v in self.param_grid.values()):
+            # Lists only, which are sampled without replacement:
+            n_configs = min(n_configs, len(grid))
+        return list(ParameterSampler(
+            self.param_grid, n_configs, random_state=self._random_state))
+
+    def _schedule(self, n_configs, min_epochs):
+        """Returns a list of `(n_trials, epochs)`, one per round.
+        """
+        schedule = []
+        epochs = min_epochs
+        max_epochs = self._max_epochs()
+        while True:
+            epochs = min(int(round(epochs)), max_epochs)
+            schedule.append((n_configs, epochs))
+            if epochs >= max_epochs or n_configs <= 1:
+                break
+            n_configs = max(int(n_configs // self.eta), 1)
+            epochs *= self.eta
+        return schedule
+
+    def _trial_score(self, net):
+        values = [row[self.score] for row in net.train_history_]
+        if not values:
+            return -np.inf if self.greater_is_better else np.inf
+        return max(values) if self.greater_is_better else min(values)
+
+    def _rank(self, trials):
+        return sorted(trials, key=lambda trial: trial['score'],
+                      reverse=self.greater_is_better)
+
+    def _successive_halving(self, parallel, configs, min_epochs, data):
+        trials = []
+        for params in configs:
+            net = clone(self.net).set_params(**params)
+            net.compile_cache_dir = self._compile_cache_dir
+            trials.append({'params': params, 'net': net, 'epochs': 0})
+
+        running = trials
+        for n_trials, epochs in self._schedule(len(configs), min_epochs):
+            if n_trials < len(running):
+                running = self._rank(running)[:n_trials]
+            if self.verbose:
+                print("Training {} trials for {} epochs".format(
+                    len(running), epochs))
+            nets = parallel(
+                delayed(_train_trial)(
+                    trial['net'], epochs - trial['epochs'], *data)
+                for trial in running
+                )
+            for trial, net in zip(running, nets):
+                net.max_epochs = self.net.max_epochs
+                trial['net'] = net
+                trial['epochs'] = len(net.train_history_)
+                trial['score'] = self._trial_score(net)
+                trial['history'] = net.train_history_
+        return trials
+
+    def _brackets(self):
+        return [(self._sample(), self.min_epochs)]
+
+    def fit(self, X_train, y_train, X_valid, y_valid):
+        self._random_state = check_random_state(self.random_state)
+        self._compile_cache_dir = self.compile_cache_dir
+        tmpdir = None
+        if self._compile_cache_dir is None:
+            tmpdir = self._compile_cache_dir = tempfile.mkdtemp()
+        data = (X_train, y_train, X_valid, y_valid)
+
+        try:
+            trials = []
+            with Parallel(n_jobs=self.n_jobs, max_nbytes='1M',
+                          mmap_mode='r') as parallel:
+                for configs, min_epochs in self._brackets():
+                    trials.extend(self._successive_halving(
+                        parallel, configs, min_epochs, data))
+        finally:
+            if tmpdir is not None:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+
+        for trial in trials:
+            if trial['net'].compile_cache_dir == tmpdir:
+                trial['net'].compile_cache_dir = self.net.compile_cache_dir
+
+        longest = max(trial['epochs'] for trial in trials)
+        best = self._rank(
+            [trial for trial in trials if trial['epochs'] == longest])[0]
+        self.best_estimator_ = best['net']
+        self.best_params_ = best['params']
+        self.best_score_ = best['score']
+        self.trials_ = [
+            dict((key, value) for key, value in trial.items()
+                 if key != 'net')
+            for trial in trials
+            ]
+        return self
+
+    def print_report(self):
+        """Prints a summary of the search, in the style of
+        :func:`nolearn.grid_search.print_report`.
+        """
+        print()
+        print("== " * 20)
+        print("All parameters:")
+        best_parameters = self.best_estimator_.get_params()
+        for param_name, value in sorted(best_parameters.items()):
+            if not isinstance(value, BaseEstimator):
+                print("    %s=%r," % (param_name, value))
+
+        print()
+        print("== " * 20)
+        print("Trials (epochs, %s):" % self.score)
+        for trial in self._rank(self.trials_):
+            print("    %4d  %0.4f  %r" % (
+                trial['epochs'], trial['score'],
+                sorted(trial['params'].items())))
+
+        print()
+        print("== " * 20)
+        print("Best score: %0.4f" % self.best_score_)
+        print("Best grid parameters:")
+        for param_name in sorted(self.best_params_.keys()):
+            print("    %s=%r," % (param_name, self.best_params_[param_name]))
+        print("== " * 20)
+
+        return self
+
+
+class HyperbandSearch(SuccessiveHalvingSearch):
+    """Searches with Hyperband, which runs several rounds of
+    successive halving, from many configurations trained for few
+    epochs to few configurations trained for all `max_epochs`.
+
+    Configurations are sampled from `param_grid` for every round, see
+    :class:`SuccessiveHalvingSearch` for the parameters.  `n_iter`
+    and `min_epochs` are ignored.
+    """
+    def _brackets(self):
+        max_epochs = self._max_epochs()
+        s_max = int(math.log(max_epochs) / math.log(self.eta) + 1e-9)
+        brackets = []
+        for s in range(s_max, -1, -1):
+            n_configs = int(math.ceil(
+                float(s_max + 1) / (s + 1) * self.eta ** s))
+            min_epochs = max_epochs * self.eta ** -s
+            brackets.append((self._sample(n_configs), min_epochs))
+        return brackets
@@ -0,0 +1,254 @@
+"""Sinks that training metrics, such as the entries of a net's
+`train_history_`, are written to.
+
+Sinks buffer records in memory and write them out in batches.  They
+can be passed to handlers like :class:`PrintLog` and
+:class:`WeightLog`, or used directly as `on_epoch_finished` handlers,
+in which case they record the last entry of the train history.
+:meth:`NeuralNet.train_loop` closes them, which flushes what's left
+in the buffer, when training ends.
+"""
+
+from csv import DictReader
+from csv import DictWriter
+import glob
+import os
+from time import time
+from warnings import warn
+
+import numpy as np
+
+
+# Columns that go first in the order given here, if they're present.
+# The remaining ones follow in alphabetical order.
+_FIRST_COLUMNS = (
+    'epoch',
+    'train_loss',
+    'valid_loss',
+    'train_accuracy',
+    'valid_accuracy',
+    'dur',
+    )
+
+
+def _columns(records, columns=()):
+    keys = set(columns)
+    for record in records:
+        keys.update(record.keys())
+    columns = list(columns)
+    columns.extend(key for key in _FIRST_COLUMNS
+                   if key in keys and key not in columns)
+    columns.extend(sorted(keys - set(columns)))
+    return columns
+
+
+class MetricsSink(object):
+    """Base class for sinks.  Subclasses implement :meth:`_write`,
+    which is called with the list of buffered records on every flush.
+    """
+    def __init__(self, flush_every=1, flush_interval=None):
+        """
+        :param flush_every: Flush after this many records.
+
+        :param flush_interval: If given, also flush when this many
+                               seconds have passed since the last
+                               flush.
+        """
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._last_flush = time()
+
+    def __call__(self, nn, train_history):
+        self.write(train_history[-1])
+
+    def write(self, record):
+        self._buffer.append(dict(record))
+        if len(self._buffer) >= self.flush_every or (
+                self.flush_interval is not None and
+                time() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._write(self._buffer)
+            self._buffer = []
+        self._last_flush = time()
+
+    def close(self):
+        self.flush()
+
+
+class MemorySink(MetricsSink):
+    """Keeps all records in the `records` list.
+    """
+    def __init__(self, flush_every=1, flush_interval=None):
+        super(MemorySink, self).__init__(flush_every, flush_interval)
+        self.records = []
+
+    def _write(self, records):
+        self.records.extend(records)
+
+    def columns(self):
+        """Returns a dict that maps each key to the list of its values
+        over all records, with `None` for records that lack the key.
+        """
+        self.flush()
+        return dict(
+            (key, [record.get(key) for record in self.records])
+            for key in _columns(self.records))
+
+
+class CSVSink(MetricsSink):
+    """Writes records to a CSV file, one row per record.
+
+    The header holds the given `columns`, or else the keys of the
+    records of the first flush.  Rows are only ever appended under
+    it: keys that aren't in the header are left out, with a warning.
+    """
+    def __init__(self, path, flush_every=10, flush_interval=60,
+                 append=False, columns=None):
+        """
+        :param path: The CSV file to write to.
+
+        :param append: If false, I truncate `path` on the first flush.
+                       Otherwise I keep existing rows and continue
+                       with the header that's in the file.
+
+        :param columns: The keys to write, in this order.
+        """
+        super(CSVSink, self).__init__(flush_every, flush_interval)
+        self.path = path
+        self.append = append
+        self.columns = columns
+        self.fieldnames = None
+        self._left_out = set()
+        self._file = None
+        self._writer = None
+
+    def _open(self):
+        if self.fieldnames is None and self.append and os.path.exists(
+                self.path):
+            with open(self.path, 'r') as f:
+                self.fieldnames = DictReader(f).fieldnames
+        if self.fieldnames is None:
+            mode = 'w'
+        else:
+            mode = 'a'
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        self._file = open(self.path, mode)
+        return mode == 'w'
+
+    def _write(self, records):
+        new_file = False
+        if self._file is None:
+            new_file = self._open()
+
+        if self.fieldnames is None:
+            self.fieldnames = list(self.columns or _columns(records))
+        if self._writer is None:
+            self._writer = DictWriter(
+                self._file, self.fieldnames, restval='',
+                extrasaction='ignore')
+            if new_file:
+                self._writer.writeheader()
+
+        left_out = set(
+            key for record in records for key in record
+            if key not in self.fieldnames) - self._left_out
+        if left_out and self.columns is None:
+            warn("Leaving out keys that aren't in the header of {}: "
+                 "{}".format(self.path, ', '.join(sorted(left_out))))
+        self._left_out.update(left_out)
+
+        self._writer.writerows(records)
+        self._file.flush()
+
+    def close(self):
+        super(CSVSink, self).close()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._writer = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_file'] = None
+        state['_writer'] = None
+        return state
+
+
+class NpySink(MetricsSink):
+    """Writes records to a directory of append-only ``.npy`` chunks,
+    one chunk per flush.
+
+    Each chunk is a structured array with one field per key.  Missing
+    numeric values are stored as NaN, missing strings as empty
+    strings.  Use :func:`load_npy_chunks` to read them back.
+    """
+    def __init__(self, path, flush_every=100, flush_interval=None):
+        """
+        :param path: The directory that chunks are written to.
+        """
+        super(NpySink, self).__init__(flush_every, flush_interval)
+        self.path = path
+        self._chunk = None
+
+    def _write(self, records):
+        if self._chunk is None:
+            if not os.path.exists(self.path):
+                os.makedirs(self.path)
+            self._chunk = len(glob.glob(
+                os.path.join(self.path, 'chunk-*.npy')))
+
+        fields = []
+        for key in _columns(records):
+            values = [record.get(key) for record in records]
+            present = np.asarray([v for v in values if v is not None])
+            if present.dtype.kind in 'biuf':
+                if None in values:
+                    values = [np.nan if v is None else v for v in values]
+                    dtype = np.result_type(present.dtype, np.float64)
+                else:
+                    dtype = present.dtype
+            else:
+                values = ['' if v is None else str(v) for v in values]
+                dtype = np.asarray(values).dtype
+            fields.append((key, values, dtype))
+
+        chunk = np.empty(
+            len(records),
+            dtype=[(str(key), dtype) for key, values, dtype in fields])
+        for key, values, dtype in fields:
+            chunk[str(key)] = values
+
+        fname = os.path.join(self.path, 'chunk-{:06d}.npy'.format(
+            self._chunk))
+        with open(fname + '.tmp', 'wb') as f:
+            np.save(f, chunk)
+        os.rename(fname + '.tmp', fname)
+        self._chunk += 1
+
+
+def load_npy_chunks(path):
+    """Reads the chunks written by :class:`NpySink` to `path` and
+    returns a dict that maps each key to an array of its values.
+    """
+    chunks = [np.load(fname) for fname in
+              sorted(glob.glob(os.path.join(path, 'chunk-*.npy')))]
+    columns = {}
+    for key in _columns([dict.fromkeys(chunk.dtype.names)
+                         for chunk in chunks]):
+        dtype = np.result_type(*[chunk.dtype[key] for chunk in chunks
+                                 if key in chunk.dtype.names])
+        missing = '' if dtype.kind in 'SU' else np.nan
+        parts = []
+        for chunk in chunks:
+            if key in chunk.dtype.names:
+                parts.append(chunk[key])
+            else:
+                parts.append(np.full(len(chunk), missing))
+        columns[key] = np.concatenate(parts)
+    return columns
@@ -1,3 +1,4 @@
+from mock import Mock
 import numpy as np
 import pytest
 from sklearn.datasets import load_boston
@@ -44,6 +45,47 @@ def boston():
     return shuffle(X, y, random_state=42)
 
 
+class _IndexBatchIterator(object):
+    """Yields `(k, fpaths, Xb, yb)` batches, with the sample indices
+    as `fpaths`, the way :meth:`NeuralNet.train_loop` and
+    :meth:`NeuralNet.predict_proba` consume them.
+    """
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+
+    def __call__(self, X, y=None):
+        for i in range(0, len(X), self.batch_size):
+            sl = slice(i, i + self.batch_size)
+            yb = y[sl] if y is not None else None
+            yield None, list(range(len(X)))[sl], X[sl], yb
+
+
+@pytest.fixture
+def batch_iterator():
+    return _IndexBatchIterator(batch_size=32)
+
+
+@pytest.fixture
+def make_nn(NeuralNet):
+    """Returns a function that makes a net that trains and validates
+    on the given `(k, fpaths, Xb, yb)` batches, with mocked iteration
+    functions, so that :meth:`NeuralNet.train_loop` runs without
+    compiling anything.
+    """
+    def make_nn(batches, **kwargs):
+        kwargs.setdefault('identifier', '1')
+        kwargs.setdefault('max_epochs', 1)
+        nn = NeuralNet(
+            [('input', object())],
+            input_shape=(None, 3),
+            batch_iterator_train=Mock(side_effect=lambda X, y: iter(batches)),
+            **kwargs)
+        nn.train_iter_ = Mock(return_value=[1.0])
+        nn.eval_iter_ = Mock(return_value=(1.0, 1.0))
+        return nn
+    return make_nn
+
+
 class _OnEpochFinished:
     def __call__(self, nn, train_history):
         self.train_history = train_history
@@ -0,0 +1,162 @@
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+
+def _params(value, size=10):
+    return OrderedDict([
+        ('account', (np.ones((size, 2)) * value, np.ones(2) * value)),
+        ])
+
+
+class TestAccountWeightCache:
+    @pytest.fixture
+    def disk(self):
+        return {}
+
+    @pytest.fixture
+    def cache(self, disk):
+        from nolearn.lasagne.accounts import AccountWeightCache
+
+        def load(k):
+            return disk.get(k, _params(0))
+
+        def save(k, params):
+            disk[k] = params
+
+        # Room for two entries of 10x2 + 2 float64 values:
+        return AccountWeightCache(load, save, max_bytes=2 * 22 * 8)
+
+    def test_hits_and_misses(self, cache):
+        cache.get(1)
+        cache.get(1)
+        cache.get(2)
+        assert cache.counters() == {'hits': 1, 'misses': 2, 'flushes': 0}
+
+    def test_write_back_on_flush(self, cache, disk):
+        cache.put(1, _params(1))
+        assert disk == {}
+        assert cache.get(1)['account'][0][0, 0] == 1
+        cache.flush()
+        assert disk[1]['account'][0][0, 0] == 1
+        assert cache.counters()['flushes'] == 1
+        cache.flush()
+        assert cache.counters()['flushes'] == 1
+
+    def test_evicts_least_recently_used(self, cache, disk):
+        cache.put(1, _params(1))
+        cache.put(2, _params(2))
+        cache.get(1)
+        cache.put(3, _params(3))
+        assert 2 not in cache
+        assert 1 in cache and 3 in cache
+        assert list(disk.keys()) == [2]
+        assert cache.nbytes == 2 * 22 * 8
+
+    def test_keeps_entry_larger_than_budget(self, cache, disk):
+        cache.put(1, _params(1, size=100))
+        assert 1 in cache
+        cache.put(2, _params(2, size=100))
+        assert 1 not in cache and 2 in cache
+        assert list(disk.keys()) == [1]
+
+    def test_reset_counters(self, cache):
+        cache.get(1)
+        cache.reset_counters()
+        assert cache.counters() == {'hits': 0, 'misses': 0, 'flushes': 0}
+
+
+class TestPickleAccountStore:
+    @pytest.fixture
+    def store(self, tmpdir):
+        from nolearn.lasagne.accounts import PickleAccountStore
+        return PickleAccountStore(str(tmpdir.join('1_accW_')))
+
+    def test_roundtrip(self, store, tmpdir):
+        assert store.load(7, ['account']) is None
+        store.save(7, _params(1))
+        assert tmpdir.join('1_accW_7.pkl').check()
+        W, b = store.load(7, ['account'])['account']
+        assert (W == 1).all() and (b == 1).all()
+
+    def test_best(self, store, tmpdir):
+        store.save(7, _params(2), best=True)
+        assert tmpdir.join('1_accW_7_loss_prms.pkl').check()
+        assert store.load(7, ['account']) is None
+        assert store.load(7, ['account'], best=True)['account'][0][0, 0] == 2
+
+
+class TestMemmapAccountStore:
+    @pytest.fixture
+    def MemmapAccountStore(self):
+        from nolearn.lasagne.accounts import MemmapAccountStore
+        return MemmapAccountStore
+
+    def test_roundtrip(self, MemmapAccountStore, tmpdir):
+        store = MemmapAccountStore(str(tmpdir), capacity=2, dtype=np.float32)
+        assert store.load('a', ['account']) is None
+        for i, k in enumerate(['a', 'b', 'c', 'd', 'e']):
+            store.save(k, _params(i))
+        assert store.index['capacity'] == 8
+
+        W, b = store.load('c', ['account'])['account']
+        assert isinstance(W, np.memmap)
+        assert W.dtype == np.float32
+        assert (W == 2).all() and (b == 2).all()
+
+    def test_persists_after_flush(self, MemmapAccountStore, tmpdir):
+        store = MemmapAccountStore(str(tmpdir), capacity=2)
+        for i, k in enumerate(['a', 'b', 'c']):
+            store.save(k, _params(i))
+        store.save('a', _params(5), best=True)
+        store.flush()
+
+        store = MemmapAccountStore(str(tmpdir))
+        assert (store.load('c', ['account'])['account'][0] == 2).all()
+        assert (store.load('a', ['account'])['account'][0] == 0).all()
+        assert (store.load('a', ['account'], best=True)['account'][1] ==
+                5).all()
+        assert store.load('b', ['account'], best=True) is None
+
+    def test_files_created_on_write(self, MemmapAccountStore, tmpdir):
+        store = MemmapAccountStore(str(tmpdir))
+        store.save('a', _params(1))
+        assert store.load('a', ['account'], best=True) is None
+        store.flush()
+        assert sorted(f.basename for f in tmpdir.listdir()) == [
+            'account.W.last.dat', 'account.b.last.dat', 'index.pkl']
+
+    def test_unsaved_layers_not_loaded(self, MemmapAccountStore, tmpdir):
+        store = MemmapAccountStore(str(tmpdir))
+        store.save('a', _params(1))
+        store.save('b', OrderedDict([('other', (np.ones(3), None))]))
+        store.flush()
+
+        store = MemmapAccountStore(str(tmpdir))
+        assert list(store.load('b', ['account', 'other'])) == ['other']
+        assert store.load('b', ['other'])['other'][1] is None
+        assert list(store.load('a', ['account', 'other'])) == ['account']
+
+    def test_dtype_of_saved_weights(self, MemmapAccountStore, tmpdir):
+        store = MemmapAccountStore(str(tmpdir), capacity=2)
+        store.save('a', OrderedDict([
+            ('account', (np.ones((3, 2), np.float32), np.ones(2)))]))
+        params = OrderedDict([
+            ('account', (np.ones((3, 2), np.float16), None))])
+        for k in ['a', 'b', 'c']:
+            store.save(k, params, best=True)
+        store.flush()
+
+        store = MemmapAccountStore(str(tmpdir))
+        W, b = store.load('a', ['account'])['account']
+        assert W.dtype == np.float32 and b.dtype == np.float64
+        W, b = store.load('c', ['account'], best=True)['account']
+        assert W.dtype == np.float16 and (W == 1).all()
+
+    def test_pickle(self, MemmapAccountStore, tmpdir):
+        import pickle
+        store = MemmapAccountStore(str(tmpdir))
+        store.save('a', _params(3))
+        store = pickle.loads(pickle.dumps(store))
+        assert (store.load('a', ['account'])['account'][0] == 3).all()
@@ -1,4 +1,7 @@
+import gc
 import pickle
+import types
+import weakref
 
 from lasagne.layers import ConcatLayer
 from lasagne.layers import DenseLayer
@@ -21,6 +24,8 @@ from sklearn.metrics import mean_absolute_error
 import theano
 import theano.tensor as T
 
+from nolearn.lasagne import BatchIterator
+
 floatX = theano.config.floatX
 
 
@@ -131,6 +136,13 @@ class TestFunctionalMNIST:
         net_loaded.load_params_from(path)
         assert np.array_equal(net_loaded.predict(X_test), y_pred)
 
+    def test_save_params_to_binary(self, net_fitted, X_test, y_pred):
+        path = '/tmp/test_lasagne_functional_mnist.ckpt'
+        net_fitted.save_params_to(path, format='binary')
+        net_loaded = clone(net_fitted)
+        net_loaded.load_params_from(path)
+        assert np.array_equal(net_loaded.predict(X_test), y_pred)
+
     def test_load_params_from_message(self, net, net_fitted, capsys):
         net2 = clone(net)
         net2.verbose = 1
@@ -682,3 +694,775 @@ class TestMultiInputFunctional:
         X, y = mnist
         y_test = y[60000:]
         assert accuracy_score(y_pred, y_test) > 0.85
+
+
+class TestBatchIteratorGroupBy:
+    @pytest.fixture
+    def BatchIterator(self):
+        from nolearn.lasagne import BatchIterator
+        return BatchIterator
+
+    @pytest.fixture
+    def X(self):
+        return np.arange(10)
+
+    @pytest.fixture
+    def y(self):
+        return np.array([2, 1, 2, 1, 0, 2, 1, 2, 2, 2])
+
+    def group_by(self, X, y):
+        return y
+
+    def test_batches_within_groups(self, BatchIterator, X, y):
+        bi = BatchIterator(batch_size=3, group_by=self.group_by)
+        bi(X, y)
+        batches = [Xb.tolist() for Xb, yb in bi]
+        assert batches == [[4], [1, 3, 6], [0, 2, 5], [7, 8, 9]]
+
+    def test_shuffle_groups(self, BatchIterator, X, y):
+        bi = BatchIterator(batch_size=3, group_by=self.group_by,
+                           shuffle_groups=True, random_state=42)
+        bi(X, y)
+        batches = [yb for Xb, yb in bi]
+        assert sorted(np.hstack(batches).tolist()) == sorted(y.tolist())
+        seen = []
+        for yb in batches:
+            assert len(set(yb)) == 1
+            if yb[0] not in seen:
+                seen.append(yb[0])
+            assert seen[-1] == yb[0]
+
+    def test_list_input(self, BatchIterator, y):
+        X = ['img{}.jpg'.format(i) for i in range(10)]
+        bi = BatchIterator(batch_size=3, group_by=self.group_by)
+        bi(X, y)
+        assert next(iter(bi))[0] == ['img4.jpg']
+
+
+def test_account_weights_swapped_once_per_account(make_nn):
+    batches = [
+        (1, None, np.zeros((2, 3)), np.zeros(2)),
+        (1, None, np.zeros((2, 3)), np.zeros(2)),
+        (2, None, np.zeros((2, 3)), np.zeros(2)),
+        ]
+    nn = make_nn(batches, account_weights=True)
+
+    with patch.object(nn, 'load_account_weights') as load, \
+            patch.object(nn, 'save_account_weights') as save:
+        nn.train_loop(None, None, None, None)
+
+    # two accounts in training, then account 1 again for validation:
+    assert [c[0][0] for c in load.call_args_list] == [1, 2, 1]
+    assert [c[0][0] for c in save.call_args_list] == [1, 2]
+    assert nn.train_history_[-1]['account_swaps'] == 3
+
+
+class _RandomBatchIterator(BatchIterator):
+    def transform(self, Xb, yb):
+        return Xb + np.random.randint(1000), yb
+
+
+class _ReversedBatchIterator(BatchIterator):
+    def __iter__(self):
+        batches = list(super(_ReversedBatchIterator, self).__iter__())
+        return reversed(batches)
+
+
+class _AccountBatchIterator(BatchIterator):
+    def __call__(self, X, y=None):
+        for i in range(0, len(X), self.batch_size):
+            sl = slice(i, i + self.batch_size)
+            yield i, list(range(len(X)))[sl], X[sl], y[sl]
+
+
+class TestPrefetchingBatchIterator:
+    @pytest.fixture
+    def PrefetchingBatchIterator(self):
+        from nolearn.lasagne import PrefetchingBatchIterator
+        return PrefetchingBatchIterator
+
+    def test_order_with_threads(self, PrefetchingBatchIterator):
+        X, y = np.arange(20), np.arange(20)
+        bi = PrefetchingBatchIterator(
+            BatchIterator(batch_size=3), n_workers=3, queue_size=4)
+        k, batches = bi(X, y)
+        assert k is None
+        assert [Xb.tolist() for Xb, yb in batches] == [
+            list(range(i, min(i + 3, 20))) for i in range(0, 20, 3)]
+        assert bi.n_samples == 20
+
+    def test_deterministic_with_processes(self, PrefetchingBatchIterator):
+        X, y = np.zeros(20), np.arange(20)
+        runs = []
+        for i in range(2):
+            bi = PrefetchingBatchIterator(
+                _RandomBatchIterator(batch_size=3), n_workers=3,
+                processes=True, random_state=42)
+            runs.append([Xb.tolist() for Xb, yb in bi(X, y)[1]])
+        assert runs[0] == runs[1]
+
+    def test_stop_early(self, PrefetchingBatchIterator):
+        bi = PrefetchingBatchIterator(
+            _RandomBatchIterator(batch_size=3), n_workers=2, processes=True)
+        batches = iter(bi(np.zeros(20), np.arange(20))[1])
+        next(batches)
+        batches.close()
+
+    def test_subclass_iter(self, PrefetchingBatchIterator):
+        X, y = np.arange(10), np.arange(10)
+        bi = PrefetchingBatchIterator(
+            _ReversedBatchIterator(batch_size=4), n_workers=2)
+        expected = [Xb.tolist() for Xb, yb in
+                    _ReversedBatchIterator(batch_size=4)(X, y)[1]]
+        # Prefetched in a single thread, whatever n_workers says:
+        with pytest.warns(UserWarning):
+            assert [Xb.tolist() for Xb, yb in bi(X, y)[1]] == expected
+        assert expected[0] == [8, 9]
+
+    def test_subclass_call(self, PrefetchingBatchIterator):
+        X, y = np.arange(10), np.arange(10)
+        bi = PrefetchingBatchIterator(
+            _AccountBatchIterator(batch_size=4), queue_size=1)
+        batches = list(bi(X, y))
+        assert [k for k, fpaths, Xb, yb in batches] == [0, 4, 8]
+        assert batches[2][1] == [8, 9]
+        assert batches[2][3].tolist() == [8, 9]
+
+    def test_subclass_call_warns_about_workers(
+            self, PrefetchingBatchIterator):
+        bi = PrefetchingBatchIterator(
+            _AccountBatchIterator(batch_size=4), n_workers=2)
+        with pytest.warns(UserWarning):
+            batches = bi(np.arange(10), np.arange(10))
+        assert len(list(batches)) == 3
+
+    def test_error_raised(self, PrefetchingBatchIterator):
+        bi = PrefetchingBatchIterator(_AccountBatchIterator(batch_size=4))
+        with pytest.raises(TypeError) as err:
+            list(bi(np.arange(10), None))
+        # The traceback ends where the batch iterator failed:
+        assert err.traceback[-1].name == '__call__'
+
+    def test_stop_early_with_thread(self, PrefetchingBatchIterator):
+        bi = PrefetchingBatchIterator(
+            _AccountBatchIterator(batch_size=1), queue_size=1)
+        batches = bi(np.arange(20), np.arange(20))
+        next(batches)
+        batches.close()
+
+    def test_pickle(self, PrefetchingBatchIterator):
+        bi = PrefetchingBatchIterator(BatchIterator(batch_size=3))
+        bi = pickle.loads(pickle.dumps(bi))
+        assert bi.batch_size == 3
+
+
+def test_valid_scores_weighted_by_batch_size(make_nn):
+    batches = [
+        (None, None, np.zeros((4, 3)), np.zeros(4)),
+        (None, None, np.zeros((1, 3)), np.zeros(1)),
+        ]
+    custom_score = Mock(side_effect=[1.0, 0.0])
+    nn = make_nn(batches, custom_score=('my_score', custom_score))
+    nn.train_iter_ = Mock(side_effect=[[1.0], [2.0]])
+    nn.eval_iter_ = Mock(side_effect=[
+        (1.0, 1.0, np.zeros((4, 2))),
+        (2.0, 0.0, np.zeros((1, 2))),
+        ])
+    nn.predict_iter_ = Mock()
+    nn.train_loop(None, None, None, None)
+
+    info = nn.train_history_[-1]
+    assert info['train_loss'] == pytest.approx(1.2)
+    assert info['valid_loss'] == pytest.approx(1.2)
+    assert info['valid_accuracy'] == pytest.approx(0.8)
+    assert info['my_score'] == pytest.approx(0.8)
+    assert nn.predict_iter_.call_count == 0
+
+
+def test_phase_timings_in_history(make_nn):
+    from nolearn.lasagne import MemorySink
+
+    batches = [
+        (None, None, np.zeros((4, 3)), np.zeros(4)),
+        (None, None, np.zeros((1, 3)), np.zeros(1)),
+        ]
+
+    def my_handler(nn, train_history):
+        with nn.timer_.span('my_phase'):
+            pass
+
+    sink = MemorySink()
+    nn = make_nn(batches, on_epoch_finished=[sink, my_handler], max_epochs=2)
+    nn.train_loop(None, None, None, None)
+
+    assert len(nn.train_history_) == 2
+    for info in nn.train_history_:
+        for phase in ('batches', 'train', 'eval', 'batch_handlers',
+                      'epoch_handlers'):
+            assert info['dur_' + phase] >= 0
+        assert 'dur_account_load' not in info
+        assert sum(value for key, value in info.items()
+                   if key.startswith('dur_')) <= info['dur'] + 1.0
+
+    # Epoch handlers' phases are reported with the next epoch:
+    assert 'dur_my_phase' not in nn.train_history_[0]
+    assert nn.train_history_[1]['dur_my_phase'] >= 0
+    # ... so that handlers see every entry as it ends up in the history,
+    # except for the last one, which the last handlers' spans are added
+    # to:
+    assert sink.records[:-1] == nn.train_history_[:-1]
+    assert sorted(sink.records[-1]) == sorted(nn.train_history_[-1])
+
+
+def test_last_epoch_handlers_timed(make_nn):
+    batches = [(None, None, np.zeros((4, 3)), np.zeros(4))]
+
+    def my_handler(nn, train_history):
+        nn.timer_.add('my_phase', 1.0)
+        if len(train_history) == 2:
+            raise StopIteration()
+
+    nn = make_nn(batches, on_epoch_finished=[my_handler], max_epochs=5)
+    nn.train_loop(None, None, None, None)
+
+    assert len(nn.train_history_) == 2
+    assert nn.train_history_[-1]['dur_my_phase'] == 2.0
+    assert nn.train_history_[-1]['dur_epoch_handlers'] > 0
+
+
+def test_sinks_flushed_when_training_ends(make_nn, tmpdir):
+    from nolearn.lasagne import MemorySink
+    from nolearn.lasagne import NpySink
+    from nolearn.lasagne import PrintLog
+    from nolearn.lasagne.sinks import load_npy_chunks
+
+    batches = [(None, None, np.zeros((4, 3)), np.zeros(4))]
+    npy_sink = NpySink(str(tmpdir.join('metrics')))
+    memory_sink = MemorySink(flush_every=100)
+    nn = make_nn(
+        batches,
+        on_epoch_finished=[npy_sink, PrintLog(sink=memory_sink)],
+        max_epochs=3,
+        )
+    nn.train_loop(None, None, None, None)
+
+    assert list(load_npy_chunks(npy_sink.path)['epoch']) == [1, 2, 3]
+    assert [r['epoch'] for r in memory_sink.records] == [1, 2, 3]
+
+
+def test_background_save_weights_waited_for(make_nn, tmpdir):
+    from nolearn.lasagne import SaveWeights
+
+    batches = [(None, None, np.zeros((4, 3)), np.zeros(4))]
+    save_weights = SaveWeights(
+        str(tmpdir.join('missing', 'params.pkl')), background=True)
+    nn = make_nn(batches, on_epoch_finished=[save_weights])
+    nn.get_all_params_values = Mock(return_value={'dense': [np.ones(3)]})
+    with pytest.raises(IOError):
+        nn.train_loop(None, None, None, None)
+    assert save_weights._writer._thread is None
+
+
+class TestDataParallel:
+    def make_net(self, NeuralNet, **kwargs):
+        l = InputLayer(shape=(None, 20))
+        l = DenseLayer(l, num_units=2, nonlinearity=softmax)
+        return NeuralNet(
+            l, update_learning_rate=0.01, identifier='1', max_epochs=2,
+            **kwargs)
+
+    def test_fit(self, NeuralNet, batch_iterator):
+        X, y = make_classification(n_samples=200)
+        X, y = X.astype(floatX), y.astype(np.int32)
+        net = self.make_net(
+            NeuralNet, n_workers=2, sync_every=2,
+            batch_iterator_train=batch_iterator,
+            )
+        net.fit(X[:150], y[:150], X[150:], y[150:])
+        assert len(net.train_history_) == 2
+        assert np.isfinite(net.train_history_[-1]['train_loss'])
+        assert net._parallel_ is None
+
+    def test_handler_changes_seen_by_workers(self, NeuralNet, batch_iterator):
+        X, y = make_classification(n_samples=200)
+        X, y = X.astype(floatX), y.astype(np.int32)
+        weights = []
+
+        def stop_learning(nn, train_history):
+            weights.append(nn.layers_[-1].W.get_value())
+            nn.update_learning_rate.set_value(np.asarray(0., dtype=floatX))
+            nn.update_momentum.set_value(np.asarray(0., dtype=floatX))
+
+        net = self.make_net(
+            NeuralNet, n_workers=2, batch_iterator_train=batch_iterator,
+            on_epoch_finished=[stop_learning],
+            )
+        net.update_learning_rate = theano.shared(
+            np.asarray(0.01, dtype=floatX))
+        net.update_momentum = theano.shared(np.asarray(0.9, dtype=floatX))
+        net.fit(X[:150], y[:150], X[150:], y[150:])
+        assert np.allclose(weights[0], weights[1], atol=1e-6)
+
+    def test_no_account_weights(self, NeuralNet):
+        net = self.make_net(NeuralNet, n_workers=2, account_weights=True)
+        with pytest.raises(ValueError):
+            net._get_parallel()
+
+
+class TestSharedData:
+    @pytest.fixture
+    def data(self):
+        X, y = make_classification(n_samples=200)
+        return X.astype(floatX), y.astype(np.int32)
+
+    @pytest.fixture
+    def net(self, NeuralNet, data):
+        X, y = data
+        l = InputLayer(shape=(None, X.shape[1]))
+        l = DenseLayer(l, num_units=2, nonlinearity=softmax)
+        return NeuralNet(
+            l,
+            update_learning_rate=0.01,
+            shared_data=True,
+            identifier='1',
+            max_epochs=2,
+            )
+
+    def test_fit_and_predict(self, net, data):
+        X, y = data
+        net.fit(X[:150], y[:150], X[150:], y[150:])
+        assert sorted(net._shared_data_.keys()) == ['train', 'valid']
+        assert len(net.train_history_) == 2
+
+        y_proba, y_true, indices = net.predict_proba(X, y)
+        assert y_proba.shape == (200, 2)
+        assert (y_true == y).all()
+        assert list(indices) == list(range(200))
+
+    def test_transform(self, net, data):
+        X, y = data
+        net.initialize()
+        output, indices = net.transform(X)
+        assert list(net._shared_data_) == ['test']
+        assert np.allclose(output, net.predict_iter_(X))
+        assert list(indices) == list(range(200))
+
+        output, indices = net.transform(X, layer=0)
+        assert np.allclose(output, X)
+
+    def test_falls_back_to_streaming(self, net, data):
+        X, y = data
+        net.initialize()
+        batches = net._batches('test', net.batch_iterator_test, X)
+        assert isinstance(batches, types.GeneratorType)
+
+        net.shared_data_max_bytes = 1
+        del net._shared_data_
+        batches = net._batches('test', net.batch_iterator_test, X)
+        # What BatchIterator.__call__ returns:
+        assert batches == (None, net.batch_iterator_test)
+        assert not hasattr(net, '_shared_data_')
+
+    def test_valid_without_y_streams(self, net, data):
+        X, y = data
+        net.initialize()
+        batches = net._batches('valid', net.batch_iterator_train, X)
+        assert batches == (None, net.batch_iterator_train)
+
+    def test_custom_call_streams(self, net, data):
+        X, y = data
+        net.initialize()
+        bi = _AccountBatchIterator(batch_size=64)
+        batches = net._batches('valid', bi, X, y)
+        assert [k for k, fpaths, Xb, yb in batches] == [0, 64, 128, 192]
+        assert not hasattr(net, '_shared_data_')
+
+    def test_host_data_not_kept(self, net, data):
+        X, y = data
+        X, y = X.copy(), y.copy()
+        net.fit(X[:150], y[:150], X[150:], y[150:])
+        entry = net._shared_data_['train']
+        assert 'X' not in entry and 'y' not in entry
+        X_ref = weakref.ref(X)
+        del X, y
+        # Theano's optimizer may leave tracebacks in reference cycles:
+        gc.collect()
+        assert X_ref() is None
+
+
+class TestPredictProba:
+    @pytest.fixture
+    def net(self, NeuralNet):
+        batches = [
+            (None, ['a', 'b'], np.zeros((2, 3)), np.array([1, 0])),
+            (None, ['c'], np.ones((1, 3)), np.array([1])),
+            ]
+        net = NeuralNet(
+            [('input', object())],
+            input_shape=(None, 3),
+            batch_iterator_test=Mock(side_effect=lambda X, y: iter(batches)),
+            identifier='1',
+            )
+        net.predict_iter_ = lambda Xb: np.hstack([Xb[:, :1], 1 - Xb[:, :1]])
+        return net
+
+    def test_return_values(self, net):
+        y_proba, y, fpaths = net.predict_proba(np.zeros((3, 3)))
+        assert y_proba.tolist() == [[0, 1], [0, 1], [1, 0]]
+        assert y.tolist() == [1, 0, 1]
+        assert fpaths == ['a', 'b', 'c']
+
+    def test_out(self, net, tmpdir):
+        out = np.memmap(
+            str(tmpdir.join('out.dat')), dtype=np.float64, mode='w+',
+            shape=(3, 2))
+        y_proba, y, fpaths = net.predict_proba(np.zeros((3, 3)), out=out)
+        assert isinstance(y_proba, np.memmap)
+        assert out[2].tolist() == [1, 0]
+
+    def test_out_too_small(self, net):
+        with pytest.raises(ValueError):
+            net.predict_proba(np.zeros((3, 3)), out=np.zeros((2, 2)))
+
+    def test_sized_by_n_samples(self, net):
+        net.batch_iterator_test.n_samples = 3
+        with patch('nolearn.lasagne.base._grow') as grow:
+            y_proba, y, fpaths = net.predict_proba(np.zeros((1, 3)))
+        assert grow.call_count == 0
+        assert y_proba.shape == (3, 2)
+
+    def test_grows(self, net):
+        y_proba, y, fpaths = net.predict_proba(None)
+        assert y_proba.tolist() == [[0, 1], [0, 1], [1, 0]]
+        assert y.tolist() == [1, 0, 1]
+
+    def test_y_dtype_from_all_batches(self, net):
+        batches = [
+            (None, ['a'], np.zeros((1, 3)), np.array([1])),
+            (None, ['b'], np.zeros((1, 3)), np.array([0.5])),
+            ]
+        net.batch_iterator_test.side_effect = lambda X, y: iter(batches)
+        y_proba, y, fpaths = net.predict_proba(np.zeros((2, 3)))
+        assert y.tolist() == [1, 0.5]
+
+    def test_iter_predict_proba(self, net):
+        batches = list(net.iter_predict_proba(np.zeros((3, 3))))
+        assert [fpaths for fpaths, probas, yb in batches] == [['a', 'b'], ['c']]
+        assert batches[1][1].tolist() == [[1, 0]]
+        assert batches[0][2].tolist() == [1, 0]
+
+
+class TestCompileCache:
+    @pytest.fixture
+    def data(self):
+        X, y = make_classification(n_samples=50)
+        return X.astype(floatX), y.astype(np.int32)
+
+    def make_net(self, NeuralNet, X, cache_dir, num_units=2):
+        l = InputLayer(shape=(None, X.shape[1]))
+        l = DenseLayer(l, num_units=num_units, nonlinearity=softmax)
+        return NeuralNet(
+            l,
+            update_learning_rate=0.01,
+            compile_cache_dir=cache_dir,
+            identifier='1',
+            )
+
+    def test_warm_start(self, NeuralNet, data, tmpdir):
+        X, y = data
+        net1 = self.make_net(NeuralNet, X, str(tmpdir))
+        net1.initialize(mode='full')
+        assert len(tmpdir.listdir()) == 3
+
+        net2 = self.make_net(NeuralNet, X, str(tmpdir))
+        with patch.object(NeuralNet, '_create_iter_funcs') as create:
+            net2.initialize(mode='full')
+        assert create.call_count == 0
+
+        net2.load_params_from(net1)
+        assert np.allclose(net1.predict_iter_(X), net2.predict_iter_(X))
+
+        # The cached training function updates net2's own parameters:
+        W_before = net2.layers_[-1].W.get_value()
+        net2.train_iter_(X, y)
+        assert not np.allclose(W_before, net2.layers_[-1].W.get_value())
+        assert np.allclose(W_before, net1.layers_[-1].W.get_value())
+
+    def test_shared_learning_rate(self, NeuralNet, data, tmpdir):
+        X, y = data
+        net1 = self.make_net(NeuralNet, X, str(tmpdir))
+        net1.update_learning_rate = theano.shared(np.asarray(0.01, dtype=floatX))
+        net1.initialize(mode='full')
+
+        net2 = self.make_net(NeuralNet, X, str(tmpdir))
+        net2.update_learning_rate = theano.shared(np.asarray(0., dtype=floatX))
+        with patch.object(NeuralNet, '_create_iter_funcs') as create:
+            net2.initialize(mode='full')
+        assert create.call_count == 0
+
+        # net2 trains with its own learning rate, and sees changes to it:
+        W_before = net2.layers_[-1].W.get_value()
+        net2.train_iter_(X, y)
+        assert np.allclose(W_before, net2.layers_[-1].W.get_value())
+        net2.update_learning_rate.set_value(np.asarray(0.1, dtype=floatX))
+        net2.train_iter_(X, y)
+        assert not np.allclose(W_before, net2.layers_[-1].W.get_value())
+
+    def test_different_architecture(self, NeuralNet, data, tmpdir):
+        X, y = data
+        self.make_net(NeuralNet, X, str(tmpdir)).initialize(mode='full')
+        self.make_net(NeuralNet, X, str(tmpdir), num_units=3).initialize(
+            mode='full')
+        assert len(tmpdir.listdir()) == 6
+
+    def test_predict_mode(self, NeuralNet, data, tmpdir):
+        X, y = data
+        self.make_net(NeuralNet, X, str(tmpdir)).initialize(mode='predict')
+        assert len(tmpdir.listdir()) == 1
+
+    def test_fingerprint_includes_code(self, NeuralNet, data, tmpdir):
+        from nolearn.lasagne import objective
+        X, y = data
+
+        def make_objective(scale):
+            def my_objective(layers, *args, **kwargs):
+                return objective(layers, *args, **kwargs) * scale
+            return my_objective
+
+        def other_objective(layers, *args, **kwargs):
+            return objective(layers, *args, **kwargs) + 1
+
+        net = self.make_net(NeuralNet, X, str(tmpdir))
+        net.initialize()
+        paths = set()
+        for obj in (objective, make_objective(1), make_objective(2),
+                    other_objective):
+            net.objective = obj
+            paths.add(net._compile_cache_path('train'))
+        assert len(paths) == 4
+
+    def test_unhashable_callable_not_cached(self, NeuralNet, data, tmpdir):
+        from operator import itemgetter
+        X, y = data
+        net = self.make_net(NeuralNet, X, str(tmpdir))
+        net.objective_loss_function = itemgetter(0)
+        net.initialize()
+        assert net._compile_cache_path('predict') is None
+        with pytest.warns(UserWarning):
+            net.initialize(mode='predict')
+        assert tmpdir.listdir() == []
+
+
+class TestLazyCompilation:
+    @pytest.fixture
+    def net(self, NeuralNet):
+        l = InputLayer(shape=(None, 20))
+        l = DenseLayer(l, num_units=2, nonlinearity=softmax)
+        return NeuralNet(l, update_learning_rate=0.01, identifier='1')
+
+    def test_initialize_compiles_nothing(self, net):
+        with patch.object(net, '_create_iter_funcs') as create:
+            net.initialize()
+        assert create.call_count == 0
+        for kind in ('train', 'eval', 'predict'):
+            assert kind + '_iter_' not in vars(net)
+
+    def test_compiled_on_first_use(self, net):
+        X, y = make_classification(n_samples=20)
+        net.initialize()
+        net.train_iter_(X.astype(floatX), y.astype(np.int32))
+        assert 'train_iter_' in vars(net)
+        assert 'eval_iter_' not in vars(net)
+        assert 'predict_iter_' not in vars(net)
+
+    def test_predict_mode(self, net):
+        X, y = make_classification(n_samples=20)
+        X = X.astype(floatX)
+        batches = [(None, list(range(20)), X, None)]
+        net.batch_iterator_test = Mock(
+            side_effect=lambda X, y=None: iter(batches))
+        net.initialize(mode='predict')
+        assert 'predict_iter_' in vars(net)
+        assert 'train_iter_' not in vars(net)
+        assert net.predict_proba(X)[0].shape == (20, 2)
+        assert 'train_iter_' not in vars(net)
+
+    def test_eval_predictions_only_for_custom_score(self, net):
+        X, y = make_classification(n_samples=20)
+        X, y = X.astype(floatX), y.astype(np.int32)
+        net2 = clone(net)
+        net.initialize()
+        assert len(net.eval_iter_(X, y)) == 2
+
+        net2.custom_score = ('my_score', Mock(return_value=1.0))
+        net2.initialize()
+        loss, accuracy, y_prob = net2.eval_iter_(X, y)
+        assert y_prob.shape == (20, 2)
+
+    def test_unpickle_old_net(self, NeuralNet, net):
+        X, y = make_classification(n_samples=20)
+        X = X.astype(floatX)
+        net.initialize()
+        state = net.__getstate__()
+        for name in ('account_cache_bytes', 'account_store', 'shared_data',
+                     'shared_data_max_bytes', 'compile_cache_dir',
+                     'n_workers', 'sync_every', 'storage_dtype'):
+            del state[name]
+        with patch.object(NeuralNet, '__getstate__', return_value=state):
+            net2 = pickle.loads(pickle.dumps(net, -1))
+
+        assert net2.n_workers == 1
+        assert net2.storage_dtype is None
+        assert clone(net2).shared_data is False
+        batches = [(None, list(range(20)), X, None)]
+        net2.batch_iterator_test = Mock(
+            side_effect=lambda X, y=None: iter(batches))
+        assert np.allclose(net2.predict_proba(X)[0], net.predict_iter_(X))
+
+    def test_unknown_mode(self, net):
+        with pytest.raises(ValueError):
+            net.initialize(mode='train')
+
+    def test_pickle_does_not_compile(self, net):
+        net.initialize(mode='full')
+        net2 = pickle.loads(pickle.dumps(net, -1))
+        assert 'predict_iter_' not in vars(net2)
+
+
+class TestStorageDtype:
+    @pytest.fixture
+    def net(self, NeuralNet, batch_iterator):
+        l = InputLayer(shape=(None, 20))
+        l = DenseLayer(l, num_units=2, nonlinearity=softmax, name='output')
+        return NeuralNet(
+            l,
+            update_learning_rate=0.01,
+            batch_iterator_train=batch_iterator,
+            storage_dtype=np.float16,
+            identifier='1',
+            max_epochs=2,
+            )
+
+    @pytest.fixture
+    def data(self):
+        X, y = make_classification(n_samples=100)
+        return X.astype(floatX), y.astype(np.int32)
+
+    @pytest.mark.parametrize('format', ['pickle', 'binary'])
+    def test_save_params_to(self, net, tmpdir, format):
+        net.initialize()
+        path = str(tmpdir.join('params'))
+        net.save_params_to(path, format=format)
+
+        net2 = clone(net)
+        net2.load_params_from(path)
+        W1 = net.layers_['output'].W.get_value()
+        W2 = net2.layers_['output'].W.get_value()
+        assert W2.dtype == W1.dtype == floatX
+        assert np.allclose(W1, W2, atol=1e-3)
+        assert not np.array_equal(W1, W2)
+
+    def test_params_are_float32_masters(self, net, data):
+        X, y = data
+        net.fit(X[:75], y[:75], X[75:], y[75:])
+        for param in net.get_all_params():
+            assert param.dtype == floatX
+        values = net.get_all_params_values(dtype=net.storage_dtype)
+        assert values['output'][0].dtype == np.float16
+
+    def test_account_params(self, net):
+        net.account_weight_layers = ['output']
+        net.initialize()
+        # Weights that training continues from keep their precision:
+        W, b = net._get_account_params()['output']
+        assert W.dtype == b.dtype == floatX
+
+        params = net._get_account_params(BEST_LOSS=True)
+        W, b = params['output']
+        assert W.dtype == b.dtype == np.float16
+
+        net._set_account_params(params)
+        layer = net.layers_['output']
+        assert layer.W.get_value().dtype == floatX
+        assert np.array_equal(layer.W.get_value(), W.astype(floatX))
+
+    def test_unreadable_account_params(self, net, tmpdir):
+        from nolearn.lasagne.accounts import PickleAccountStore
+        net.account_weight_layers = ['output']
+        net.account_store = PickleAccountStore(str(tmpdir.join('w_')))
+        net.initialize()
+        tmpdir.join('w_7.pkl').write('garbage')
+        W, b = net._read_account_params(7)['output']
+        assert W.shape == (20, 2) and b.shape == (2,)
+
+    def test_shared_data(self, net, data):
+        from nolearn.lasagne import BatchIterator
+        X, y = data
+        net.shared_data = True
+        net.batch_iterator_train = BatchIterator(batch_size=32)
+        net.fit(X[:75], y[:75], X[75:], y[75:])
+        X_shared = net._shared_data_['train']['X_shared']
+        assert X_shared.get_value(borrow=True).dtype == np.float16
+        assert len(net.train_history_) == 2
+
+
+class TestLayerOutputFn:
+    @pytest.fixture
+    def net(self, NeuralNet):
+        batches = [
+            (None, ['a', 'b'], np.zeros((2, 20), dtype=floatX), None),
+            (None, ['c'], np.ones((1, 20), dtype=floatX), None),
+            ]
+        l = InputLayer(shape=(None, 20), name='input')
+        l = DenseLayer(l, num_units=5, name='hidden')
+        l = DenseLayer(l, num_units=2, nonlinearity=softmax, name='output')
+        return NeuralNet(
+            l,
+            update_learning_rate=0.01,
+            batch_iterator_test=Mock(
+                side_effect=lambda X, y=None: iter(batches)),
+            identifier='1',
+            )
+
+    def test_memoised(self, net):
+        func = net.get_layer_output_fn('hidden')
+        with patch('theano.function') as function:
+            assert net.get_layer_output_fn('hidden') is func
+            assert net.get_layer_output_fn(net.layers_['hidden']) is func
+        assert function.call_count == 0
+        assert net.get_layer_output_fn('output') is not func
+
+    def test_output(self, net):
+        X = np.random.random((4, 20)).astype(floatX)
+        hidden = net.get_layer_output_fn('hidden')(X)
+        assert hidden.shape == (4, 5)
+        assert np.allclose(
+            net.get_layer_output_fn(-1)(X), net.predict_iter_(X))
+
+    def test_transform(self, net):
+        output, fpaths = net.transform(None, layer='hidden')
+        assert output.shape == (3, 5)
+        assert fpaths == ['a', 'b', 'c']
+        hidden = net.get_layer_output_fn('hidden')
+        assert np.allclose(output[2], hidden(np.ones((1, 20)))[0])
+
+    def test_transform_output_layer(self, net):
+        output, fpaths = net.transform(None)
+        assert output.shape == (3, 2)
+
+    def test_transform_sized_by_n_samples(self, net):
+        net.batch_iterator_test.n_samples = 3
+        with patch('nolearn.lasagne.base._grow') as grow:
+            output, fpaths = net.transform(np.zeros((1, 20)))
+        assert grow.call_count == 0
+        assert output.shape == (3, 2)
+
+    def test_transform_out_too_small(self, net):
+        with pytest.raises(ValueError):
+            net.transform(None, out=np.zeros((2, 2)))
+
+    def test_not_pickled(self, net):
+        net.get_layer_output_fn('hidden')
+        net.batch_iterator_test = None
+        net2 = pickle.loads(pickle.dumps(net, -1))
+        assert not hasattr(net2, '_layer_output_fns_')
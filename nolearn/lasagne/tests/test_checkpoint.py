@@ -0,0 +1,60 @@
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def params():
+    return OrderedDict([
+        ('input', []),
+        ('hidden', [np.arange(12, dtype=np.float32).reshape(3, 4),
+                    np.ones(4, dtype=np.float32)]),
+        ('output', [np.arange(8, dtype=np.float64).reshape(4, 2),
+                    np.zeros(0, dtype=np.float32)]),
+        ])
+
+
+def test_roundtrip(params, tmpdir):
+    from nolearn.lasagne.checkpoint import load_checkpoint
+    from nolearn.lasagne.checkpoint import save_checkpoint
+
+    fname = str(tmpdir.join('params.ckpt'))
+    save_checkpoint(fname, params)
+    for mmap_mode in ('r', None):
+        loaded = load_checkpoint(fname, mmap_mode=mmap_mode)
+        assert list(loaded.keys()) == ['hidden', 'output']
+        for name, values in loaded.items():
+            assert len(values) == len(params[name])
+            for value, expected in zip(values, params[name]):
+                assert value.dtype == expected.dtype
+                assert value.shape == expected.shape
+                assert (value == expected).all()
+    assert isinstance(load_checkpoint(fname)['hidden'][0], np.memmap)
+
+
+def test_payloads_aligned(params, tmpdir):
+    from nolearn.lasagne.checkpoint import ALIGNMENT
+    from nolearn.lasagne.checkpoint import read_header
+    from nolearn.lasagne.checkpoint import save_checkpoint
+
+    fname = str(tmpdir.join('params.ckpt'))
+    save_checkpoint(fname, params)
+    entries, data_offset = read_header(fname)
+    assert data_offset % ALIGNMENT == 0
+    assert [entry['offset'] % ALIGNMENT for entry in entries] == [0] * 4
+    assert entries[0]['layer'] == 'hidden'
+    assert entries[0]['shape'] == (3, 4)
+    assert entries[2]['dtype'] == np.dtype(np.float64).str
+
+
+def test_is_checkpoint(params, tmpdir):
+    from nolearn.lasagne.checkpoint import is_checkpoint
+    from nolearn.lasagne.checkpoint import save_checkpoint
+
+    fname = str(tmpdir.join('params.ckpt'))
+    assert not is_checkpoint(fname)
+    save_checkpoint(fname, params)
+    assert is_checkpoint(fname)
+    tmpdir.join('params.pkl').write('not a checkpoint')
+    assert not is_checkpoint(str(tmpdir.join('params.pkl')))
@@ -0,0 +1,85 @@
+from lasagne.layers import DenseLayer
+from lasagne.layers import InputLayer
+from lasagne.nonlinearities import softmax
+import numpy as np
+import pytest
+from sklearn.base import BaseEstimator
+from sklearn.datasets import make_classification
+import theano
+
+
+class _FoldNet(BaseEstimator):
+    """Records the data it was fit on in a fake train history.
+    """
+    def __init__(self, regression=False, epochs=2):
+        self.regression = regression
+        self.epochs = epochs
+
+    def fit(self, X_train, y_train, X_valid, y_valid):
+        self.train_history_ = [{
+            'epoch': epoch,
+            'train_loss': float(len(X_train)),
+            'valid_loss': float(X_valid.sum()) / epoch,
+            'valid_loss_best': True,
+            'n_valid': len(X_valid),
+            } for epoch in range(1, self.epochs + 1)]
+        return self
+
+    def get_all_params_values(self):
+        return {'n_epochs': self.epochs}
+
+
+def test_aggregate_histories():
+    from nolearn.lasagne.cross_validation import aggregate_histories
+
+    histories = [
+        [{'epoch': 1, 'valid_loss': 1.0, 'valid_loss_best': True},
+         {'epoch': 2, 'valid_loss': 0.5, 'valid_loss_best': True}],
+        [{'epoch': 1, 'valid_loss': 3.0, 'valid_loss_best': True}],
+        ]
+    history = aggregate_histories(histories)
+    assert history == [
+        {'epoch': 1, 'n_folds': 2,
+         'valid_loss_mean': 2.0, 'valid_loss_std': 1.0},
+        {'epoch': 2, 'n_folds': 1,
+         'valid_loss_mean': 0.5, 'valid_loss_std': 0.0},
+        ]
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_folds(n_jobs):
+    from nolearn.lasagne import CrossValidation
+
+    X = np.arange(48, dtype=np.float64).reshape(24, 2)
+    y = np.array([0, 1] * 12)
+    cv = CrossValidation(
+        _FoldNet(), n_folds=4, n_jobs=n_jobs, max_nbytes=0,
+        return_params=True)
+    assert cv.fit(X, y) is cv
+
+    assert len(cv.histories_) == 4
+    assert [h[0]['n_valid'] for h in cv.histories_] == [6] * 4
+    assert [h[0]['train_loss'] for h in cv.histories_] == [18.] * 4
+    # Every sample is in exactly one validation fold:
+    total = sum(h[0]['valid_loss'] for h in cv.histories_)
+    assert total == X.sum()
+    assert cv.history_[1]['n_folds'] == 4
+    assert cv.best_valid_loss_.shape == (4,)
+    assert cv.params_ == [{'n_epochs': 2}] * 4
+
+
+def test_neural_net(NeuralNet, batch_iterator):
+    from nolearn.lasagne import CrossValidation
+
+    X, y = make_classification(n_samples=90)
+    X = X.astype(theano.config.floatX)
+    y = y.astype(np.int32)
+    l = InputLayer(shape=(None, X.shape[1]))
+    l = DenseLayer(l, num_units=2, nonlinearity=softmax)
+    net = NeuralNet(l, update_learning_rate=0.01, max_epochs=2,
+                    batch_iterator_train=batch_iterator,
+                    identifier='1')
+
+    cv = CrossValidation(net, n_folds=3).fit(X, y)
+    assert [len(h) for h in cv.histories_] == [2, 2, 2]
+    assert net.train_history_ == []
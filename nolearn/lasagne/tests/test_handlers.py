@@ -41,6 +41,96 @@ def test_print_log(mnist):
 """
 
 
+def test_print_log_timings():
+    from nolearn.lasagne import PrintLog
+
+    nn = Mock(custom_score=None)
+    train_history = [{
+        'epoch': 1,
+        'train_loss': 0.8,
+        'valid_loss': 0.7,
+        'train_loss_best': False,
+        'valid_loss_best': False,
+        'train_accuracy': 0.8,
+        'valid_accuracy': 0.9,
+        'dur': 1.0,
+        'dur_train': 0.7,
+        'dur_batches': 0.2,
+        }]
+    header = PrintLog().table(nn, train_history).split('\n')[0]
+    assert header.split()[-3:] == ['dur', 'dur_batches', 'dur_train']
+
+
+def test_print_log_fixed_columns():
+    from nolearn.lasagne import PrintLog
+
+    nn = Mock(custom_score=None)
+    info = {
+        'epoch': 1,
+        'train_loss': 0.8,
+        'valid_loss': 0.7,
+        'train_loss_best': False,
+        'valid_loss_best': False,
+        'train_accuracy': 0.8,
+        'valid_accuracy': 0.9,
+        'dur': 1.0,
+        'dur_train': 0.7,
+        }
+    print_log = PrintLog()
+    header, line, row1 = print_log.table(nn, [info]).split('\n')
+    info = dict(info, epoch=2, dur_my_phase=0.1)
+    row2 = print_log.table(nn, [info])
+    assert 'dur_my_phase' not in header
+    assert len(row2.split()) == len(row1.split())
+
+
+def test_print_log_writes_to_sink():
+    from nolearn.lasagne import MemorySink
+    from nolearn.lasagne import PrintLog
+
+    nn = Mock(custom_score=None)
+    train_history = [{
+        'epoch': 1,
+        'train_loss': 0.8,
+        'valid_loss': 0.7,
+        'train_loss_best': False,
+        'valid_loss_best': False,
+        'train_accuracy': 0.8,
+        'valid_accuracy': 0.9,
+        'dur': 1.0,
+        'dur_train': 0.7,
+        }]
+    sink = MemorySink()
+    PrintLog(sink=sink)(nn, train_history)
+    assert sink.records == [dict(train_history[0], **{'train/val': 0.8 / 0.7})]
+
+
+def test_print_log_tracker_columns(tmpdir):
+    from nolearn.lasagne import PrintLog
+
+    nn = Mock(custom_score=None, HOME=str(tmpdir) + '/', identifier=1)
+    info = {
+        'epoch': 1,
+        'train_loss': 0.8,
+        'valid_loss': 0.4,
+        'train_loss_best': False,
+        'valid_loss_best': False,
+        'train_accuracy': 0.8,
+        'valid_accuracy': 0.9,
+        'dur': 1.0,
+        'dur_train': 0.7,
+        }
+    print_log = PrintLog()
+    print_log(nn, [info])
+    print_log.close()
+    with open(str(tmpdir.join('trainedParams', '1_tracker.csv'))) as f:
+        lines = f.read().splitlines()
+    assert lines == [
+        'train_loss,valid_loss,train/val,train_accuracy,valid_accuracy,dur',
+        '0.8,0.4,2.0,0.8,0.9,1.0',
+        ]
+
+
 class TestSaveWeights():
     @pytest.fixture
     def SaveWeights(self):
@@ -89,6 +179,22 @@ class TestSaveWeights():
         handler(nn, train_history)
         assert nn.save_params_to.call_count == 0
 
+    def test_only_best_incremental(self, SaveWeights):
+        train_history = [{'epoch': 1, 'valid_loss': 1.2}]
+        nn = Mock()
+        handler = SaveWeights('mypath', only_best=True)
+        handler(nn, train_history)
+        assert nn.save_params_to.call_count == 1
+
+        for epoch, loss in [(2, 1.3), (3, 1.1), (4, 1.15)]:
+            train_history.append({'epoch': epoch, 'valid_loss': loss})
+            handler(nn, train_history)
+        assert nn.save_params_to.call_count == 2
+
+        # A new history, e.g. after a refit, starts over:
+        handler(nn, [{'epoch': 1, 'valid_loss': 1.4}])
+        assert nn.save_params_to.call_count == 3
+
     def test_with_path_interpolation(self, SaveWeights):
         train_history = [{'epoch': 9, 'valid_loss': 1.1}]
         nn = Mock()
@@ -109,6 +215,45 @@ class TestSaveWeights():
         mock_open.assert_called_with('mypath', 'wb')
         pickle.dump.assert_called_with(nn, mock_open().__enter__(), -1)
 
+    def test_background(self, SaveWeights, tmpdir):
+        train_history = [{'epoch': 9, 'valid_loss': 1.1}]
+        nn = Mock()
+        nn.get_all_params_values.return_value = {'dense': [numpy.ones(3)]}
+        path = str(tmpdir.join('epoch-{epoch}.pkl'))
+        handler = SaveWeights(path, background=True)
+        handler(nn, train_history)
+        train_history.append({'epoch': 10, 'valid_loss': 1.0})
+        handler(nn, train_history)
+        handler.wait()
+
+        assert nn.save_params_to.call_count == 0
+        assert sorted(f.basename for f in tmpdir.listdir()) == [
+            'epoch-0009.pkl', 'epoch-0010.pkl']
+        with open(str(tmpdir.join('epoch-0010.pkl')), 'rb') as f:
+            assert (pickle.load(f)['dense'][0] == 1).all()
+
+    def test_background_binary(self, SaveWeights, tmpdir):
+        from nolearn.lasagne.checkpoint import load_checkpoint
+
+        train_history = [{'epoch': 9, 'valid_loss': 1.1}]
+        nn = Mock()
+        nn.get_all_params_values.return_value = {'dense': [numpy.ones(3)]}
+        path = str(tmpdir.join('params.ckpt'))
+        handler = SaveWeights(path, background=True, format='binary')
+        handler(nn, train_history)
+        handler.wait()
+        assert (load_checkpoint(path)['dense'][0] == 1).all()
+
+    def test_background_error_raised_on_wait(self, SaveWeights, tmpdir):
+        train_history = [{'epoch': 9, 'valid_loss': 1.1}]
+        nn = Mock()
+        nn.get_all_params_values.return_value = {'dense': [numpy.ones(3)]}
+        path = str(tmpdir.join('missing', 'params.pkl'))
+        handler = SaveWeights(path, background=True)
+        handler(nn, train_history)
+        with pytest.raises(IOError):
+            handler.wait()
+
 
 class TestRememberBestWeights:
     @pytest.fixture
@@ -162,6 +307,75 @@ class TestRememberBestWeights:
         nn.load_params_from.assert_called_with(rbw.best_weights)
 
 
+class TestRememberBestWeightsStore:
+    @pytest.fixture
+    def RememberBestWeights(self):
+        from nolearn.lasagne.handlers import RememberBestWeights
+        return RememberBestWeights
+
+    @pytest.fixture
+    def nn(self):
+        import theano
+        W = theano.shared(numpy.zeros((3, 2)))
+        b = theano.shared(numpy.zeros(2))
+        nn = Mock()
+        nn.layers_ = OrderedDict([
+            ('input', Mock(get_params=lambda: [])),
+            ('dense', Mock(get_params=lambda: [W, b])),
+            # shares its weights with 'dense':
+            ('tied', Mock(get_params=lambda: [W])),
+            ])
+
+        def get_all_params_values():
+            return OrderedDict(
+                (name, [p.get_value() for p in layer.get_params()])
+                for name, layer in nn.layers_.items())
+        nn.get_all_params_values = get_all_params_values
+        nn.W, nn.b = W, b
+        return nn
+
+    def test_unknown_store(self, RememberBestWeights):
+        with pytest.raises(ValueError):
+            RememberBestWeights(store='disk')
+
+    def test_host(self, RememberBestWeights, nn):
+        rbw = RememberBestWeights(store='host')
+        rbw(nn, [{'epoch': 1, 'valid_loss': 1.0}])
+        buf = rbw.best_weights['dense'][0]
+        nn.W.set_value(numpy.ones((3, 2)))
+        rbw(nn, [{'epoch': 2, 'valid_loss': 0.9}])
+        assert rbw.best_weights['dense'][0] is buf
+        assert (buf == 1).all()
+
+        nn.W.set_value(numpy.ones((3, 2)) * 2)
+        rbw(nn, [{'epoch': 3, 'valid_loss': 1.1}])
+        assert (buf == 1).all()
+
+    def test_device(self, RememberBestWeights, nn):
+        rbw = RememberBestWeights(store='device')
+        nn.W.set_value(numpy.ones((3, 2)))
+        rbw(nn, [{'epoch': 1, 'valid_loss': 1.0}])
+        assert rbw.best_weights['dense'][0] is rbw.best_weights['tied'][0]
+
+        nn.W.set_value(numpy.ones((3, 2)) * 2)
+        rbw(nn, [{'epoch': 2, 'valid_loss': 1.1}])
+        rbw.restore(nn, [])
+        assert (nn.W.get_value() == 1).all()
+
+        nn.W.set_value(numpy.ones((3, 2)) * 3)
+        rbw(nn, [{'epoch': 3, 'valid_loss': 0.5}])
+        nn.W.set_value(numpy.zeros((3, 2)))
+        rbw.restore(nn, [])
+        assert (nn.W.get_value() == 3).all()
+        assert rbw.best_weights_epoch == 3
+
+    def test_device_pickle(self, RememberBestWeights, nn):
+        rbw = RememberBestWeights(store='device')
+        rbw(nn, [{'epoch': 1, 'valid_loss': 1.0}])
+        rbw = pickle.loads(pickle.dumps(rbw, -1))
+        assert rbw._copy_funcs == {}
+
+
 class TestPrintLayerInfo():
     @pytest.fixture(scope='session')
     def X_train(self, mnist):
@@ -378,6 +592,40 @@ class TestWeightLog:
             '1.0,2.5,-2.5,2.5,6.0,6.0\n',
             ]
 
+    def test_every_n_batches(self, WeightLog, nn):
+        wl = WeightLog(every_n_batches=2)
+        wl(nn, None)
+        wl(nn, None)
+        wl(nn, None)
+        assert len(wl.history) == 2
+        assert nn.get_all_params_values.call_count == 2
+
+    def test_device(self, WeightLog):
+        import theano
+        W = theano.shared(numpy.array([[-1., -2.]]))
+        nn = Mock()
+        nn.layers_ = OrderedDict([
+            ('input', Mock(get_params=lambda: [])),
+            ('layer1', Mock(get_params=lambda: [W])),
+            ])
+
+        wl = WeightLog()
+        wl(nn, None)
+        W.set_value(numpy.array([[-2., -3.]]))
+        wl(nn, None)
+
+        assert nn.get_all_params_values.call_count == 0
+        assert wl.history[0] == {
+            'layer1_0 wdiff': 0.0,
+            'layer1_0 wabsmean': 1.5,
+            'layer1_0 wmean': -1.5,
+            'layer1_0 wmin': -2.0,
+            'layer1_0 wmax': -1.0,
+            'layer1_0 wstd': 0.5,
+            }
+        assert wl.history[1]['layer1_0 wdiff'] == 1.0
+        assert wl.history[1]['layer1_0 wmin'] == -3.0
+
     def test_pickle(self, WeightLog, nn, tmpdir):
         save_to = tmpdir.join("hello.csv")
         pkl = tmpdir.join("hello.pkl")
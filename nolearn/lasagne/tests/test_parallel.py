@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+
+
+class _Param(object):
+    def __init__(self, value):
+        self.value = np.array(value)
+
+    def get_value(self, borrow=False):
+        return self.value if borrow else self.value.copy()
+
+    def set_value(self, value):
+        self.value = np.array(value)
+
+
+class _Net(object):
+    """Stands in for a NeuralNet whose training step adds the sum of
+    the batch to its single parameter.
+    """
+    def __init__(self):
+        self.W = _Param(np.zeros(2))
+
+    def get_all_params(self):
+        return [self.W]
+
+    def train_iter_(self, Xb, yb):
+        if (Xb < 0).any():
+            raise ValueError("negative")
+        self.W.set_value(self.W.get_value() + Xb.sum())
+        return [Xb.mean()]
+
+    @staticmethod
+    def apply_batch_func(func, Xb, yb=None):
+        return func(Xb, yb)
+
+
+@pytest.fixture
+def DataParallelTrainer():
+    from nolearn.lasagne.parallel import DataParallelTrainer
+    return DataParallelTrainer
+
+
+def test_sync_every_batch(DataParallelTrainer):
+    net = _Net()
+    trainer = DataParallelTrainer(net, n_workers=2)
+    try:
+        loss = trainer.train(np.ones(4), np.zeros(4))
+        assert loss == [1.0]
+        assert (net.W.value == 2).all()
+        trainer.train(np.ones(4) * 2, np.zeros(4))
+        assert (net.W.value == 6).all()
+    finally:
+        trainer.close()
+
+
+def test_periodic_averaging(DataParallelTrainer):
+    net = _Net()
+    trainer = DataParallelTrainer(net, n_workers=2, sync_every=2)
+    try:
+        trainer.train(np.ones(4), np.zeros(4))
+        assert (net.W.value == 2).all()
+        loss = trainer.train(np.array([1., 1., 3., 3.]), np.zeros(4))
+        assert loss == [2.0]
+        assert (net.W.value == 6).all()
+    finally:
+        trainer.close()
+
+
+def test_sync_at_end_of_epoch(DataParallelTrainer):
+    net = _Net()
+    trainer = DataParallelTrainer(net, n_workers=2, sync_every=10)
+    try:
+        trainer.train(np.array([1., 1., 3., 3.]), np.zeros(4))
+        assert (net.W.value == 2).all()
+        trainer.sync()
+        assert (net.W.value == 4).all()
+    finally:
+        trainer.close()
+
+
+def test_changes_between_batches_loaded(DataParallelTrainer):
+    net = _Net()
+    trainer = DataParallelTrainer(net, n_workers=2)
+    try:
+        trainer.train(np.ones(4), np.zeros(4))
+        # What a handler might do in between, e.g. load_params_from:
+        net.W.set_value(np.ones(2) * 10)
+        trainer.train(np.ones(4), np.zeros(4))
+        assert (net.W.value == 12).all()
+    finally:
+        trainer.close()
+
+
+def test_small_batch(DataParallelTrainer):
+    net = _Net()
+    trainer = DataParallelTrainer(net, n_workers=4)
+    try:
+        assert trainer.train(np.ones(2), np.zeros(2)) == [1.0]
+        assert (net.W.value == 1).all()
+    finally:
+        trainer.close()
+
+
+def test_worker_error(DataParallelTrainer):
+    net = _Net()
+    trainer = DataParallelTrainer(net, n_workers=2)
+    try:
+        with pytest.raises(RuntimeError) as err:
+            trainer.train(np.array([1., -1.]), np.zeros(2))
+        assert 'negative' in str(err.value)
+    finally:
+        trainer.close()
+    assert trainer.processes == []
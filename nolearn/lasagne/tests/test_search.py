@@ -0,0 +1,134 @@
+import numpy as np
+import pytest
+from sklearn.base import BaseEstimator
+
+
+class _SearchNet(BaseEstimator):
+    """Fakes training by appending to its train history on every call
+    to :meth:`fit`.  Its validation loss decreases faster the closer
+    `lr` is to `0.1`.
+    """
+    def __init__(self, lr=0.01, max_epochs=9, compile_cache_dir=None):
+        self.lr = lr
+        self.max_epochs = max_epochs
+        self.compile_cache_dir = compile_cache_dir
+
+    def fit(self, X_train, y_train, X_valid, y_valid):
+        history = getattr(self, 'train_history_', [])
+        for i in range(self.max_epochs):
+            epoch = len(history) + 1
+            history.append({
+                'epoch': epoch,
+                'valid_loss': (1. + abs(np.log10(self.lr) + 1)) / epoch,
+                'cache_dir': self.compile_cache_dir,
+                })
+        self.train_history_ = history
+        return self
+
+
+@pytest.fixture
+def data():
+    X = np.random.random((20, 3)).astype(np.float32)
+    y = np.zeros(20, dtype=np.int32)
+    return X[:15], y[:15], X[15:], y[15:]
+
+
+class TestSuccessiveHalvingSearch:
+    @pytest.fixture
+    def Search(self):
+        from nolearn.lasagne.search import SuccessiveHalvingSearch
+        return SuccessiveHalvingSearch
+
+    @pytest.fixture
+    def search(self, Search):
+        return Search(
+            _SearchNet(),
+            {'lr': [0.0001, 0.001, 0.01, 0.1, 1.0, 10.0, 100., 1000., 0.1]},
+            verbose=0,
+            )
+
+    def test_schedule(self, search):
+        assert search._schedule(9, 1) == [(9, 1), (3, 3), (1, 9)]
+        assert search._schedule(2, 1) == [(2, 1), (1, 3)]
+        assert search._schedule(27, 3) == [(27, 3), (9, 9)]
+
+    def test_fit(self, search, data):
+        search.fit(*data)
+        assert search.best_params_ == {'lr': 0.1}
+        assert search.best_score_ == 1. / 9
+        assert search.best_estimator_.max_epochs == 9
+        assert len(search.best_estimator_.train_history_) == 9
+
+        epochs = sorted(trial['epochs'] for trial in search.trials_)
+        assert epochs == [1] * 6 + [3, 3, 9]
+        assert all('net' not in trial for trial in search.trials_)
+
+    def test_shared_compile_cache_dir(self, search, data, tmpdir):
+        search.compile_cache_dir = str(tmpdir)
+        search.fit(*data)
+        for trial in search.trials_:
+            assert set(row['cache_dir'] for row in trial['history']) == set(
+                [str(tmpdir)])
+        assert search.best_estimator_.compile_cache_dir == str(tmpdir)
+
+    def test_temporary_compile_cache_dir(self, search, data):
+        search.fit(*data)
+        cache_dirs = set(
+            row['cache_dir']
+            for trial in search.trials_ for row in trial['history'])
+        assert len(cache_dirs) == 1
+        assert cache_dirs.pop() is not None
+        assert search.best_estimator_.compile_cache_dir is None
+
+    def test_greater_is_better(self, Search, data):
+        search = Search(
+            _SearchNet(), {'lr': [0.001, 0.1, 10.0]},
+            greater_is_better=True, verbose=0,
+            )
+        search.fit(*data)
+        assert search.best_params_['lr'] in (0.001, 10.0)
+
+    def test_n_iter(self, Search, data):
+        search = Search(
+            _SearchNet(), {'lr': [0.001, 0.01, 0.1, 1.0]},
+            n_iter=3, random_state=42, verbose=0,
+            )
+        search.fit(*data)
+        assert len(search.trials_) == 3
+
+    def test_n_jobs(self, search, data):
+        search.n_jobs = 2
+        search.fit(*data)
+        assert search.best_params_ == {'lr': 0.1}
+
+    def test_print_report(self, search, data, capsys):
+        search.fit(*data).print_report()
+        out, err = capsys.readouterr()
+        assert "Best score: 0.1111" in out
+        assert "lr=0.1," in out
+
+
+class TestHyperbandSearch:
+    @pytest.fixture
+    def search(self):
+        from nolearn.lasagne.search import HyperbandSearch
+        return HyperbandSearch(
+            _SearchNet(),
+            {'lr': [0.0001, 0.001, 0.01, 0.1, 1.0, 10.0, 100.0]},
+            random_state=42,
+            verbose=0,
+            )
+
+    def test_brackets(self, search):
+        search._random_state = np.random.RandomState(42)
+        brackets = search._brackets()
+        assert [min_epochs for configs, min_epochs in brackets] == [
+            1, 3, 9]
+        assert [len(configs) for configs, min_epochs in brackets] == [
+            7, 5, 3]
+
+    def test_fit(self, search, data):
+        search.fit(*data)
+        assert search.best_params_ == {'lr': 0.1}
+        assert len(search.trials_) == 15
+        assert max(trial['epochs'] for trial in search.trials_) == 9
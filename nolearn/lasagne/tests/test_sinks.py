@@ -0,0 +1,159 @@
+from csv import DictReader
+
+import numpy as np
+import pytest
+
+
+def _history(n, **extra):
+    for epoch in range(1, n + 1):
+        info = {
+            'epoch': epoch,
+            'train_loss': 1.0 / epoch,
+            'valid_loss': 2.0 / epoch,
+            'valid_loss_best': True,
+            'dur': 0.5,
+            }
+        info.update(extra)
+        yield info
+
+
+class TestMemorySink:
+    def test_buffered(self):
+        from nolearn.lasagne.sinks import MemorySink
+
+        sink = MemorySink(flush_every=3)
+        for info in _history(4):
+            sink.write(info)
+        assert len(sink.records) == 3
+        sink.flush()
+        assert len(sink.records) == 4
+
+    def test_flush_interval(self):
+        from nolearn.lasagne.sinks import MemorySink
+
+        sink = MemorySink(flush_every=100, flush_interval=0)
+        sink.write({'epoch': 1})
+        assert len(sink.records) == 1
+
+    def test_as_handler(self):
+        from nolearn.lasagne.sinks import MemorySink
+
+        sink = MemorySink()
+        history = list(_history(2))
+        sink(None, history[:1])
+        sink(None, history)
+        assert sink.columns()['epoch'] == [1, 2]
+
+    def test_columns(self):
+        from nolearn.lasagne.sinks import MemorySink
+
+        sink = MemorySink()
+        sink.write({'epoch': 1})
+        sink.write({'epoch': 2, 'my_score': 0.5})
+        assert sink.columns() == {'epoch': [1, 2], 'my_score': [None, 0.5]}
+
+
+class TestCSVSink:
+    def test_all_keys(self, tmpdir):
+        from nolearn.lasagne.sinks import CSVSink
+
+        path = str(tmpdir.join('tracker.csv'))
+        sink = CSVSink(path)
+        for info in _history(3, my_score=0.9):
+            sink.write(info)
+        sink.close()
+
+        with open(path) as f:
+            reader = DictReader(f)
+            rows = list(reader)
+        assert reader.fieldnames == [
+            'epoch', 'train_loss', 'valid_loss', 'dur',
+            'my_score', 'valid_loss_best']
+        assert [row['epoch'] for row in rows] == ['1', '2', '3']
+        assert rows[0]['my_score'] == '0.9'
+
+    def test_new_key_left_out(self, tmpdir):
+        from nolearn.lasagne.sinks import CSVSink
+
+        path = str(tmpdir.join('tracker.csv'))
+        sink = CSVSink(path, flush_every=1)
+        sink.write({'epoch': 1})
+        with pytest.warns(UserWarning):
+            sink.write({'epoch': 2, 'dur_eval': 0.1})
+        sink.close()
+
+        with open(path) as f:
+            rows = list(DictReader(f))
+        assert rows == [{'epoch': '1'}, {'epoch': '2'}]
+
+    def test_columns(self, tmpdir):
+        from nolearn.lasagne.sinks import CSVSink
+
+        path = str(tmpdir.join('tracker.csv'))
+        sink = CSVSink(path, columns=['valid_loss', 'epoch'])
+        for info in _history(2):
+            sink.write(info)
+        sink.close()
+        with open(path) as f:
+            assert f.readline().strip() == 'valid_loss,epoch'
+            assert f.readline().strip() == '2.0,1'
+
+    def test_truncate_and_append(self, tmpdir):
+        from nolearn.lasagne.sinks import CSVSink
+
+        path = str(tmpdir.join('tracker.csv'))
+        tmpdir.join('tracker.csv').write('epoch\n99\n')
+        sink = CSVSink(path, append=True)
+        sink.write({'epoch': 1})
+        sink.close()
+        with open(path) as f:
+            assert [row['epoch'] for row in DictReader(f)] == ['99', '1']
+
+        sink = CSVSink(path)
+        sink.write({'epoch': 1})
+        sink.close()
+        with open(path) as f:
+            assert [row['epoch'] for row in DictReader(f)] == ['1']
+
+    def test_pickle(self, tmpdir):
+        import pickle
+        from nolearn.lasagne.sinks import CSVSink
+
+        path = str(tmpdir.join('tracker.csv'))
+        sink = CSVSink(path)
+        sink.write({'epoch': 1})
+        sink = pickle.loads(pickle.dumps(sink))
+        sink.write({'epoch': 2})
+        sink.close()
+        with open(path) as f:
+            assert [row['epoch'] for row in DictReader(f)] == ['1', '2']
+
+
+class TestNpySink:
+    def test_chunks(self, tmpdir):
+        from nolearn.lasagne.sinks import load_npy_chunks
+        from nolearn.lasagne.sinks import NpySink
+
+        path = str(tmpdir.join('metrics'))
+        sink = NpySink(path, flush_every=2)
+        for info in _history(3):
+            sink.write(info)
+        sink.write({'epoch': 4, 'my_score': 0.5, 'note': 'x'})
+        assert len(tmpdir.join('metrics').listdir()) == 2
+
+        columns = load_npy_chunks(path)
+        assert list(columns['epoch']) == [1, 2, 3, 4]
+        assert columns['valid_loss_best'][0]
+        assert np.isnan(columns['train_loss'][3])
+        assert np.isnan(columns['my_score'][:3]).all()
+        assert columns['my_score'][3] == 0.5
+        assert list(columns['note']) == ['', '', '', 'x']
+
+    def test_continues_numbering(self, tmpdir):
+        from nolearn.lasagne.sinks import NpySink
+
+        path = str(tmpdir.join('metrics'))
+        NpySink(path, flush_every=1).write({'epoch': 1})
+        NpySink(path, flush_every=1).write({'epoch': 2})
+        fnames = sorted(f.basename for f in tmpdir.join('metrics').listdir())
+        assert fnames == ['chunk-000000.npy', 'chunk-000001.npy']
@@ -0,0 +1,44 @@
+import time
+
+import pytest
+
+
+class TestPhaseTimer:
+    @pytest.fixture
+    def timer(self):
+        from nolearn.lasagne.timing import PhaseTimer
+        return PhaseTimer()
+
+    def test_span(self, timer):
+        with timer.span('one'):
+            time.sleep(0.01)
+        with timer.span('one'):
+            pass
+        assert 0.01 <= timer.totals['one'] < 1.0
+        assert list(timer.totals) == ['one']
+
+    def test_span_exception(self, timer):
+        with pytest.raises(ValueError):
+            with timer.span('one'):
+                raise ValueError()
+        assert 'one' in timer.totals
+
+    def test_iterate(self, timer):
+        def slow():
+            for i in range(2):
+                time.sleep(0.01)
+                yield i
+
+        items = []
+        for i in timer.iterate(slow(), 'batches'):
+            items.append(i)
+            time.sleep(0.05)
+        assert items == [0, 1]
+        assert 0.02 <= timer.totals['batches'] < 0.1
+
+    def test_durations_and_reset(self, timer):
+        timer.add('train', 1.5)
+        timer.add('train', 0.5)
+        assert timer.durations() == {'dur_train': 2.0}
+        timer.reset()
+        assert timer.durations() == {}
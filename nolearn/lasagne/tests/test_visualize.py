@@ -1,4 +1,6 @@
 import matplotlib.pyplot as plt
+import numpy as np
+import pytest
 
 
 class TestCNNVisualizeFunctions:
@@ -55,3 +57,73 @@ class TestCNNVisualizeFunctions:
         plot_occlusion(net_color_non_square, X[:3], [3, 2, 1])
         plt.clf()
         plt.cla()
+
+
+class _SoftmaxNet(object):
+    """A linear softmax model that counts its predict calls.
+    """
+    def __init__(self, n_inputs, n_classes=4):
+        self.W = np.random.RandomState(0).rand(n_inputs, n_classes)
+        self.n_calls = 0
+
+    def predict_iter_(self, X):
+        self.n_calls += 1
+        z = X.reshape(len(X), -1).dot(self.W)
+        e = np.exp(z - z.max(axis=1, keepdims=True))
+        return e / e.sum(axis=1, keepdims=True)
+
+    @staticmethod
+    def apply_batch_func(func, Xb):
+        return func(Xb)
+
+
+def _naive_occlusion_heatmap(net, x, target, square_length):
+    img = x[0]
+    s0, s1 = img.shape[1:]
+    pad = square_length // 2 + 1
+    heat_array = np.zeros((s0, s1))
+    for i in range(s0):
+        for j in range(s1):
+            x_pad = np.pad(img, ((0, 0), (pad, pad), (pad, pad)), 'constant')
+            x_pad[:, i:i + square_length, j:j + square_length] = 0.
+            x_occluded = x_pad[None, :, pad:-pad, pad:-pad]
+            heat_array[i, j] = net.predict_iter_(x_occluded)[0, target]
+    return heat_array
+
+
+class TestOcclusionHeatmap:
+    @pytest.fixture
+    def X(self):
+        return np.random.random((3, 3, 9, 11)).astype(np.float32)
+
+    @pytest.fixture
+    def net(self):
+        return _SoftmaxNet(3 * 9 * 11)
+
+    @pytest.mark.parametrize('square_length', [1, 3, 7])
+    def test_same_as_naive(self, net, X, square_length):
+        from nolearn.lasagne.visualize import occlusion_heatmap
+        heat_array = occlusion_heatmap(
+            net, X[:1], 2, square_length, batch_size=17)
+        assert heat_array.shape == (9, 11)
+        assert np.allclose(heat_array, _naive_occlusion_heatmap(
+            net, X[:1], 2, square_length), atol=1e-5)
+
+    def test_many_images(self, net, X):
+        from nolearn.lasagne.visualize import occlusion_heatmap
+        net.n_calls = 0
+        heat_arrays = occlusion_heatmap(net, X, [0, 1, 2], 3, batch_size=100)
+        assert heat_arrays.shape == (3, 9, 11)
+        assert net.n_calls == 3  # 297 occluded images
+        for n in range(3):
+            assert np.allclose(heat_arrays[n], _naive_occlusion_heatmap(
+                net, X[n:n + 1], n, 3), atol=1e-5)
+
+    def test_stride(self, net, X):
+        from nolearn.lasagne.visualize import occlusion_heatmap
+        heat_arrays = occlusion_heatmap(net, X, 1, 3)
+        strided = occlusion_heatmap(net, X, 1, 3, stride=2)
+        assert strided.shape == heat_arrays.shape
+        assert np.allclose(strided[:, ::2, ::2], heat_arrays[:, ::2, ::2])
+        assert np.allclose(
+            strided[:, 1::2, 1::2], heat_arrays[:, :-1:2, :-1:2])
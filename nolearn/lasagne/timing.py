@@ -0,0 +1,72 @@
+from time import time
+
+
+class _Span(object):
+    __slots__ = ('timer', 'phase', 'start')
+
+    def __init__(self, timer, phase):
+        self.timer = timer
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timer.add(self.phase, time() - self.start)
+        return False
+
+
+class PhaseTimer(object):
+    """Accumulates wall time per named phase.
+
+    :class:`NeuralNet` keeps one in its `timer_` attribute while
+    training, and resets it whenever it has added an epoch's entry to
+    the train history.  Handlers can time their own phases, which are
+    then reported along with the net's phases.  Phases that run in
+    `on_epoch_finished` handlers, including `epoch_handlers` itself,
+    are reported with the next epoch's entry, or added to the last
+    entry when training ends:
+
+    .. code-block:: python
+
+        def my_handler(nn, train_history):
+            with nn.timer_.span('my_phase'):
+                ...
+    """
+    def __init__(self):
+        self.totals = {}
+
+    def reset(self):
+        self.totals = {}
+
+    def add(self, phase, seconds):
+        self.totals[phase] = self.totals.get(phase, 0.) + seconds
+
+    def span(self, phase):
+        """Returns a context manager that adds the time spent in its
+        block to `phase`.
+        """
+        return _Span(self, phase)
+
+    def iterate(self, iterable, phase):
+        """Iterates over `iterable`, and adds the time spent waiting
+        for each item to `phase`.
+        """
+        iterator = iter(iterable)
+        while True:
+            t0 = time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(phase, time() - t0)
+                return
+            self.add(phase, time() - t0)
+            yield item
+
+    def durations(self, prefix='dur_'):
+        """Returns a dict that maps `prefix` plus the name of each
+        phase to its total time in seconds.
+        """
+        return dict((prefix + phase, seconds)
+                    for phase, seconds in self.totals.items())
@@ -1,4 +1,7 @@
 from functools import reduce
+import hashlib
+import inspect
+import numbers
 from operator import mul
 
 from lasagne.layers import Layer
@@ -6,6 +9,9 @@ from lasagne.layers import Conv2DLayer
 from lasagne.layers import MaxPool2DLayer
 import numpy as np
 from tabulate import tabulate
+import theano
+
+from .._compat import basestring
 
 convlayers = [Conv2DLayer]
 maxpoollayers = [MaxPool2DLayer]
@@ -174,3 +180,124 @@ def get_conv_infos(net, min_capacity=100. / 6, detailed=False):
                            receptive_fields.astype(int)))
 
     return tabulate(table, header, floatfmt='.2f')
+
+
+def _describe_function(func, depth):
+    if depth > 10:
+        raise ValueError(
+            "Can't describe {!r}, it refers to itself.".format(func))
+    closure = [cell.cell_contents for cell in func.__closure__ or ()]
+    return ('function', func.__module__, func.__name__,
+            _describe(func.__code__, depth),
+            _describe(func.__defaults__, depth + 1),
+            _describe(closure, depth + 1))
+
+
+def _describe_class(cls, depth):
+    methods = {}
+    for key, value in vars(cls).items():
+        if isinstance(value, (staticmethod, classmethod)):
+            value = value.__func__
+        if inspect.isfunction(value):
+            methods[key] = value
+    return ('class', cls.__module__, cls.__name__,
+            [_describe(base, depth) for base in cls.__bases__],
+            _describe(methods, depth))
+
+
+def _describe(value, depth=0):
+    """Returns a nested structure of plain values that describes
+    everything about `value` that goes into a compiled Theano graph.
+
+    Functions are described by their code, defaults and closure, and
+    classes by their methods, so that editing them changes the
+    description.  Raises :class:`ValueError` for callables that can't
+    be described this way.
+    """
+    if value is None or isinstance(
+            value, (numbers.Number, basestring, bytes)):
+        return value
+    if isinstance(value, (np.generic, np.dtype)):
+        return repr(value)
+    if isinstance(value, np.ndarray):
+        return ('array', value.shape, str(value.dtype),
+                hashlib.sha1(np.ascontiguousarray(value)).hexdigest())
+    if isinstance(value, (list, tuple)):
+        return [_describe(v, depth) for v in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted(repr(_describe(v, depth)) for v in value)
+    if isinstance(value, dict):
+        return sorted((repr(_describe(k, depth)), _describe(v, depth))
+                      for k, v in value.items())
+    if isinstance(value, Layer):
+        return ('layer', value.name)
+    if isinstance(value, theano.compile.SharedVariable):
+        return ('shared', str(value.type),
+                value.get_value(borrow=True, return_internal_type=True).shape)
+    if isinstance(value, theano.Variable):
+        return ('variable', str(value.type))
+    if isinstance(value, theano.gof.Op):
+        # Ops cache hashes of their attributes, which vary from one
+        # process to the next:
+        return ('op', _describe(type(value), depth), str(value))
+    if inspect.iscode(value):
+        return ('code', hashlib.sha1(value.co_code).hexdigest(),
+                value.co_names, _describe(value.co_consts, depth))
+    if inspect.isfunction(value):
+        return _describe_function(value, depth)
+    if inspect.ismethod(value):
+        return ('method', _describe(value.__self__, depth + 1),
+                _describe(value.__func__, depth))
+    if inspect.isclass(value):
+        return _describe_class(value, depth)
+    if hasattr(value, '__name__'):
+        # builtin functions and ufuncs
+        return ('name', getattr(value, '__module__', None), value.__name__)
+    if hasattr(value, 'func') and hasattr(value, 'keywords'):
+        # functools.partial
+        return ('partial', _describe(value.func, depth),
+                _describe(value.args, depth),
+                _describe(value.keywords, depth))
+    if depth < 3 and hasattr(value, '__dict__'):
+        return (_describe(type(value), depth),
+                _describe(vars(value), depth + 1))
+    if depth < 3 and callable(value):
+        raise ValueError("Can't describe {!r}.".format(value))
+    return (type(value).__module__, type(value).__name__)
+
+
+def graph_fingerprint(layers, *args):
+    """Returns a hex digest that identifies the computation graph of
+    `layers` along with any other objects passed in `args`, such as
+    objective and update parameters.  Parameter values are not part of
+    the fingerprint, only their types and shapes are.
+
+    Raises :class:`ValueError` if any of these can't be described,
+    e.g. a callable object without a `__dict__`.
+    """
+    description = []
+    for name, layer in layers.items():
+        attrs = dict(
+            (key, value) for key, value in vars(layer).items()
+            if key not in ('name', 'params'))
+        params = [(_describe(param), sorted(tags))
+                  for param, tags in layer.params.items()]
+        description.append((
+            name,
+            _describe(type(layer)),
+            _describe(layer.output_shape),
+            _describe(attrs),
+            params,
+            ))
+    description.append(_describe(args))
+    description.append((
+        theano.__version__,
+        theano.config.floatX,
+        theano.config.device,
+        theano.config.mode,
+        theano.config.optimizer,
+        theano.config.linker,
+        theano.config.optimizer_excluding,
+        theano.config.optimizer_including,
+        ))
+    return hashlib.sha1(repr(description).encode('utf-8')).hexdigest()
@@ -1,13 +1,9 @@
 from itertools import product
 import Image
 import lasagne.layers
-from lasagne.layers import get_output
-from lasagne.layers import get_output_shape
 import matplotlib.pyplot as plt
 import numpy as np
 import math
-import theano
-import theano.tensor as T
 
 def plot_loss(net):
     train_loss = [row['train_loss'] for row in net.train_history_]
@@ -78,30 +74,14 @@ def plot_conv_activity(net, layer0, fname, figsize=(6, 6), N = None):
 
     inLayers = [ layer for layer in net.layers_.values()
                        if isinstance( layer, lasagne.layers.InputLayer ) ]
-    layerL = []
-    tensorL = []
-    tensorDic = {}
-    for layer in inLayers:
-        lname = layer.name
-        lshape = layer.shape
-        layerL.append( lname )
-        print lshape
-        if len( lshape ) == 2:
-            tensorL.append( T.matrix( lname ) )
-        if len( lshape ) == 3:
-            tensorL.append( T.tensor3( lname ) )
-        if len( lshape ) == 4:
-            tensorL.append( T.tensor4( lname ) )
-        tensorDic[ net.layers_[lname] ] = tensorL[ -1 ]
-
-    # compile theano function
-    output = lasagne.layers.get_output( layer0, inputs = tensorDic )
-    get_activity = theano.function( tensorL, output, on_unused_input='warn' )
+
+    # compiled once per layer, see NeuralNet.get_layer_output_fn
+    get_activity = net.get_layer_output_fn( layer0 )
 
     valL = []
     for layer in inLayers:
-        valL.append( x[layer.name] )        
-    
+        valL.append( x[layer.name] )
+
     activity = get_activity( *valL )
     shape = activity.shape
     nrows = np.ceil(np.sqrt(shape[1])).astype(int)
@@ -146,7 +126,18 @@ def plot_conv_activity(net, layer0, fname, figsize=(6, 6), N = None):
                               interpolation='nearest')
 
 
-def occlusion_heatmap(net, x, target, square_length=7):
+def _occlusion_masks(positions, size, square_length):
+    """Returns a boolean array of shape `(len(positions), size)` that
+    is true where a square at each of `positions` occludes a row (or
+    column) of an image of `size` pixels.
+    """
+    start = positions[:, None] - (square_length // 2 + 1)
+    pixels = np.arange(size)[None, :]
+    return (pixels >= start) & (pixels < start + square_length)
+
+
+def occlusion_heatmap(net, x, target, square_length=7, stride=1,
+                      batch_size=256):
     """An occlusion test that checks an image for its critical parts.
 
     In this function, a square part of the image is occluded (i.e. set
@@ -155,13 +146,16 @@ def occlusion_heatmap(net, x, target, square_length=7):
     critical parts of the image are occluded. If not, this indicates
     overfitting.
 
-    Depending on the depth of the net and the size of the image, this
-    function may take awhile to finish, since one prediction for each
-    pixel of the image is made.
+    Occluded images are built in a preallocated buffer of
+    `batch_size` images at a time, by broadcasting the image against
+    the occlusion masks, and squares from several images share the
+    same batch.  Depending on the depth of the net and the size of the
+    image, this function may still take awhile to finish, since one
+    prediction is made for every `stride` pixels in both directions.
 
-    Currently, all color channels are occluded at the same time. Also,
-    this does not really work if images are randomly distorted by the
-    batch iterator.
+    Currently, all color channels are occluded at the same time. The
+    images are passed to `net.predict_iter_` as they are, without
+    going through the batch iterator.
 
     See paper: Zeiler, Fergus 2013
 
@@ -171,11 +165,11 @@ def occlusion_heatmap(net, x, target, square_length=7):
       The neural net to test.
 
     x : np.array
-      The input data, should be of shape (1, c, x, y). Only makes
+      The input data, should be of shape (b, c, x, y). Only makes
       sense with image data.
 
-    target : int
-      The true value of the image. If the net makes several
+    target : int or list of ints
+      The true value of each image. If the net makes several
       predictions, say 10 classes, this indicates which one to look
       at.
 
@@ -183,48 +177,78 @@ def occlusion_heatmap(net, x, target, square_length=7):
       The length of the side of the square that occludes the image.
       Must be an odd number.
 
+    stride : int (default=1)
+      Only occlude squares at every `stride` pixels.  The heat of the
+      squares in between is that of the nearest occluded square above
+      and to the left.
+
+    batch_size : int (default=256)
+      The number of occluded images to predict at a time.
+
     Results
     -------
     heat_array : np.array (with same size as image)
       An 2D np.array that at each point (i, j) contains the predicted
       probability of the correct class if the image is occluded by a
-      square with center (i, j).
+      square with center (i, j).  If `x` holds more than one image,
+      one such array per image, stacked along the first axis.
 
     """
-    if (x.ndim != 4) or x.shape[0] != 1:
+    if x.ndim != 4:
         raise ValueError("This function requires the input data to be of "
-                         "shape (1, c, x, y), instead got {}".format(x.shape))
+                         "shape (b, c, x, y), instead got {}".format(x.shape))
     if square_length % 2 == 0:
         raise ValueError("Square length has to be an odd number, instead "
                          "got {}.".format(square_length))
 
-    num_classes = get_output_shape(net.layers_[-1])[1]
-    img = x[0].copy()
-    bs, col, s0, s1 = x.shape
-
-    heat_array = np.zeros((s0, s1))
-    pad = square_length // 2 + 1
-    x_occluded = np.zeros((s1, col, s0, s1), dtype=img.dtype)
-    probs = np.zeros((s0, s1, num_classes))
-
-    # generate occluded images
-    for i in range(s0):
-        # batch s1 occluded images for faster prediction
-        for j in range(s1):
-            x_pad = np.pad(img, ((0, 0), (pad, pad), (pad, pad)), 'constant')
-            x_pad[:, i:i + square_length, j:j + square_length] = 0.
-            x_occluded[j] = x_pad[:, pad:-pad, pad:-pad]
-        y_proba = net.predict_proba(x_occluded)
-        probs[i] = y_proba.reshape(s1, num_classes)
-
-    # from predicted probabilities, pick only those of target class
-    for i in range(s0):
-        for j in range(s1):
-            heat_array[i, j] = probs[i, j, target]
+    num_images, col, s0, s1 = x.shape
+    targets = np.asarray(target).reshape(-1)
+    if len(targets) == 1:
+        targets = np.repeat(targets, num_images)
+    rows = np.arange(0, s0, stride)
+    cols = np.arange(0, s1, stride)
+    row_masks = _occlusion_masks(rows, s0, square_length)
+    col_masks = _occlusion_masks(cols, s1, square_length)
+
+    # One entry per occluded image, for all images at once:
+    n_squares = len(rows) * len(cols)
+    image_index = np.repeat(np.arange(num_images), n_squares)
+    row_index = np.tile(np.repeat(np.arange(len(rows)), len(cols)),
+                        num_images)
+    col_index = np.tile(np.arange(len(cols)), num_images * len(rows))
+
+    batch_size = min(batch_size, len(image_index))
+    x_occluded = np.empty((batch_size, col, s0, s1), dtype=x.dtype)
+    keep = np.empty((batch_size, s0, s1), dtype=bool)
+    heat = np.empty(len(image_index))
+
+    for start in range(0, len(image_index), batch_size):
+        sl = slice(start, start + batch_size)
+        images = image_index[sl]
+        n = len(images)
+        np.logical_and(row_masks[row_index[sl]][:, :, None],
+                       col_masks[col_index[sl]][:, None, :], out=keep[:n])
+        np.logical_not(keep[:n], out=keep[:n])
+        # Broadcast each image against its run of masks in the batch:
+        edges = np.concatenate(
+            ([0], np.flatnonzero(np.diff(images)) + 1, [n]))
+        for a, b in zip(edges[:-1], edges[1:]):
+            np.multiply(x[images[a]], keep[a:b, None],
+                        out=x_occluded[a:b])
+        probs = net.apply_batch_func(net.predict_iter_, x_occluded[:n])
+        probs = np.asarray(probs).reshape(n, -1)
+        heat[sl] = probs[np.arange(n), targets[images]]
+
+    heat_array = heat.reshape(num_images, len(rows), len(cols))
+    heat_array = np.repeat(np.repeat(heat_array, stride, axis=1),
+                           stride, axis=2)[:, :s0, :s1]
+    if num_images == 1:
+        return heat_array[0]
     return heat_array
 
 
-def plot_occlusion(net, X, target, square_length=7, figsize=(9, None)):
+def plot_occlusion(net, X, target, square_length=7, figsize=(9, None),
+                   stride=1):
     """Plot which parts of an image are particularly import for the
     net to classify the image correctly.
 
@@ -252,6 +276,9 @@ def plot_occlusion(net, X, target, square_length=7, figsize=(9, None)):
     figsize : tuple (int, int)
       Size of the figure.
 
+    stride : int (default=1)
+      Passed on to :func:`occlusion_heatmap`.
+
     Plots
     -----
     Figure with 3 subplots: the original image, the occlusion heatmap,
@@ -272,10 +299,12 @@ def plot_occlusion(net, X, target, square_length=7, figsize=(9, None)):
         ax.set_yticks([])
         ax.axis('off')
 
+    heat_imgs = occlusion_heatmap(
+        net, X, target, square_length, stride=stride
+    ).reshape(num_images, X.shape[2], X.shape[3])
+
     for n in range(num_images):
-        heat_img = occlusion_heatmap(
-            net, X[n:n + 1, :, :, :], target[n], square_length
-        )
+        heat_img = heat_imgs[n]
 
         ax = axes if num_images == 1 else axes[n]
         img = X[n, :, :, :].mean(0)
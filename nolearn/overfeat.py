@@ -17,12 +17,12 @@ def _overfeat_cache_key(self, images):
         raise cache.DontCache
     if isinstance(images[0], Image.Image):
         images = [im.filename for im in images]
-    return ','.join([
-        str(images),
-        str(self.feature_layer),
-        str(self.network_size),
-        str(self.pretrained_params),
-        ])
+    return cache.structural_hash((
+        images,
+        self.feature_layer,
+        self.network_size,
+        self.pretrained_params,
+        ))
 
 
 class OverFeatShell(ChunkedTransform, BaseEstimator):
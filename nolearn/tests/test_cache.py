@@ -1,4 +1,10 @@
+import itertools
+import os
+import time
+
 from mock import patch
+import numpy as np
+import pytest
 
 
 def test_cached(tmpdir):
@@ -18,6 +24,11 @@ def test_cached(tmpdir):
     assert add(2, 4) == 6
     assert len(called) == 2
 
+    # File names hold the whole hash of the key, so they don't collide:
+    names = [path.basename for path in tmpdir.listdir()
+             if '-cache-' in path.basename]
+    assert [len(name.rsplit('-', 1)[1]) for name in names] == [40, 40]
+
 
 def test_cache_with_cache_key(tmpdir):
     from ..cache import cached
@@ -50,3 +61,282 @@ def test_cache_systemerror(tmpdir):
     with patch('nolearn.cache.numpy_pickle.dump') as dump:
         dump.side_effect = SystemError()
         assert add(2, 3) == 5
+
+
+def test_cached_large_arrays(tmpdir):
+    from ..cache import cached
+
+    called = []
+
+    @cached(cache_path=str(tmpdir))
+    def total(X):
+        called.append(X)
+        return X.sum()
+
+    X1 = np.zeros((2000, 10))
+    X2 = X1.copy()
+    X2[1000, 5] = 1
+    assert str(X1) == str(X2)
+    assert total(X1) == 0
+    assert total(X2) == 1
+    assert total(X1.copy()) == 0
+    assert len(called) == 2
+
+
+class TestStructuralHash:
+    def hash(self, *args, **kwargs):
+        from ..cache import structural_hash
+        return structural_hash(*args, **kwargs)
+
+    def test_arrays(self):
+        X = np.arange(20.).reshape(4, 5)
+        assert self.hash(X) == self.hash(X.copy())
+        assert self.hash(X) != self.hash(X.astype(np.float32))
+        assert self.hash(X) != self.hash(X.reshape(5, 4))
+        assert self.hash(X.T) == self.hash(np.ascontiguousarray(X.T))
+        assert self.hash(X[:, ::2]) == self.hash(X[:, ::2].copy())
+
+    def test_object_arrays(self):
+        X = np.array(['a.jpg', 'b.jpg'], dtype=object)
+        assert self.hash(X) == self.hash(X.copy())
+        assert self.hash(X) != self.hash(X[::-1])
+
+    def test_max_bytes(self):
+        X1 = np.zeros((100, 10))
+        X2 = X1.copy()
+        X2[1] = 1
+        assert self.hash(X1) != self.hash(X2)
+        assert self.hash(X1, max_bytes=800) == self.hash(X2, max_bytes=800)
+        assert self.hash(X1, max_bytes=800) != self.hash(
+            X1[:99], max_bytes=800)
+
+    def test_containers(self):
+        assert self.hash(['ab', 'c']) != self.hash(['a', 'bc'])
+        assert self.hash([1, 2]) != self.hash([[1, 2]])
+        assert self.hash({'a': 1, 'b': 2}) == self.hash({'b': 2, 'a': 1})
+        assert self.hash({'a': 1}) != self.hash({'a': 2})
+        assert self.hash((1, None)) != self.hash((1, 'None'))
+
+    def test_scalars(self):
+        assert self.hash(1) != self.hash(1.0)
+        assert self.hash(np.float32(1)) != self.hash(np.float64(1))
+        assert self.hash(u'abc') == self.hash('abc')
+
+    def test_default_cache_key(self):
+        from ..cache import default_cache_key
+        assert default_cache_key(1, 2) != default_cache_key(2, 1)
+        assert default_cache_key(1, b=2) == default_cache_key(1, b=2)
+        assert default_cache_key(1, b=2) != default_cache_key(1, c=2)
+
+
+class TestCacheDir:
+    @pytest.fixture
+    def CacheDir(self):
+        from ..cache import CacheDir
+        return CacheDir
+
+    def write(self, tmpdir, name, size, mtime=None):
+        path = tmpdir.join('mod.func-cache-' + name)
+        path.write(b'x' * size, mode='wb')
+        if mtime is not None:
+            os.utime(str(path), (mtime, mtime))
+        return str(path)
+
+    def test_stats(self, tmpdir):
+        from ..cache import cache_dir
+        from ..cache import cached
+
+        @cached(cache_path=str(tmpdir))
+        def add(one, two):
+            return one + two
+
+        add(2, 3)
+        add(2, 3)
+        add(2, 3)
+        add(2, 4)
+        stats = cache_dir(str(tmpdir)).stats()
+        assert stats['hits'] == 2
+        assert stats['misses'] == 2
+        assert stats['n_entries'] == 2
+        assert stats['bytes'] == stats['bytes_written'] > 0
+        assert stats['hit_rate'] == 0.5
+        assert tmpdir.join('index.json').check()
+
+    def test_unknown_files_are_indexed(self, CacheDir, tmpdir):
+        self.write(tmpdir, 'a', 10)
+        self.write(tmpdir, 'b', 20)
+        tmpdir.join('other.txt').write('hi')
+        stats = CacheDir(str(tmpdir)).stats()
+        assert stats['n_entries'] == 2
+        assert stats['bytes'] == 30
+
+    def test_max_bytes_lru(self, CacheDir, tmpdir):
+        directory = CacheDir(str(tmpdir), max_bytes=25, flush_every=1)
+        with patch('nolearn.cache.time', side_effect=itertools.count()):
+            a = self.write(tmpdir, 'a', 10)
+            directory.add(a)
+            b = self.write(tmpdir, 'b', 10)
+            directory.add(b)
+            directory.hit(a)
+            c = self.write(tmpdir, 'c', 10)
+            directory.add(c)
+        assert os.path.exists(a)
+        assert not os.path.exists(b)
+        assert os.path.exists(c)
+        assert directory.stats()['evictions'] == 1
+
+    def test_max_bytes_age(self, CacheDir, tmpdir):
+        directory = CacheDir(
+            str(tmpdir), max_bytes=25, policy='age', flush_every=1)
+        with patch('nolearn.cache.time', side_effect=itertools.count()):
+            a = self.write(tmpdir, 'a', 10)
+            directory.add(a)
+            b = self.write(tmpdir, 'b', 10)
+            directory.add(b)
+            directory.hit(a)
+            c = self.write(tmpdir, 'c', 10)
+            directory.add(c)
+        assert not os.path.exists(a)
+        assert os.path.exists(b)
+
+    def test_max_bytes_kept_when_adding(self, CacheDir, tmpdir):
+        directory = CacheDir(str(tmpdir), max_bytes=25)
+        with patch('nolearn.cache.time', side_effect=itertools.count()):
+            for name in 'abc':
+                directory.add(self.write(tmpdir, name, 10))
+            assert not tmpdir.join('mod.func-cache-a').check()
+            directory.hit(str(tmpdir.join('mod.func-cache-b')))
+        assert directory._n_pending == 1
+
+    def test_prune(self, CacheDir, tmpdir):
+        now = time.time()
+        self.write(tmpdir, '0001', 10, mtime=now - 3600)
+        self.write(tmpdir, '0002', 10, mtime=now - 60)
+        self.write(tmpdir, '0003', 10, mtime=now)
+        directory = CacheDir(str(tmpdir))
+        assert directory.prune(max_age=600) == ['mod.func-cache-0001']
+        assert directory.prune(max_bytes=15) == ['mod.func-cache-0002']
+        assert directory.prune() == []
+        assert directory.stats()['n_entries'] == 1
+
+    def test_updates_are_batched(self, CacheDir, tmpdir):
+        directory = CacheDir(str(tmpdir), flush_every=3)
+        a = self.write(tmpdir, 'a', 10)
+        with patch.object(directory, '_list') as list_:
+            directory.add(a, [os.path.basename(a)])
+        assert list_.call_count == 0
+        directory.hit(a)
+        assert not tmpdir.join('index.json').check()
+        directory.miss(a)
+        assert tmpdir.join('index.json').check()
+
+        directory.hit(a)
+        stats = directory.stats()
+        assert stats['hits'] == 2
+        assert stats['bytes_read'] == 20
+
+    def test_concurrent_updates_are_merged(self, CacheDir, tmpdir):
+        directory1 = CacheDir(str(tmpdir))
+        directory2 = CacheDir(str(tmpdir))
+        a = self.write(tmpdir, 'a', 10)
+        directory1.add(a)
+        directory1.hit(a)
+        directory2.miss(a)
+        directory2.hit(a)
+        directory1.flush()
+        directory2.flush()
+        stats = directory1.stats()
+        assert stats['hits'] == 2
+        assert stats['misses'] == 1
+        assert stats['bytes_read'] == 20
+
+    def test_max_age_on_lookup(self, tmpdir):
+        from ..cache import cache_dir
+        from ..cache import cached
+
+        called = []
+
+        @cached(cache_path=str(tmpdir))
+        def add(one, two):
+            called.append([one, two])
+            return one + two
+
+        add(2, 3)
+        directory = cache_dir(str(tmpdir))
+        directory.max_age = 600
+        add(2, 3)
+        assert len(called) == 1
+        for path in tmpdir.listdir():
+            os.utime(str(path), (time.time() - 3600, time.time() - 3600))
+        add(2, 3)
+        assert len(called) == 2
+        assert directory.stats()['misses'] == 2
+
+    def test_unknown_policy(self, CacheDir, tmpdir):
+        with pytest.raises(ValueError):
+            CacheDir(str(tmpdir), policy='random')
+
+    def test_evicted_while_reading(self, tmpdir):
+        from ..cache import cached
+
+        called = []
+
+        @cached(cache_path=str(tmpdir))
+        def add(one, two):
+            called.append([one, two])
+            return one + two
+
+        add(2, 3)
+        with patch('nolearn.cache.numpy_pickle.load') as load:
+            load.side_effect = IOError()
+            assert add(2, 3) == 5
+        assert len(called) == 2
+
+
+def test_cached_mmap_mode(tmpdir):
+    from ..cache import cached
+
+    called = []
+
+    @cached(cache_path=str(tmpdir), compress=0, mmap_mode='r')
+    def features(n):
+        called.append(n)
+        return np.arange(n * 1000.).reshape(n, 1000)
+
+    X = features(3)
+    assert not isinstance(X, np.memmap)
+    X2 = features(3)
+    assert len(called) == 1
+    assert isinstance(X2, np.memmap)
+    assert X2.mode == 'r'
+    assert (X2 == X).all()
+    assert not [name for name in os.listdir(str(tmpdir))
+                if name.endswith('.tmp')]
+
+
+def test_cached_compress(tmpdir):
+    from ..cache import cached
+
+    @cached(cache_path=str(tmpdir), compress=3)
+    def features(n):
+        return np.zeros((n, 1000))
+
+    with patch('nolearn.cache.numpy_pickle.dump') as dump:
+        features(3)
+    assert dump.call_args[1]['compress'] == 3
+
+
+def test_cache_dir_companion_files(tmpdir):
+    from ..cache import CacheDir
+
+    tmpdir.join('mod.func-cache-0001').write(b'x' * 10, mode='wb')
+    tmpdir.join('mod.func-cache-0001_01.npy').write(b'x' * 20, mode='wb')
+    tmpdir.join('mod.func-cache-0002').write(b'x' * 10, mode='wb')
+    directory = CacheDir(str(tmpdir))
+    stats = directory.stats()
+    assert stats['n_entries'] == 2
+    assert stats['bytes'] == 40
+
+    directory.prune(max_bytes=15)
+    assert sorted(os.listdir(str(tmpdir))) == [
+        'index.json', 'mod.func-cache-0002']